@@ -0,0 +1,58 @@
+import os
+import pickle
+import hashlib
+
+# Bump when a change to the interpreter gives existing trees a different meaning
+INTERPRETER_VERSION = 1
+# Bump whenever the grammar or the AST classes in csparser.py change
+GRAMMAR_VERSION = 13
+
+CACHE_DIR = '__cscache__'
+
+
+def source_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(file_path):
+    directory, file_name = os.path.split(file_path)
+    return os.path.join(directory, CACHE_DIR, file_name + '.pickle')
+
+
+def cache_key(hash):
+    return (hash, INTERPRETER_VERSION, GRAMMAR_VERSION)
+
+
+def load(file_path, hash):
+    """Returns the (program, imports) cached for file_path, or None if there is no valid entry."""
+    try:
+        with open(cache_path(file_path), 'rb') as file:
+            if pickle.load(file) != cache_key(hash):
+                return None
+            return pickle.load(file)
+    except Exception:
+        return None
+
+
+def store(file_path, hash, program, imports):
+    """Saves program and its imports for file_path. Returns whether the entry was written."""
+    path = cache_path(file_path)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            pickle.dump(cache_key(hash), file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump((program, imports), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        return True
+    except (OSError, RecursionError, pickle.PicklingError):
+        # The cache is only an optimisation, a tree that cannot be stored is parsed again next run
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,479 @@
+import gc
+import io
+import os
+import sys
+import time
+import contextlib
+import shutil
+import tempfile
+import tracemalloc
+
+from cstoken import *
+from lexer import *
+from csparser import *
+from semantic_analyzer import *
+from interpreter import *
+from vm import VirtualMachine
+from closures import ClosureInterpreter
+from transpiler import TranspiledInterpreter
+from optimizer import Optimizer
+import import_graph
+
+# Compared against the tree walking Interpreter
+ENGINES = {'vm': VirtualMachine, 'closures': ClosureInterpreter, 'python': TranspiledInterpreter}
+
+# Example scripts that run without asking for input
+EXAMPLE_SCRIPTS = ['countdown', 'function_auth', 'macro_auth', 'helloworld']
+
+
+def generate_script(statement_count):
+    statements = [
+        '{"John": "Admin", "Joe": "User"}',
+        '1||"Admin":\n    ? m.0[m0] = m1:\n        r<T>\n    ;,\n    r<F>\n;',
+    ]
+    for i in range(statement_count):
+        statements.append(
+            f'# generated block {i} #\n'
+            f'[{i}, {i}.5, "str {i}", \'q\\\'{i}\', T, F, X],\n'
+            f'?? m{i % 3} <\\ {i} & m.0 >= 2 | !<m1 != 3>:\n'
+            f'    s.{i % 3} => m.{i % 2} ** 2 // 3 + `f {{m0}} {i}` * 4 - 1,\n'
+            f'    p<l<m.2>, ci<"{i}">, m.1<m0>>\n'
+            f';'
+        )
+    return ',\n'.join(statements)
+
+
+def generate_loop_script(iterations):
+    return f'''
+0,
+[],
+1||2:
+    r<m0 * m1 + 1>
+;,
+"",
+>1:
+    s..3 => `{{k0}}-{{l<m..1>}}`
+;,
+?/ {iterations}:
+    s.0 + m.2<m0> - m0,
+    ? m0 % 7 = 0:
+        m..1.a<m.0>
+    ;e? m0 % 5 = 0:
+        s..0 - 1
+    ;,
+    0,
+    ?? m1 <\\ 3:
+        s.1++
+    ;,
+    ? m0 % 11 = 0:
+        X => m..4<m.0>
+    ;
+;
+'''
+
+
+def generate_nested_script(iterations):
+    # Loops nested inside a function, reaching out to variables a few scopes up
+    return f'''
+0,
+1:
+    0,
+    ?/ m0:
+        ?/ 20:
+            ? m0 % 2 = 0:
+                s...1 + m...0 + m..0 + m.0,
+                s....0 + 1
+            ;
+        ;
+    ;,
+    r<m0>
+;,
+m1<{iterations}>
+'''
+
+
+def generate_variables_script(count):
+    # Scalars out of the small int range, so each one is a value of its own
+    return ',\n'.join(str(1000 + i) for i in range(count))
+
+
+def generate_reads_script(iterations, variable_count=10):
+    reads = ' + '.join(f'm.{i}' for i in range(variable_count))
+    return ',\n'.join([str(i) for i in range(variable_count)] + [f'?/ {iterations}:\n    {reads}\n;'])
+
+
+def generate_constants_script(iterations):
+    return f'''
+60 * 60 * 24,
+1:
+    7,
+    r<m.0 * m0 + `{{"x" * 3}}-{{2 ** 8}}`.l>
+;,
+0,
+?/ {iterations}:
+    s.2 + m.1<m0 % 60> + 1000 // 7 * m.0 - 3600 * 24,
+    ? !<1 = 2> & m0 >\\ -1:
+        "ab" + "cd"
+    ;
+;
+'''
+
+
+def generate_invariant_script(iterations):
+    return f'''
+[3, 1, 4, 1, 5, 9, 2, 6],
+"commascript",
+0,
+?/ {iterations}:
+    s.2 + m0 % l<m.0> * l<m.1> + mx<m.0> - mn<m.0>,
+    ? m0 >\\ l<m.1.up> * 100:
+        s.2 - 1
+    ;
+;
+'''
+
+
+def generate_macro_script(iterations):
+    return f'''
+{{"John": "Admin", "Joe": "User", "Fred": "User", "Billy": "Admin", "Bob": "User"}},
+>||"Admin":
+    ? m.0[m0] != k0:
+        r<"Access Denied">
+    ;
+;,
+1:
+    m.1,
+    r<"Access Granted">
+;,
+["John", "Joe", "Fred", "Billy", "Bob"],
+0,
+?/ {iterations}:
+    ? m.2<m.3[m0 % 5]> = "Access Granted":
+        s..4 + 1
+    ;
+;
+'''
+
+
+def generate_fib_script(n):
+    # Functions can only call themselves through a reference passed to them
+    return f'''
+2:
+    ? m0 <\\ 2:
+        r<m.0>
+    ;,
+    r<m1<m0 - 1, ~m1> + m1<m0 - 2, ~m1>>
+;,
+m0<{n}, ~m0>
+'''
+
+
+def generate_ackermann_script(m, n):
+    return f'''
+3:
+    ? m0 = 0:
+        r<m.1 + 1>
+    ;,
+    ? m1 = 0:
+        r<m.2<m.0 - 1, 1, ~m.2>>
+    ;,
+    r<m2<m0 - 1, m2<m0, m1 - 1, ~m2>, ~m2>>
+;,
+m0<{m}, {n}, ~m0>
+'''
+
+
+def generate_sum_script(depth):
+    # Not a tail call, so every level stays on the call stack
+    return f'''
+2:
+    ? m0 = 0:
+        r<0>
+    ;,
+    r<m0 + m1<m0 - 1, ~m1>>
+;,
+m0<{depth}, ~m0>
+'''
+
+
+def generate_module(statement_count):
+    statements = ['0', '1||2:\n    r<m0 * m1 + 1>\n;']
+    for i in range(statement_count):
+        statements.append(
+            f'[{i}, "str {i}", T, X],\n'
+            f'? m0 <\\ {i} & !<m0 != 3>:\n'
+            f'    s.0 => m.1<m.0, {i}> ** 2 // 3 + 1,\n'
+            f'    X => `f {{m.0}} {i}` * 4\n'
+            f';'
+        )
+    return ',\n'.join(statements)
+
+
+def parse_text(text, file_path):
+    Parser.imported_files.clear()
+    parser = Parser(Lexer(text), file_path)
+    return parser.parse()
+
+
+def benchmark_lexer(size, repeat=3):
+    text = generate_script(size)
+    best = None
+    for _ in range(repeat):
+        lexer = Lexer(text)
+        token_count = 0
+        start = time.perf_counter()
+        while lexer.get_next_token().type != TokenType.EOF:
+            token_count += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"lexer: {len(text):,} chars, {token_count:,} tokens in {best:.3f}s "
+          f"({token_count / best:,.0f} tokens/sec)")
+
+
+def benchmark_token_memory(size):
+    text = generate_script(size)
+    lexer = Lexer(text)
+    tokens = []
+    gc.collect()
+    tracemalloc.start()
+    while True:
+        token = lexer.get_next_token()
+        tokens.append(token)
+        if token.type == TokenType.EOF:
+            break
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"tokens: {len(tokens):,} tokens held in {size:,} bytes "
+          f"({size / len(tokens):.1f} bytes/token)")
+
+
+def benchmark_parser(size, repeat=3):
+    text = generate_script(size)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_text(text, "<parser benchmark>")
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"parser: {len(text):,} chars parsed in {best:.3f}s ({len(text) / best:,.0f} chars/sec)")
+
+
+def benchmark_ast_memory(size):
+    text = generate_script(size)
+    gc.collect()
+    tracemalloc.start()
+    tree = parse_text(text, "<ast benchmark>")
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"ast: {len(text):,} chars parsed into {size:,} bytes")
+
+
+def time_interpreter(text, repeat, engine=Interpreter, file_path="<interpreter benchmark>", runs=1):
+    tree = parse_text(text, file_path)
+    SemanticAnalyzer(file_path).visit(tree)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(runs):
+            Memory.imported_scopes.clear()
+            engine(file_path).visit(tree)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_interpreter(size, repeat=3):
+    iterations = size * 2
+    best = time_interpreter(generate_loop_script(iterations), repeat)
+    print(f"interpreter: {iterations:,} loop iterations in {best:.3f}s "
+          f"({iterations / best:,.0f} iterations/sec)")
+
+
+def benchmark_frames(size, repeat=3):
+    file_path = "<frames benchmark>"
+    tree = parse_text(generate_variables_script(size), file_path)
+    SemanticAnalyzer(file_path).visit(tree)
+    Memory.imported_scopes.clear()
+    gc.collect()
+    tracemalloc.start()
+    # The global scope stays in Memory.imported_scopes after the run
+    Interpreter(file_path).visit(tree)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    Memory.imported_scopes.clear()
+    print(f"frames: {size:,} variables held in {held:,} bytes ({held / size:.1f} bytes/variable)")
+
+    iterations = size * 2
+    reads = iterations * 10
+    best = time_interpreter(generate_reads_script(iterations), repeat)
+    print(f"frames: {reads:,} variable reads in {best:.3f}s ({reads / best:,.0f} reads/sec)")
+
+
+def benchmark_nested(size, repeat=3):
+    iterations = size * 2
+    best = time_interpreter(generate_nested_script(iterations // 20), repeat)
+    print(f"nested: {iterations:,} nested loop iterations in {best:.3f}s "
+          f"({iterations / best:,.0f} iterations/sec)")
+
+
+def benchmark_visits(size, depth=300, repeat=3):
+    # A left leaning chain of BinOps, as deep as the tree walker's recursion allows
+    file_path = "<visit benchmark>"
+    tree = parse_text(' + '.join(['1'] * depth), file_path)
+    SemanticAnalyzer(file_path).visit(tree)
+    expr = tree.statement_list_node.children[0].value
+    node_count = 2 * depth - 1
+    runs = max(size // 50, 1)
+    for name, visitor in (("semantic analyzer", SemanticAnalyzer(file_path)),
+                          ("interpreter", Interpreter(file_path))):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(runs):
+                visitor.visit(expr)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"visits: {runs * node_count:,} {name} visits of a {depth} deep expression in {best:.3f}s "
+              f"({runs * node_count / best:,.0f} visits/sec)")
+
+
+def benchmark_recursion(size, repeat=3):
+    runs = max(size // 1000, 1)
+    for name, text in (("fib<18>", generate_fib_script(18)),
+                       ("ackermann<2, 30>", generate_ackermann_script(2, 30))):
+        tree_walker = time_interpreter(text, repeat, runs=runs)
+        for engine_name, engine in ENGINES.items():
+            best = time_interpreter(text, repeat, engine, runs=runs)
+            print(f"recursion: {name} run {runs:,} times in {best:.3f}s by {engine_name}, "
+                  f"tree walker {tree_walker:.3f}s ({tree_walker / best:.2f}x)")
+    # Far deeper than any engine using the python stack for calls can go
+    depth = size * 20
+    best = time_interpreter(generate_sum_script(depth), repeat, VirtualMachine)
+    print(f"recursion: {depth:,} nested calls in {best:.3f}s by vm ({depth / best:,.0f} calls/sec)")
+
+
+def benchmark_memoize(size, repeat=3):
+    file_path = "<memoize benchmark>"
+    n = 20
+    tree = parse_text(generate_fib_script(n), file_path)
+    SemanticAnalyzer(file_path).visit(tree)
+    for memo_size in (None, DEFAULT_MEMO_SIZE, 4):
+        best = None
+        for _ in range(repeat):
+            Memory.imported_scopes.clear()
+            interpreter = VirtualMachine(file_path, memo_size=memo_size)
+            start = time.perf_counter()
+            interpreter.visit(tree)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        stats = ", ".join(f"{cache.hits:,} hits, {cache.misses:,} misses" for cache in interpreter.memo_caches.values())
+        print(f"memoize: fib<{n}> in {best:.4f}s by vm "
+              f"{'without memoizing' if memo_size is None else f'keeping {memo_size} results ({stats})'}")
+
+
+def benchmark_optimizer(size, repeat=3):
+    file_path = "<optimizer benchmark>"
+    iterations = size * 2
+    for name, text in (("constants", generate_constants_script(iterations)),
+                       ("invariants", generate_invariant_script(iterations)),
+                       ("macros", generate_macro_script(iterations))):
+        for engine_name, engine in dict(tree=Interpreter, **ENGINES).items():
+            optimize_and_time(name, text, file_path, iterations, engine_name, engine, repeat)
+
+
+def optimize_and_time(name, text, file_path, iterations, engine_name, engine, repeat):
+    times = []
+    for optimize in (False, True):
+        tree = parse_text(text, file_path)
+        semantic_analyzer = SemanticAnalyzer(file_path)
+        semantic_analyzer.visit(tree)
+        if optimize:
+            Optimizer(semantic_analyzer).optimize(tree)
+        best = None
+        for _ in range(repeat):
+            Memory.imported_scopes.clear()
+            start = time.perf_counter()
+            engine(file_path).visit(tree)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    print(f"optimizer ({name}): {iterations:,} iterations in {times[1]:.3f}s by {engine_name} optimized, "
+          f"{times[0]:.3f}s as written ({times[0] / times[1]:.2f}x)")
+
+
+def benchmark_engines(size, repeat=3):
+    iterations = size * 2
+    for name, text in (("loop", generate_loop_script(iterations)),
+                       ("nested loop", generate_nested_script(iterations // 20))):
+        tree_walker = time_interpreter(text, repeat)
+        for engine_name, engine in ENGINES.items():
+            best = time_interpreter(text, repeat, engine)
+            print(f"engines: {iterations:,} {name} iterations in {best:.3f}s by {engine_name}, "
+                  f"tree walker {tree_walker:.3f}s ({tree_walker / best:.2f}x)")
+
+
+def benchmark_examples(size, repeat=3):
+    runs = max(size // 50, 1)
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example_scripts")
+    for name in EXAMPLE_SCRIPTS:
+        file_path = os.path.join(directory, name + ".cscr")
+        with open(file_path) as file:
+            text = file.read()
+        # The scripts print, which would otherwise drown out the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            tree_walker = time_interpreter(text, repeat, Interpreter, file_path, runs)
+            times = {engine_name: time_interpreter(text, repeat, engine, file_path, runs)
+                     for engine_name, engine in ENGINES.items()}
+        for engine_name, best in times.items():
+            print(f"examples: {name} run {runs:,} times in {best:.3f}s by {engine_name}, "
+                  f"tree walker {tree_walker:.3f}s ({tree_walker / best:.2f}x)")
+
+
+def benchmark_imports(size, module_count=8):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"module{i}") for i in range(module_count)]
+        for path in paths:
+            with open(path + ".cscr", "w") as file:
+                file.write(generate_module(size // module_count))
+        file_path = os.path.join(directory, "main.cscr")
+        with open(file_path, "w") as file:
+            file.write(',\n'.join(f'@"{path}"' for path in paths))
+
+        for jobs in (None, os.cpu_count()):
+            shutil.rmtree(os.path.join(directory, ast_cache.CACHE_DIR), ignore_errors=True)
+            Parser.imported_files.clear()
+            ScopedSymbolTable.imported_scopes.clear()
+            start = time.perf_counter()
+            tree = import_graph.build(file_path, jobs) if jobs else Parser.parse_file(file_path)
+            SemanticAnalyzer(file_path).visit(tree)
+            elapsed = time.perf_counter() - start
+            print(f"imports: {module_count} modules parsed and analyzed cold "
+                  f"{f'with {jobs} jobs' if jobs else 'sequentially'} in {elapsed:.3f}s")
+
+
+BENCHMARKS = {
+    'lexer': benchmark_lexer,
+    'tokens': benchmark_token_memory,
+    'parser': benchmark_parser,
+    'ast': benchmark_ast_memory,
+    'interpreter': benchmark_interpreter,
+    'nested': benchmark_nested,
+    'frames': benchmark_frames,
+    'visits': benchmark_visits,
+    'recursion': benchmark_recursion,
+    'memoize': benchmark_memoize,
+    'optimizer': benchmark_optimizer,
+    'engines': benchmark_engines,
+    'examples': benchmark_examples,
+    'imports': benchmark_imports,
+}
+
+
+if __name__ == "__main__":
+    names = [arg for arg in sys.argv[1:] if not arg.isdigit()] or list(BENCHMARKS)
+    sizes = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark {name}, expected one of: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name](sizes[0] if sizes else 5000)
@@ -1,8 +1,12 @@
+import sys
+import ast
 import random
 import codecs
 import io
 import time
-from inspect import isfunction
+import inspect
+import builtins
+from inspect import isfunction, signature
 
 from error import *
 
@@ -282,3 +286,84 @@ def cs_sp(self, token, string, sep=None, maxsplit=-1):
 def cs_jn(self, token, collection, sep=" "):
     argument_validation(self, token, "join", (collection, sep), (list, str))
     return sep.join([str(ele) for ele in collection])
+
+
+class BuiltIn():
+    """A cs_ function along with what the parser and interpreter need to know about it."""
+
+    def __init__(self, name, function, min_args, max_args, returns_value, arg_types, pure):
+        self.name = name
+        self.function = function
+        self.min_args = min_args
+        # None when the function takes any number of arguments
+        self.max_args = max_args
+        self.returns_value = returns_value
+        # Parameter name -> the types argument_validation accepts for it
+        self.arg_types = arg_types
+        # Whether the function's result only depends on its arguments, without any side effects
+        self.pure = pure
+
+    def __str__(self):
+        return f"<BuiltIn(name = {self.name}, args = {self.min_args}..{self.max_args}, returns_value = {self.returns_value})>"
+
+    __repr__ = __str__
+
+    def __reduce__(self):
+        # Trees hold on to entries, which are looked up again by name when a cached tree is loaded
+        return (get_built_in, (self.name,))
+
+
+def get_built_in(name):
+    return BUILT_INS.get(name.lower())
+
+
+def _resolve_types(node):
+    if isinstance(node, ast.Tuple):
+        return tuple(_resolve_types(element) for element in node.elts)
+    return getattr(builtins, node.id)
+
+
+def _validated_arg_types(function_node):
+    arg_types = {}
+    for node in ast.walk(function_node):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'argument_validation':
+            args, valid_types = node.args[3], node.args[4]
+            for arg, types in zip(args.elts, valid_types.elts):
+                if isinstance(arg, ast.Name):
+                    arg_types[arg.id] = _resolve_types(types)
+    return arg_types
+
+
+# Built-ins that print, read input or files, wait or are random
+IMPURE_BUILT_INS = {'p', 'i', 'rnd', 'lrnd', 'wf', 'rf', 'slp'}
+# Built-ins that change the collection they're given
+MUTATING_BUILT_INS = {'a', 'rm', 'rmv', 'pop', 'srt'}
+
+
+def _build_built_ins():
+    # The module's source is parsed once here rather than for every call the parser comes across
+    function_nodes = {
+        node.name: node
+        for node in ast.parse(inspect.getsource(sys.modules[__name__])).body
+        if isinstance(node, ast.FunctionDef) and node.name.startswith('cs_')
+    }
+    built_ins = {}
+    for function_name, function_node in function_nodes.items():
+        function = globals()[function_name]
+        parameters = list(signature(function).parameters.values())[2:]
+        variadic = any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters)
+        name = function_name[len('cs_'):]
+        built_ins[name] = BuiltIn(
+            name=name,
+            function=function,
+            min_args=sum(1 for parameter in parameters
+                         if parameter.default is parameter.empty and parameter.kind != parameter.VAR_POSITIONAL),
+            max_args=None if variadic else len(parameters),
+            returns_value=any(isinstance(node, ast.Return) for node in ast.walk(function_node)),
+            arg_types=_validated_arg_types(function_node),
+            pure=name not in IMPURE_BUILT_INS
+        )
+    return built_ins
+
+
+BUILT_INS = _build_built_ins()
@@ -0,0 +1,135 @@
+import io
+import sys
+import contextlib
+
+from lexer import *
+from csparser import *
+from semantic_analyzer import *
+from interpreter import *
+from vm import VirtualMachine
+from closures import ClosureInterpreter
+from transpiler import TranspiledInterpreter
+from optimizer import Optimizer
+
+ENGINES = {'tree': Interpreter, 'vm': VirtualMachine, 'closures': ClosureInterpreter, 'python': TranspiledInterpreter}
+
+# Programs the Optimizer has got wrong before, each of which every engine has to print the same for optimized
+# as the tree walker does for the program as written, which is how --debug runs it
+CHECKS = {
+    # Reads of a variable the loop sets through a negative slot mustn't be hoisted
+    "negative slot read": '''
+0,
+5,
+?/ 3:
+    s.0++,
+    p<m.-2 + 1>
+;
+''',
+    "negative slot set": '''
+5,
+s-1 => 7,
+p<m0>,
+1,
+?/ 2:
+    s.-1++,
+    p<m.1 * 10>
+;
+''',
+    # Passing a function some of its optional arguments moves the slots of everything declared in it
+    "default shifted by an optional argument": '''
+||3:
+    5,
+    p<m1>
+;,
+m0<7>,
+m0
+''',
+    "defaults shifted by optional arguments": '''
+||1, 2:
+    9,
+    p<m2>
+;,
+m0<5, 6>,
+m0<5>
+''',
+    # A function called every time round a loop isn't invariant, whatever the analyzer took its slot for
+    "call hoisted from a function with defaults": '''
+||3:
+    ||:
+        p<"x">,
+        r<1>
+    ;,
+    <m0 + 1>,
+    ?/ [1, 2, 3]:
+        p<<m.2 + 10>>
+    ;
+;,
+m0<7>
+''',
+    "read hoisted from a function with defaults": '''
+1||3:
+    m0 * 2,
+    ?/ 2:
+        p<m.1 + m.2>,
+        s.2 + 1
+    ;
+;,
+m0<4>,
+m0<4, 5>
+''',
+    # Nor is a macro expanded where what's called may not be a macro at all
+    "macro expanded in a function with defaults": '''
+||3:
+    >:
+        p<"macro">
+    ;,
+    m1
+;,
+m0<7>,
+m0
+''',
+    "macro expanded in a block of a function with defaults": '''
+||3:
+    >:
+        p<"macro">
+    ;,
+    ? 1:
+        m.1
+    ;
+;,
+m0<7>,
+m0
+''',
+}
+
+
+def run(text, engine, optimize, file_path="<optimizer check>"):
+    """What running text prints, errors included."""
+    Parser.imported_files.clear()
+    Memory.imported_scopes.clear()
+    tree = Parser(Lexer(text), file_path).parse()
+    semantic_analyzer = SemanticAnalyzer(file_path)
+    semantic_analyzer.visit(tree)
+    if optimize:
+        Optimizer(semantic_analyzer).optimize(tree)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            engine(file_path).visit(tree)
+        except InterpreterError as e:
+            print(e.message)
+    return output.getvalue()
+
+
+if __name__ == "__main__":
+    failures = 0
+    for name, text in CHECKS.items():
+        expected = run(text, Interpreter, False)
+        for engine_name, engine in ENGINES.items():
+            output = run(text, engine, True)
+            if output != expected:
+                failures += 1
+                print(f"{name}: {engine_name} printed {output!r} optimized, but {expected!r} as written")
+    print(f"{len(CHECKS) * len(ENGINES) - failures} of {len(CHECKS) * len(ENGINES)} optimizer checks passed")
+    if failures:
+        sys.exit(1)
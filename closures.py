@@ -0,0 +1,541 @@
+from types import FunctionType, ModuleType
+
+from interpreter import *
+from vm import BINARY_OPERATORS, can_exit
+
+
+class ClosureInterpreter(Interpreter):
+    """Runs CommaScript by turning every node into a Python closure the first time it is visited.
+
+    Each closure has its children's closures, operators and memory locations bound in already,
+    so running a node is a single call with no visitor dispatch or token type comparisons. Like
+    the VirtualMachine, anything it doesn't compile itself goes through the Interpreter's methods.
+    """
+
+    def __init__(self, file_path, display_debug_messages=False, max_depth=None, memo_size=None):
+        super(ClosureInterpreter, self).__init__(file_path, display_debug_messages, max_depth, memo_size)
+        # Closures are bound to this interpreter, so they can't be shared like bytecode
+        self.closures = {}
+
+    def visit(self, node):
+        closure = self.closures.get(node)
+        if closure is None:
+            closure = self.closures[node] = self.compile(node)
+        return closure()
+
+    def compile(self, node):
+        return getattr(self, 'compile_' + type(node).__name__)(node)
+
+    def enter_block(self, scope_name):
+        scope = self.current_scope
+        self.current_scope = Memory(self.current_file_path, scope_name,
+                                    scope.scope_level + 1 if scope else 1, scope, scope)
+
+    def compile_block(self, scope_name, node):
+        body = self.compile(node)
+
+        if not node.declares:
+            def reused_block():
+                self.enter_block_scope(scope_name, node)
+                body()
+                self.current_scope = self.current_scope.scope_to_return_to
+            return reused_block
+
+        def block():
+            self.enter_block(scope_name)
+            body()
+            self.current_scope = self.current_scope.scope_to_return_to
+        return block
+
+    def compile_load(self, node):
+        """Returns a closure that finds node's variable, with the checks Interpreter.visit_VarGet makes."""
+        token = node.token
+        access = node.access
+
+        def missing():
+            self.error(ErrorCode.VARIABLE_MISSING, token,
+                       f'm{"."*node.scope_depth}{node.mem_loc} seems to have been lost in the darkness that is CommaScript.')
+
+        def invalid():
+            self.error(ErrorCode.INVALID_VARIABLE, token,
+                       f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
+
+        if access:
+            distance, slot = access.distance, access.slot
+
+            def load():
+                if self.current_python_module is not builtins:
+                    invalid()
+                var = self.current_scope.load(distance, slot)
+                if var is MISSING:
+                    missing()
+                return var
+        else:
+            scope_depth, mem_loc = node.scope_depth, node.mem_loc
+
+            def load():
+                if self.current_python_module is not builtins:
+                    invalid()
+                var = self.current_scope.get(scope_depth, mem_loc)
+                if var is MISSING:
+                    missing()
+                return var
+        return load
+
+    def compile_index(self, node, indexer):
+        token = node.token
+
+        def index(value):
+            index = indexer()
+            if isinstance(value, dict):
+                if index not in value:
+                    self.error(ErrorCode.INDEX_ERROR, token=token,
+                               message=f"{index} does not exist in the given dictionary")
+            else:
+                val_len = len(value)
+                if not isinstance(index, int) or index < -val_len or index >= val_len:
+                    self.error(ErrorCode.INDEX_ERROR, token=token,
+                               message=f"{index} is out of range of the given {type(value).__name__}")
+            return value[index]
+        return index
+
+    def compile_Program(self, node):
+        body = self.compile(node.statement_list_node)
+
+        def program():
+            self.enter_block("global")
+            body()
+            global_scope = self.current_scope
+            self.current_scope = global_scope.scope_to_return_to
+            return global_scope
+        return program
+
+    def compile_StatementList(self, node):
+        function_stack = self.function_stack
+        loop_stack = self.loop_stack
+        statements = []
+        checks = []
+        for child in node.children:
+            statements.append(self.compile(child))
+            if isinstance(child, (Return, Break, Continue)):
+                checks.append(False)
+                break
+            checks.append(node.exits and can_exit(child))
+        statements = tuple(statements)
+
+        if not any(checks):
+            def statement_list():
+                for statement in statements:
+                    statement()
+            return statement_list
+
+        steps = tuple(zip(statements, checks))
+
+        def statement_list():
+            for statement, check in steps:
+                statement()
+                if check and (function_stack and function_stack[-1].has_return_value or
+                              loop_stack and (loop_stack[-1].breaking or loop_stack[-1].continuing)):
+                    break
+        return statement_list
+
+    def compile_Return(self, node):
+        if node.tail_call is not None:
+            return self.compile_tail_call(node)
+        expr = self.compile(node.expr)
+        function_stack = self.function_stack
+
+        def return_():
+            function_stack[-1].set_return_value(expr())
+        return return_
+
+    def compile_tail_call(self, node):
+        # As the var_call compile_VarGet makes, except that a function is left for the caller to call
+        call = node.expr
+        load = self.compile_load(call)
+        args = [self.compile(arg) for arg in call.args]
+        token = call.token
+        function_stack = self.function_stack
+
+        def tail_call():
+            var = load()
+            self.current_python_module = builtins
+            self.leave_module_scope()
+            if isinstance(var, FunctionData):
+                self.prepare_tail_call(node, var, [arg() for arg in args])
+                value = None
+            elif isinstance(var, MacroData):
+                value = self.call_macro(var, [arg() for arg in args])
+            elif isinstance(var, FunctionType):
+                value = var(self, token, *[arg() for arg in args])
+            else:
+                value = var
+            function_stack[-1].set_return_value(value)
+        return tail_call
+
+    def compile_Break(self, node):
+        loop_stack = self.loop_stack
+
+        def break_():
+            loop_stack[-1].breaking = True
+        return break_
+
+    def compile_Continue(self, node):
+        loop_stack = self.loop_stack
+
+        def continue_():
+            loop_stack[-1].continuing = True
+        return continue_
+
+    def compile_BinOp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        if node.short_circuit:
+            if node.op.type == TokenType.AND:
+                return lambda: left() and right()
+            return lambda: left() or right()
+        operator = BINARY_OPERATORS[node.op.type]
+
+        def bin_op():
+            left_value = left()
+            right_value = right()
+            try:
+                return operator(left_value, right_value)
+            except:
+                self.error(ErrorCode.TYPE_ERROR, node.token,
+                           f"'{node.op.value}' not supported between instances of '{type(left_value).__name__}' and '{type(right_value).__name__}'")
+        return bin_op
+
+    def compile_Const(self, node):
+        value = node.value
+        return lambda: value
+
+    def compile_Null(self, node):
+        return lambda: None
+
+    def compile_NoneType(self, node):
+        return lambda: None
+
+    def compile_NoOp(self, node):
+        return lambda: None
+
+    def compile_FString(self, node):
+        portions = [self.compile(portion) for portion in node.portions]
+        return lambda: "".join([str(portion()) for portion in portions])
+
+    def compile_List(self, node):
+        elements = [self.compile(element) for element in node.value]
+        return lambda: [element() for element in elements]
+
+    def compile_Tuple(self, node):
+        elements = [self.compile(element) for element in node.value]
+        return lambda: tuple([element() for element in elements])
+
+    def compile_Dict(self, node):
+        items = [(self.compile(key), self.compile(value)) for key, value in node.value.items()]
+        return lambda: {key(): value() for key, value in items}
+
+    def compile_UnaryOp(self, node):
+        expr = self.compile(node.expr)
+        op_type = node.op.type
+
+        def unary_op():
+            value = expr()
+            try:
+                if op_type == TokenType.PLUS:
+                    return value
+                if op_type == TokenType.MINUS:
+                    return -value
+            except:
+                self.error(ErrorCode.TYPE_ERROR, node.token,
+                           f"Unary '{node.op.value}' not supported for instances of type '{type(value).__name__}'")
+        return unary_op
+
+    def compile_Not(self, node):
+        value = self.compile(node.value)
+        return lambda: not value()
+
+    def compile_VarDecl(self, node):
+        params_num, default_param_vals, body = node.params_num, node.default_param_vals, node.value
+        if isinstance(body, StatementList):
+            def declare_function():
+                self.current_scope._memory.append(FunctionData(params_num, default_param_vals, body))
+            return declare_function
+
+        expr = self.compile(body)
+
+        def declare():
+            value = expr()
+            if isinstance(value, StatementList):
+                value = FunctionData(params_num, default_param_vals, body)
+            self.current_scope._memory.append(value)
+        return declare
+
+    def compile_VarSet(self, node):
+        expr = self.compile(node.value)
+        add_mode = node.add_mode
+        access = node.access
+
+        def var_set():
+            value = expr()
+            if access:
+                types = self.current_scope.store(access.distance, access.slot, value, add_mode)
+            else:
+                types = self.current_scope.set(node.scope_depth, node.mem_loc, value, add_mode)
+            if types:
+                self.error(ErrorCode.TYPE_ERROR, node.token,
+                           f"'+' not supported between instances of '{types[0].__name__}' and '{types[1].__name__}'")
+        return var_set
+
+    def compile_VarGet(self, node):
+        load = self.compile_load(node)
+        token = node.token
+
+        if not node.ref and not node.args and not node.indexer:
+            def var_get():
+                var = load()
+                self.current_python_module = builtins
+                if self.in_module_temps:
+                    self.leave_module_scope()
+                var_type = type(var)
+                if var_type is FunctionData:
+                    return self.call_function(node, var, [])
+                if var_type is MacroData:
+                    return self.call_macro(var, [])
+                return var(self, token) if var_type is FunctionType else var
+            return var_get
+
+        if node.ref:
+            def var_ref():
+                var = load()
+                value = var.value if isinstance(var, (FunctionData, MacroData)) else var
+                self.current_python_module = builtins
+                self.leave_module_scope()
+                return value
+            return var_ref
+
+        args = [self.compile(arg) for arg in node.args]
+        indexer = node.indexer
+        index = self.compile_index(node, self.compile(indexer)) if indexer else None
+
+        def var_call():
+            var = load()
+            value = var.value if isinstance(var, (FunctionData, MacroData)) else var
+            self.current_python_module = builtins
+            self.leave_module_scope()
+            if isinstance(var, FunctionData):
+                return self.call_function(node, var, [arg() for arg in args])
+            if isinstance(var, MacroData):
+                return self.call_macro(var, [arg() for arg in args])
+            if indexer and isinstance(value, (list, tuple, str, dict)):
+                return index(value)
+            if isinstance(value, FunctionType):
+                return value(self, token, *[arg() for arg in args])
+            if indexer:
+                self.error(ErrorCode.INVALID_INDEXER, token,
+                           f"'{type(value).__name__}' does not support the use of indexers.")
+            return value
+        return var_call
+
+    def compile_MacroDecl(self, node):
+        params_num, default_param_vals, body = node.params_num, node.default_param_vals, node.value
+
+        def declare_macro():
+            self.current_scope._memory.append(MacroData(params_num, default_param_vals, body))
+        return declare_macro
+
+    def compile_MacroVarGet(self, node):
+        mem_loc = node.mem_loc
+        indexer = node.indexer
+        index = self.compile_index(node, self.compile(indexer)) if indexer else None
+
+        def macro_var_get():
+            value = self.current_macro_variables[mem_loc]
+            if indexer and isinstance(value, (list, tuple, dict)):
+                return index(value)
+            if indexer:
+                self.error(ErrorCode.INVALID_INDEXER, node.token,
+                           f"'{type(value).__name__}' does not support the use of indexers.")
+            return value
+        return macro_var_get
+
+    def compile_Expansion(self, node):
+        args = [self.compile(arg) for arg in node.args]
+        body = self.compile(node.body)
+        if not args:
+            return body
+
+        def expansion():
+            self.current_macro_variables = [arg() for arg in args]
+            body()
+            self.current_macro_variables = None
+        return expansion
+
+    def compile_Import(self, node):
+        return lambda: self.visit_Import(node)
+
+    def compile_ModuleGet(self, node):
+        var_node = self.compile(node.var_node)
+        access = node.access
+
+        def module_get():
+            if access:
+                module = self.current_scope.load_imported_scope(access.distance, access.slot)
+            else:
+                module = self.current_scope.get_imported_scope(node.scope_depth, node.mem_loc)
+
+            if type(module) is ModuleType:
+                self.current_python_module = module
+                value = var_node()
+                self.current_python_module = builtins
+            else:
+                self.enter_module_scope(module)
+                value = var_node()
+                self.leave_module_scope()
+            return value
+        return module_get
+
+    def compile_OpenFile(self, node):
+        return lambda: self.visit_OpenFile(node)
+
+    def compile_If(self, node):
+        conditional = self.compile(node.conditional)
+        body = self.compile_block("if-block", node.value)
+        else_value = node.else_value
+        if isinstance(else_value, If):
+            otherwise = self.compile(else_value)
+        elif else_value:
+            otherwise = self.compile_block("else-block", else_value)
+        else:
+            otherwise = None
+
+        def if_():
+            if conditional():
+                body()
+            elif otherwise:
+                otherwise()
+        return if_
+
+    def compile_While(self, node):
+        conditional = self.compile(node.conditional)
+        body = self.compile_block("while-block", node.value)
+        function_stack = self.function_stack
+        loop_stack = self.loop_stack
+
+        def while_():
+            loop = Loop()
+            loop_stack.append(loop)
+            while conditional():
+                loop.continuing = False
+                body()
+                if (function_stack and function_stack[-1].has_return_value or
+                        loop_stack and loop_stack[-1].breaking):
+                    break
+            loop_stack.pop()
+        return self.forgetting_invariants(node, while_)
+
+    def compile_For(self, node):
+        iterable = self.compile(node.iterable)
+        body = self.compile(node.value)
+        function_stack = self.function_stack
+        loop_stack = self.loop_stack
+
+        def for_():
+            iter = iterable()
+            iter = range(iter) if isinstance(iter, int) else iter
+            loop = Loop()
+            loop_stack.append(loop)
+            scope = None
+            try:
+                for i in iter:
+                    loop.continuing = False
+                    if scope is None:
+                        self.enter_block("for-block")
+                        scope = self.current_scope
+                        scope._memory.append(i)
+                    else:
+                        self.reenter_loop_scope(scope, i)
+                    body()
+                    self.current_scope = self.current_scope.scope_to_return_to
+                    if (function_stack and function_stack[-1].has_return_value or
+                            loop_stack and loop_stack[-1].breaking):
+                        break
+            except TypeError:
+                self.error(ErrorCode.TYPE_ERROR, node.token,
+                           f"'{type(iter).__name__}' is not iterable")
+            loop_stack.pop()
+        return self.forgetting_invariants(node, for_)
+
+    def forgetting_invariants(self, node, loop):
+        values = node.invariants
+        if not values:
+            return loop
+
+        def forget_then_loop():
+            forget_invariants(values)
+            loop()
+        return forget_then_loop
+
+    def compile_Invariant(self, node):
+        expr = self.compile(node.expr)
+        values, index = node.values, node.index
+
+        def invariant():
+            value = values[index]
+            if value is MISSING:
+                value = expr()
+                if type(value) in INVARIANT_VALUE_TYPES:
+                    values[index] = value
+            return value
+        return invariant
+
+    def compile_BuiltInFunction(self, node):
+        token = node.token
+        args = [self.compile(arg) for arg in node.args]
+
+        def wrong_params(function, arg_values, e):
+            self.log(e)
+            self.error(ErrorCode.WRONG_PARAMS_NUM, token,
+                       f"{node.name}<> takes {len(signature(function).parameters) - 2} arguments but {len(arg_values)} were given")
+
+        if node.from_python:
+            name = node.name
+
+            def python_function():
+                function = getattr(self.current_python_module, name)
+                self.current_python_module = builtins
+                if node.ref:
+                    return function
+                arg_values = [arg() for arg in args]
+                try:
+                    return function(*arg_values)
+                except TypeError as e:
+                    wrong_params(function, arg_values, e)
+            return python_function
+
+        function = node.built_in.function
+        if node.ref:
+            def built_in_ref():
+                self.current_python_module = builtins
+                return function
+            return built_in_ref
+
+        def built_in():
+            self.current_python_module = builtins
+            arg_values = [arg() for arg in args]
+            try:
+                return function(self, token, *arg_values)
+            except TypeError as e:
+                wrong_params(function, arg_values, e)
+        return built_in
+
+    def compile_GetAttr(self, node):
+        name = node.name
+
+        def get_attr():
+            try:
+                return getattr(self.current_python_module, name)
+            except:
+                self.error(ErrorCode.INVALID_VARIABLE, node.token,
+                           f"'{self.current_python_module}' has no attribute '{name}'")
+        return get_attr
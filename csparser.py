@@ -1,8 +1,7 @@
 import sys
-import ast
-import inspect
 import builtins
 
+import ast_cache
 from error import *
 from cstoken import *
 from lexer import *
@@ -12,12 +11,16 @@ current_print_indent = 0
 
 
 class AST(object):
-    pass
+    __slots__ = ()
 
 
 class Program(AST):
+    __slots__ = ('statement_list_node', 'optimized')
+
     def __init__(self, statement_list_node):
         self.statement_list_node = statement_list_node
+        # Set by the Optimizer once it has rewritten the tree, to a string telling its rewrites apart
+        self.optimized = None
 
     def __str__(self):
         return self.statement_list_node.__str__()
@@ -33,9 +36,21 @@ class BlockType(Enum):
 
 
 class StatementList(AST):
+    __slots__ = ('block_type', 'children', 'declares', 'reused_scope', 'pure', 'exits')
+
     def __init__(self, block_type):
         self.block_type = block_type
         self.children = []
+        # Cleared by the semantic analyzer when the block's scope ends up empty
+        self.declares = True
+        # Filled in by the interpreter
+        self.reused_scope = None
+        # Set by the semantic analyzer on a function body that only reads its own scopes and
+        # calls nothing with side effects, so its result only depends on its arguments
+        self.pure = False
+        # Cleared by the Optimizer on a list nothing run in can return, break or continue out of, so
+        # it's run without checking whether to stop after every statement
+        self.exits = True
 
     def __str__(self):
         global current_print_indent
@@ -50,10 +65,20 @@ class StatementList(AST):
 
 
 class BinOp(AST):
+    __slots__ = ('left', 'token', 'right', 'cache', 'short_circuit')
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.token = op
         self.right = right
+        # Filled in by the interpreter
+        self.cache = None
+        # & and | only evaluate their right hand side when the left doesn't decide the result
+        self.short_circuit = op.type in (TokenType.AND, TokenType.OR)
+
+    @property
+    def op(self):
+        return self.token
 
     def __str__(self):
         return f"BinOp({self.left} {self.op.value} {self.right})"
@@ -61,6 +86,8 @@ class BinOp(AST):
 
 
 class Const(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
@@ -71,15 +98,24 @@ class Const(AST):
 
 
 class Null(AST):
-    def __init__(self, token):
-        self.token = token
+    __slots__ = ()
 
     def __str__(self):
         return f"Null()"
     __repr__ = __str__
 
+    def __reduce__(self):
+        # Cached trees unpickle back to the shared instance
+        return 'NULL'
+
+
+# Null carries no data so every X in every tree is this one node
+NULL = Null()
+
 
 class FString(AST):
+    __slots__ = ('token', 'portions')
+
     def __init__(self, token, portions):
         self.token = token
         self.portions = portions
@@ -90,6 +126,8 @@ class FString(AST):
 
 
 class List(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token, value):
         self.token = token
         self.value = value
@@ -100,6 +138,8 @@ class List(AST):
 
 
 class Tuple(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token, value):
         self.token = token
         self.value = value
@@ -110,6 +150,8 @@ class Tuple(AST):
 
 
 class Dict(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token, value):
         self.token = token
         self.value = value
@@ -120,16 +162,24 @@ class Dict(AST):
 
 
 class UnaryOp(AST):
+    __slots__ = ('token', 'expr')
+
     def __init__(self, op, expr):
-        self.token = self.op = op
+        self.token = op
         self.expr = expr
 
+    @property
+    def op(self):
+        return self.token
+
     def __str__(self):
         return f"UnaryOp({self.op.value} {self.expr})"
     __repr__ = __str__
 
 
 class VarDecl(AST):
+    __slots__ = ('params_num', 'default_param_vals', 'value')
+
     def __init__(self, params_num, default_param_vals, value):
         self.params_num = params_num
         self.default_param_vals = default_param_vals
@@ -141,18 +191,24 @@ class VarDecl(AST):
 
 
 class VarSet(AST):
+    __slots__ = ('token', 'scope_depth', 'mem_loc', 'value', 'add_mode', 'access')
+
     def __init__(self, token, scope_depth, mem_loc, value, add_mode):
         self.token = token
         self.scope_depth = scope_depth
         self.mem_loc = mem_loc
         self.value = value
         self.add_mode = add_mode
+        # Filled in by the semantic analyzer
+        self.access = None
 
     def __str__(self):
         return f"VarSet(s{'.'*self.scope_depth}{self.mem_loc}, {self.value}, add_mode:{self.add_mode})"
 
 
 class VarGet(AST):
+    __slots__ = ('token', 'ref', 'scope_depth', 'mem_loc', 'args', 'indexer', 'access', 'cache')
+
     def __init__(self, token, ref, scope_depth, mem_loc, args, indexer):
         self.token = token
         self.ref = ref
@@ -160,6 +216,10 @@ class VarGet(AST):
         self.mem_loc = mem_loc
         self.args = args
         self.indexer = indexer
+        # Filled in by the semantic analyzer
+        self.access = None
+        # Filled in by the interpreter
+        self.cache = None
 
     def __str__(self):
         if self.args and self.indexer:
@@ -174,6 +234,8 @@ class VarGet(AST):
 
 
 class MacroDecl(AST):
+    __slots__ = ('token', 'params_num', 'default_param_vals', 'value')
+
     def __init__(self, token, params_num, default_param_vals, value):
         self.token = token
         self.params_num = params_num
@@ -186,6 +248,8 @@ class MacroDecl(AST):
 
 
 class MacroVarGet(AST):
+    __slots__ = ('token', 'mem_loc', 'indexer')
+
     def __init__(self, token, mem_loc, indexer):
         self.token = token
         self.mem_loc = mem_loc
@@ -197,6 +261,8 @@ class MacroVarGet(AST):
 
 
 class Import(AST):
+    __slots__ = ('token', 'file_path', 'from_python')
+
     def __init__(self, token, file_path, from_python=False):
         self.token = token
         self.file_path = file_path
@@ -208,11 +274,15 @@ class Import(AST):
 
 
 class ModuleGet(AST):
+    __slots__ = ('token', 'scope_depth', 'mem_loc', 'var_node', 'access')
+
     def __init__(self, token, scope_depth, mem_loc, var_node):
         self.token = token
         self.scope_depth = scope_depth
         self.mem_loc = mem_loc
         self.var_node = var_node
+        # Filled in by the semantic analyzer
+        self.access = None
 
     def __str__(self):
         return f"ModuleGet({'.'*self.scope_depth}{self.mem_loc}, {self.var_node})"
@@ -220,6 +290,8 @@ class ModuleGet(AST):
 
 
 class OpenFile(AST):
+    __slots__ = ('token', 'file_mode', 'file_path', 'value')
+
     def __init__(self, token, file_path, value):
         self.token = token
         self.file_mode = token.type
@@ -232,6 +304,8 @@ class OpenFile(AST):
 
 
 class Not(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token, value):
         self.token = token
         self.value = value
@@ -241,6 +315,8 @@ class Not(AST):
 
 
 class If(AST):
+    __slots__ = ('token', 'conditional', 'value', 'else_value')
+
     def __init__(self, token, conditional, value, else_value):
         self.token = token
         self.conditional = conditional
@@ -253,10 +329,14 @@ class If(AST):
 
 
 class While(AST):
+    __slots__ = ('token', 'conditional', 'value', 'invariants')
+
     def __init__(self, token, conditional, value):
         self.token = token
         self.conditional = conditional
         self.value = value
+        # Set by the Optimizer to the values of the Invariants it hoists out of the loop
+        self.invariants = None
 
     def __str__(self):
         return f"While({self.conditional}, {self.value})"
@@ -264,20 +344,66 @@ class While(AST):
 
 
 class For(AST):
+    __slots__ = ('token', 'iterable', 'value', 'invariants')
+
     def __init__(self, token, iterable, value):
         self.token = token
         self.iterable = iterable
         self.value = value
+        # Set by the Optimizer to the values of the Invariants it hoists out of the loop
+        self.invariants = None
 
     def __str__(self):
         return f"For({self.iterable}, {self.value})"
     __repr__ = __str__
 
 
+class Invariant(AST):
+    """An expression the Optimizer found gives the same value every time round the loop it's in.
+
+    Never made by the parser. Its value is kept in values[index], a list the loop shares between
+    its Invariants and forgets the contents of every time it starts.
+    """
+    __slots__ = ('token', 'expr', 'values', 'index')
+
+    def __init__(self, expr, values, index):
+        self.token = expr.token
+        self.expr = expr
+        self.values = values
+        self.index = index
+
+    def __str__(self):
+        return f"Invariant({self.expr})"
+    __repr__ = __str__
+
+
+class Expansion(AST):
+    """A call to a macro the Optimizer has written a copy of the macro's body in place of.
+
+    Never made by the parser. Arguments that are constants are written into the body, and the
+    rest are evaluated into the macro variables its MacroVarGets are renumbered to read, before
+    the body runs in the caller's scope just as the macro's would. Like a macro call, it gives null.
+    """
+    __slots__ = ('token', 'args', 'body')
+
+    def __init__(self, token, args, body):
+        self.token = token
+        self.args = args
+        self.body = body
+
+    def __str__(self):
+        return f"Expansion({self.args}, {self.body})"
+    __repr__ = __str__
+
+
 class Return(AST):
+    __slots__ = ('token', 'expr', 'tail_call')
+
     def __init__(self, token, expr):
         self.token = token
         self.expr = expr
+        # Filled in by the semantic analyzer
+        self.tail_call = None
 
     def __str__(self):
         return f"Return({self.expr})"
@@ -285,6 +411,8 @@ class Return(AST):
 
 
 class Break(AST):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
 
@@ -294,6 +422,8 @@ class Break(AST):
 
 
 class Continue(AST):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
 
@@ -303,12 +433,16 @@ class Continue(AST):
 
 
 class BuiltInFunction(AST):
-    def __init__(self, token, ref, args, from_python=False):
+    __slots__ = ('token', 'ref', 'name', 'args', 'from_python', 'built_in')
+
+    def __init__(self, token, ref, args, from_python=False, built_in=None):
         self.token = token
         self.ref = ref
         self.name = token.value
         self.args = args
         self.from_python = from_python
+        # The BUILT_INS entry of a CommaScript built-in, resolved once by the parser
+        self.built_in = built_in
 
     def __str__(self):
         return f"BuiltInFunction({'~'*self.ref}{'^'*self.from_python}{self.name}, {self.args})"
@@ -316,6 +450,8 @@ class BuiltInFunction(AST):
 
 
 class GetAttr(AST):
+    __slots__ = ('token', 'name')
+
     def __init__(self, token):
         self.token = token
         self.name = token.value
@@ -326,6 +462,8 @@ class GetAttr(AST):
 
 
 class NoOp(AST):
+    __slots__ = ()
+
     def __str__(self):
         return f"NoOp()"
     __repr__ = __str__
@@ -334,19 +472,61 @@ class NoOp(AST):
 class Parser():
     imported_files = {}
 
-    def __init__(self, lexer, file_path, display_debug_messages=False):
+    def __init__(self, lexer, file_path, display_debug_messages=False, follow_imports=True):
         self.lexer = lexer
         self.file_path = file_path
         Parser.imported_files[file_path] = None
         self.current_token = self.lexer.get_next_token()
         self.peeked_at_token = None
         self.display_debug_messages = display_debug_messages
+        self.follow_imports = follow_imports
+        self.imports = []
+
+    @classmethod
+    def parse_file(cls, file_path, display_debug_messages=False, source_hash=None):
+        """Parses file_path, or loads its tree from __cscache__ if the source has not changed since."""
+        source_hash = source_hash or ast_cache.source_hash(file_path)
+        # Debugging the parser needs the parse to actually happen
+        cached = None if display_debug_messages else ast_cache.load(file_path, source_hash)
+        if cached:
+            program, imports = cached
+            Parser.imported_files[file_path] = None
+            for node in imports:
+                cls.import_module(file_path, node.token, node.file_path, display_debug_messages)
+            Parser.imported_files[file_path] = program
+            return program
+
+        with open(file_path) as file:
+            parser = cls(Lexer(file), file_path, display_debug_messages)
+            program = parser.parse()
+        ast_cache.store(file_path, source_hash, program, parser.imports)
+        return program
+
+    @classmethod
+    def import_module(cls, importing_file_path, token, file_path, display_debug_messages=False):
+        if file_path in Parser.imported_files:
+            if not Parser.imported_files[file_path]:
+                raise ParserError(ErrorCode.CIRCULAR_IMPORT, token,
+                                  f"importing {file_path} causes a circular import.", importing_file_path)
+            return
+
+        try:
+            source_hash = ast_cache.source_hash(file_path)
+        except OSError:
+            raise ParserError(ErrorCode.FILE_NOT_FOUND, token,
+                              f"{file_path} does not exist.", importing_file_path)
+        program = cls.parse_file(file_path, display_debug_messages, source_hash)
+        if display_debug_messages:
+            print('')
+            print(program)
+            print('')
 
     def error(self, error_code, token, message=''):
         raise ParserError(
             error_code=error_code,
             token=token,
-            message=f'\u001b[31m{error_code.value} -> File: {self.file_path}, Line: {token.line}, Column: {token.column}\n{message}\u001b[0m'
+            message=message,
+            file_path=self.file_path
         )
 
     def log(self, msg):
@@ -373,9 +553,6 @@ class Parser():
             self.peeked_at_token = self.lexer.get_next_token()
         return self.peeked_at_token
 
-    def contains_return(self, f):
-        return any(isinstance(node, ast.Return) for node in ast.walk(ast.parse(inspect.getsource(f))))
-
     def parse(self):
         node = self.program()
         if self.current_token.type != TokenType.EOF:
@@ -388,7 +565,7 @@ class Parser():
         if self.current_token.type == TokenType.EOF:
             token = Token(TokenType.FUNCTION, 'p')
             const = Const(Token(TokenType.STR_CONST, "Hello World!"))
-            built_in_function = BuiltInFunction(token, False, [const])
+            built_in_function = BuiltInFunction(token, False, [const], built_in=get_built_in('p'))
             # var_set = VarDecl(0, built_in_function)
             statement_list_node = StatementList(BlockType.PROGRAM)
             statement_list_node.children.append(built_in_function)
@@ -426,7 +603,7 @@ class Parser():
                 node = Return(token, self.conditional())
                 self.eat(TokenType.RANGLE)
             else:
-                node = Return(token, Null(token))
+                node = Return(token, NULL)
             return node
         if token.type == TokenType.BREAK:
             self.eat(TokenType.BREAK)
@@ -468,22 +645,12 @@ class Parser():
         if not from_python:
             file_path = file_path + ".cscr" if ".cscr" not in file_path else file_path
 
-            if file_path in Parser.imported_files and not Parser.imported_files[file_path]:
-                self.error(ErrorCode.CIRCULAR_IMPORT, token,
-                           message=f"importing {file_path} causes a circular import.")
-
-            try:
-                with open(file_path) as file:
-                    lexer = Lexer(file.read())
-            except:
-                self.error(error_code=ErrorCode.FILE_NOT_FOUND,
-                           token=token, message=f"{file_path} does not exist.")
-            parser = Parser(lexer, file_path, self.display_debug_messages)
-            self.log('')
-            self.log(parser.parse())
-            self.log('')
+            if self.follow_imports:
+                Parser.import_module(self.file_path, token, file_path, self.display_debug_messages)
 
         node = Import(token, file_path, from_python)
+        if not from_python:
+            self.imports.append(node)
 
         self.eat(TokenType.STR_CONST)
         return node
@@ -508,11 +675,8 @@ class Parser():
 
     def var_decl(self, force_decl=False):
         node = self.conditional()
-        if not force_decl and isinstance(node, BuiltInFunction):
-            function_name = f"cs_{node.name.lower()}"
-            function = globals()[function_name]
-
-            if not self.contains_return(function):
+        if not force_decl and isinstance(node, BuiltInFunction) and not node.from_python:
+            if not node.built_in.returns_value:
                 return node
         return VarDecl(0, [], node)
 
@@ -782,7 +946,7 @@ class Parser():
             return self.built_in_function()
         elif token.type == TokenType.NULL:
             self.eat(TokenType.NULL)
-            return Null(token)
+            return NULL
         else:
             self.error(ErrorCode.UNEXPECTED_TOKEN, self.current_token,
                        f"Unexpected character(s): {self.current_token.value}")
@@ -962,9 +1126,8 @@ class Parser():
                     args.append(self.conditional())
             self.eat(TokenType.RANGLE)
 
-        node = BuiltInFunction(token, ref, args, from_python)
-
         if from_python:
+            node = BuiltInFunction(token, ref, args, from_python)
             try:
                 getattr(builtins, token.value)
                 if allow_var_decl:  # TODO: Look for ways to check if python's built-in function's have return values or not
@@ -975,13 +1138,13 @@ class Parser():
                            f"Python function {token.value}<> does not exist")
 
         else:
-            function_name = f"cs_{token.value.lower()}"
-            if function_name not in globals():
+            built_in = get_built_in(token.value)
+            if not built_in:
                 self.error(ErrorCode.ID_NOT_FOUND, token,
                            f"Function {token.value}<> does not exist")
-            function = globals()[function_name]
+            node = BuiltInFunction(token, ref, args, from_python, built_in)
 
-            if allow_var_decl and self.contains_return(function):
+            if allow_var_decl and built_in.returns_value:
                 return VarDecl(0, [], node)
             return node
 
@@ -1015,8 +1178,5 @@ if __name__ == "__main__":
         print("Unspecified file")
     else:
         file_path = sys.argv[1]
-        with open(file_path) as file:
-            lexer = Lexer(file.read())
-        parser = Parser(lexer, file_path, True)
-        print(parser.parse())
+        print(Parser.parse_file(file_path, True))
         print(Parser.imported_files)
@@ -1,3 +1,6 @@
+import re
+from array import array
+from bisect import bisect_right
 from enum import Enum
 
 
@@ -74,13 +77,63 @@ def _build_reserved_keywords():
 
 RESERVED_KEYWORDS = _build_reserved_keywords()
 
+NEWLINE_REGEX = re.compile('\n')
+
+
+class LineIndex():
+    """Turns character offsets into line and column numbers for one source text.
+
+    The newline table is only built the first time a position is asked for, which
+    is normally when an error message is shown. Lines start on their newline
+    character and a newline at offset 0 is not counted, matching the positions
+    CommaScript has always reported. Offsets at or past the end of the text are
+    reported one column after the last character.
+
+    Sources that are read in chunks start without text and extend() the table
+    with each chunk as it arrives instead, so the text itself need not be kept.
+    """
+
+    def __init__(self, text=None):
+        self.text = text
+        if text is None:
+            self.length = 0
+            self.newlines = array('q')
+        else:
+            self.length = len(text)
+            self.newlines = None
+
+    def extend(self, chunk):
+        start = 1 if self.length == 0 else 0
+        self.newlines.extend(self.length + match.start()
+                             for match in NEWLINE_REGEX.finditer(chunk, start))
+        self.length += len(chunk)
+
+    def position(self, pos):
+        if pos >= self.length:
+            line, column = self.position(self.length - 1) if self.length > 0 else (1, 1)
+            return line, column + 1
+        if self.newlines is None:
+            self.newlines = array('q', (match.start() for match in NEWLINE_REGEX.finditer(self.text, 1)))
+        line = bisect_right(self.newlines, pos)
+        return line + 1, pos - (self.newlines[line - 1] if line else 0) + 1
+
 
 class Token():
-    def __init__(self, type, value, line=None, column=None):
+    __slots__ = ('type', 'value', 'pos', 'line_index')
+
+    def __init__(self, type, value, pos=None, line_index=None):
         self.type = type
         self.value = value
-        self.line = line
-        self.column = column
+        self.pos = pos
+        self.line_index = line_index
+
+    @property
+    def line(self):
+        return self.line_index.position(self.pos)[0] if self.line_index else None
+
+    @property
+    def column(self):
+        return self.line_index.position(self.pos)[1] if self.line_index else None
 
     def __str__(self):
         return f"Token({self.type}, {self.value})"
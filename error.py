@@ -21,15 +21,27 @@ class ErrorCode(Enum):
     VARIABLE_MISSING = 'A variable seems to be missing'
     TYPE_ERROR = 'Type error'
     INVALID_FUNCTION_CALL = 'Invalid Function Call'
+    MAX_DEPTH_EXCEEDED = 'Maximum call depth exceeded'
 
 
 class Error(Exception):
-    def __init__(self, error_code=None, token=None, message=None):
+    def __init__(self, error_code=None, token=None, message=None, file_path=None):
         self.error_code = error_code
         self.token = token
-        self.message = message
+        self.description = message
+        self.file_path = file_path
         super().__init__(message)
 
+    @property
+    def message(self):
+        # Errors raised against a file only look up the token's line and column when shown
+        if self.file_path is None:
+            return self.description
+        return f'\u001b[31m{self.error_code.value} -> File: {self.file_path}, Line: {self.token.line}, Column: {self.token.column}\n{self.description}\u001b[0m'
+
+    def __str__(self):
+        return self.message
+
 
 class LexerError(Error):
     pass
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import ast_cache
+from error import *
+from csparser import *
+
+
+def parse_module(file_path, source_hash):
+    """Parses file_path without following its imports.
+
+    Returns (program, imports), where program is None if it was stored in __cscache__ for the
+    caller to load, or None if the file failed to parse.
+    """
+    try:
+        with open(file_path) as file:
+            parser = Parser(Lexer(file), file_path, follow_imports=False)
+            program = parser.parse()
+    except Exception:
+        return None
+    # Loading the stored tree is cheaper than sending it back through the pool
+    if ast_cache.store(file_path, source_hash, program, parser.imports):
+        program = None
+    return program, parser.imports
+
+
+def module_imports(imports):
+    return [node.file_path for node in imports if not node.from_python]
+
+
+def parse_graph(executor, file_path):
+    """Parses file_path and every module it imports, spreading the modules that aren't in __cscache__ over executor.
+
+    Returns {file_path: (program, imports)}, or None if any module is missing or failed to parse.
+    """
+    modules = {}
+    hashes = {}
+    futures = {}
+    queue = [file_path]
+    while queue or futures:
+        while queue:
+            path = queue.pop()
+            if path in modules:
+                continue
+            modules[path] = None
+            try:
+                hashes[path] = ast_cache.source_hash(path)
+            except OSError:
+                return None
+            cached = ast_cache.load(path, hashes[path])
+            if cached:
+                modules[path] = cached
+                queue.extend(module_imports(cached[1]))
+            else:
+                futures[executor.submit(parse_module, path, hashes[path])] = path
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception:
+                # The tree was too deep to send back
+                result = None
+            if result and result[0] is None:
+                result = ast_cache.load(path, hashes[path])
+            if result is None:
+                return None
+            modules[path] = result
+            queue.extend(module_imports(result[1]))
+    return modules
+
+
+def import_order(modules, file_path):
+    """Returns the modules in the order the parser would first import them, or None if the imports are circular."""
+    order = []
+    in_progress = set()
+
+    def walk(path):
+        in_progress.add(path)
+        order.append(path)
+        for import_path in module_imports(modules[path][1]):
+            if import_path in in_progress:
+                return False
+            if import_path not in order and not walk(import_path):
+                return False
+        in_progress.remove(path)
+        return True
+
+    return order if walk(file_path) else None
+
+
+def build(file_path, jobs=None):
+    """Parses file_path and its whole import graph, with independent modules parsed in jobs processes.
+
+    Every module ends up in Parser.imported_files just as if it had been imported by Parser.parse_file,
+    ready for the SemanticAnalyzer. If anything goes wrong, be it a missing file, a syntax error or a
+    circular import, the graph is parsed again by Parser.parse_file so that the error is reported
+    exactly as before.
+    """
+    with ProcessPoolExecutor(jobs or os.cpu_count()) as executor:
+        modules = parse_graph(executor, file_path)
+        order = modules and import_order(modules, file_path)
+        if not order:
+            executor.shutdown(cancel_futures=True)
+
+    if not order:
+        Parser.imported_files.clear()
+        return Parser.parse_file(file_path)
+
+    for path in order:
+        Parser.imported_files[path] = modules[path][0]
+    return Parser.imported_files[file_path]
@@ -1,6 +1,8 @@
 from inspect import signature, isfunction
 from types import ModuleType
+from collections import OrderedDict
 import builtins
+import operator
 import importlib
 
 from error import *
@@ -8,16 +10,44 @@ from cstoken import *
 from lexer import *
 from csparser import *
 from semantic_analyzer import *
+import import_graph
 
 from node_visitor import *
 from memory import *
 from built_in_functions import *
 
 
+def _build_fast_binary_operations():
+    operations = {}
+    for number_types in ((int, int), (float, float)):
+        for op_type, operation in ((TokenType.PLUS, operator.add), (TokenType.MINUS, operator.sub),
+                                   (TokenType.MUL, operator.mul)):
+            operations[(op_type, *number_types)] = operation
+    for compared_types in ((int, int), (float, float), (int, float), (float, int), (str, str)):
+        for op_type, operation in ((TokenType.EQUAL, operator.eq), (TokenType.NOT_EQUAL, operator.ne),
+                                   (TokenType.LTHAN, operator.lt), (TokenType.GTHAN, operator.gt),
+                                   (TokenType.LTHAN_OR_EQUAL, operator.le), (TokenType.GTHAN_OR_EQUAL, operator.ge)):
+            operations[(op_type, *compared_types)] = operation
+    operations[(TokenType.PLUS, str, str)] = operator.add
+    for op_type, operation in ((TokenType.EQUAL, operator.eq), (TokenType.NOT_EQUAL, operator.ne)):
+        operations[(op_type, bool, bool)] = operation
+    return operations
+
+
+# Operations that can't fail for operands of exactly these types, which visit_BinOp goes
+# straight to once a node has seen them
+FAST_BINARY_OPERATIONS = _build_fast_binary_operations()
+
+
 class Function:
     def __init__(self):
         self.return_value = None
         self.has_return_value = False
+        # (call node, FunctionData, argument values, enclosing scope, whether the scope can be rebound)
+        # of a call returned from a tail position, for the caller to make once the function is left
+        self.tail_call = None
+        # (MemoCache, key) the function's return value is cached under, when it is memoized
+        self.memo = None
 
     def set_return_value(self, return_val):
         self.return_value = return_val
@@ -30,8 +60,72 @@ class Loop:
         self.continuing = False
 
 
+# How many results of each pure function --memoize keeps when it isn't given a size
+DEFAULT_MEMO_SIZE = 1024
+
+# Values a memoized call's arguments and result can be made of, anything mutable could change
+# after its result is cached
+MEMO_VALUE_TYPES = frozenset((int, float, str, bool, type(None)))
+
+# Values an Invariant keeps, anything else is computed again each time round, since a mutable
+# value could be changed through another variable or give away that it's the same object
+INVARIANT_VALUE_TYPES = MEMO_VALUE_TYPES
+
+
+def forget_invariants(values):
+    values[:] = [MISSING] * len(values)
+
+
+def memo_key(values):
+    """A key that tells values apart by type as well as by value, None if any of them can't be cached."""
+    key = []
+    for value in values:
+        value_type = type(value)
+        if value_type is tuple:
+            value = memo_key(value)
+            if value is None:
+                return None
+        elif value_type is StatementList:
+            # A function passed by reference, which could be called
+            if not value.pure:
+                return None
+        elif value_type not in MEMO_VALUE_TYPES:
+            return None
+        key.append(value_type)
+        key.append(value)
+    return tuple(key)
+
+
+class MemoCache:
+    """The results of a pure function's calls, forgetting the least recently used once there are more than size."""
+
+    def __init__(self, name, size):
+        # How the function was called the first time, as functions don't have names of their own
+        self.name = name
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        results = self.results
+        if key in results:
+            results.move_to_end(key)
+            self.hits += 1
+            return results[key]
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value):
+        if memo_key((value,)) is None:
+            return
+        self.results[key] = value
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+
 class Interpreter(NodeVisitor):
-    def __init__(self, file_path, display_debug_messages=False):
+    def __init__(self, file_path, display_debug_messages=False, max_depth=None, memo_size=None):
         super(Interpreter, self).__init__(display_debug_messages)
         self.current_file_path = file_path
         self.current_scope = None
@@ -40,10 +134,21 @@ class Interpreter(NodeVisitor):
         self.loop_stack = []
         self.current_python_module = builtins
         self.in_module_temps = None
+        # Node type name -> [hits, misses] of its inline caches, only counted with debug messages on
+        self.inline_cache_stats = {}
+        # Scopes of function calls that have returned, ready for the next call to take
+        self.frame_pool = []
+        # How deep function calls may nest before it is an error, None for as deep as the engine allows
+        self.max_depth = max_depth
+        # How many results of each pure function are cached, None when they aren't
+        self.memo_size = memo_size
+        # Function body -> its MemoCache
+        self.memo_caches = {}
 
     def enter_scope(self, scope_name, enclosing_scope=None):
         enclosing_scope = enclosing_scope if enclosing_scope else self.current_scope
-        self.log(f"ENTER scope: {self.current_file_path}: {scope_name}")
+        if self.display_debug_messages:
+            self.log(f"ENTER scope: {self.current_file_path}: {scope_name}")
         scoped_memory_table = Memory(
             file_path=self.current_file_path,
             scope_name=scope_name,
@@ -54,10 +159,64 @@ class Interpreter(NodeVisitor):
         )
         self.current_scope = scoped_memory_table
 
+    def enter_block_scope(self, scope_name, block):
+        # A block the semantic analyzer saw declare nothing keeps one scope per parent scope,
+        # so loops and repeated ifs stop allocating a fresh memory table every time round
+        scope = block.reused_scope
+        if block.declares or scope is None or scope.scope_to_return_to is not self.current_scope:
+            self.enter_scope(scope_name)
+            if not block.declares:
+                block.reused_scope = self.current_scope
+            return
+        if self.display_debug_messages:
+            self.log(f"ENTER scope: {self.current_file_path}: {scope_name}")
+        # Macro bodies run in the caller's scope and can still declare into it
+        if scope._memory or scope.imported_file_paths:
+            scope._memory.clear()
+            scope.imported_file_paths.clear()
+        self.current_scope = scope
+
+    # Nothing keeps hold of a function's scope once it returns, as references are to the function's
+    # statement list rather than a closure, so the scope can go straight back into the pool
+
+    def enter_function_scope(self, scope_name, enclosing_scope):
+        scope = self.current_scope
+        if self.frame_pool:
+            frame = self.frame_pool.pop()
+            frame.file_path = self.current_file_path
+            frame.scope_name = scope_name
+            frame.scope_level = scope.scope_level + 1
+            frame.enclosing_scope = enclosing_scope
+            frame.scope_to_return_to = scope
+            self.current_scope = frame
+        else:
+            self.current_scope = Memory(self.current_file_path, scope_name, scope.scope_level + 1,
+                                        enclosing_scope, scope)
+
+    def leave_function_scope(self):
+        frame = self.current_scope
+        self.current_scope = frame.scope_to_return_to
+        frame._memory.clear()
+        if frame.imported_file_paths:
+            frame.imported_file_paths.clear()
+        frame.enclosing_scope = frame.scope_to_return_to = None
+        self.frame_pool.append(frame)
+
+    def reenter_loop_scope(self, scope, item):
+        """Enters the scope a for loop made for its first item again for the next one, rebinding the loop variable in place."""
+        memory = scope._memory
+        if len(memory) > 1:
+            del memory[1:]
+        memory[0] = item
+        if scope.imported_file_paths:
+            scope.imported_file_paths.clear()
+        self.current_scope = scope
+
     def leave_scope(self):
-        self.log(self.current_scope)
-        self.log(f'LEAVE scope: {self.current_scope.file_path}: {self.current_scope.scope_name}' +
-                 f' -> {self.current_scope.scope_to_return_to.file_path}: {self.current_scope.scope_to_return_to.scope_name}' if self.current_scope.scope_to_return_to else '')
+        if self.display_debug_messages:
+            self.log(self.current_scope)
+            self.log(f'LEAVE scope: {self.current_scope.file_path}: {self.current_scope.scope_name}' +
+                     f' -> {self.current_scope.scope_to_return_to.file_path}: {self.current_scope.scope_to_return_to.scope_name}' if self.current_scope.scope_to_return_to else '')
         self.current_scope = self.current_scope.scope_to_return_to
 
     def enter_module_scope(self, module):
@@ -79,13 +238,26 @@ class Interpreter(NodeVisitor):
         raise InterpreterError(
             error_code=error_code,
             token=token,
-            message=f'\u001b[31m{error_code.value} -> File: {self.current_file_path}, Line: {token.line}, Column: {token.column}\n{message}\u001b[0m'
+            message=message,
+            file_path=self.current_file_path
         )
 
     def log(self, msg):
         if self.display_debug_messages:
             print(msg)
 
+    def count_inline_cache(self, name, hit):
+        stats = self.inline_cache_stats.setdefault(name, [0, 0])
+        stats[0 if hit else 1] += 1
+
+    def log_inline_caches(self):
+        for name, (hits, misses) in self.inline_cache_stats.items():
+            self.log(f"{name}: {hits} hits, {misses} misses")
+
+    def log_memo_caches(self):
+        for cache in self.memo_caches.values():
+            self.log(f"{cache.name}: {cache.hits} hits, {cache.misses} misses, {len(cache.results)} cached")
+
     def visit_Program(self, node):
         self.enter_scope("global")
         self.visit(node.statement_list_node)
@@ -94,6 +266,10 @@ class Interpreter(NodeVisitor):
         return global_scope
 
     def visit_StatementList(self, node):
+        if not node.exits:
+            for child in node.children:
+                self.visit(child)
+            return
         for child in node.children:
             return_value = self.visit(child)
             if isinstance(child, Return):
@@ -118,9 +294,22 @@ class Interpreter(NodeVisitor):
                     break
 
     def visit_BinOp(self, node):
+        if node.short_circuit:
+            return self.eval_short_circuit(node)
         left = self.visit(node.left)
         right = self.visit(node.right)
+        cache = node.cache
+        if cache is not None and type(left) is cache[0] and type(right) is cache[1]:
+            if self.display_debug_messages:
+                self.count_inline_cache("BinOp", True)
+            return cache[2](left, right)
+        if self.display_debug_messages:
+            self.count_inline_cache("BinOp", False)
         op_type = node.op.type
+        operation = FAST_BINARY_OPERATIONS.get((op_type, type(left), type(right)))
+        node.cache = operation and (type(left), type(right), operation)
+        if operation:
+            return operation(left, right)
         try:
             if op_type == TokenType.PLUS:
                 return left + right
@@ -136,10 +325,6 @@ class Interpreter(NodeVisitor):
                 return left / right
             elif op_type == TokenType.MOD:
                 return left % right
-            elif op_type == TokenType.AND:
-                return left and right
-            elif op_type == TokenType.OR:
-                return left or right
             elif op_type == TokenType.EQUAL:
                 return left == right
             elif op_type == TokenType.NOT_EQUAL:
@@ -156,6 +341,11 @@ class Interpreter(NodeVisitor):
             self.error(ErrorCode.TYPE_ERROR, node.token,
                        f"'{node.op.value}' not supported between instances of '{type(left).__name__}' and '{type(right).__name__}'")
 
+    def eval_short_circuit(self, node):
+        if node.op.type == TokenType.AND:
+            return self.visit(node.left) and self.visit(node.right)
+        return self.visit(node.left) or self.visit(node.right)
+
     def visit_Const(self, node):
         return node.value
 
@@ -195,16 +385,18 @@ class Interpreter(NodeVisitor):
         else:
             value = self.visit(node.value)
             if isinstance(value, StatementList):
-                data = FunctionData(
+                value = FunctionData(
                     node.params_num, node.default_param_vals, node.value)
-            else:
-                data = Data(value)
-            self.current_scope.insert(data)
+            self.current_scope.insert(value)
 
     def visit_VarSet(self, node):
         value = self.visit(node.value)
         # Error: returns both types
-        if types := self.current_scope.set(node.scope_depth, node.mem_loc, value, node.add_mode):
+        if node.access and not self.display_debug_messages:
+            types = self.current_scope.store(node.access.distance, node.access.slot, value, node.add_mode)
+        else:
+            types = self.current_scope.set(node.scope_depth, node.mem_loc, value, node.add_mode)
+        if types:
             self.error(ErrorCode.TYPE_ERROR, node.token,
                        f"'+' not supported between instances of '{types[0].__name__}' and '{types[1].__name__}'")
 
@@ -212,17 +404,55 @@ class Interpreter(NodeVisitor):
         if self.current_python_module != builtins:
             self.error(ErrorCode.INVALID_VARIABLE, node.token,
                        f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
-        var = self.current_scope.get(node.scope_depth, node.mem_loc)
-        if not var:
+        if node.access and not self.display_debug_messages:
+            var = self.current_scope.load(node.access.distance, node.access.slot)
+        else:
+            var = self.current_scope.get(node.scope_depth, node.mem_loc)
+        if var is MISSING:
             self.error(ErrorCode.VARIABLE_MISSING, node.token,
                        f'm{"."*node.scope_depth}{node.mem_loc} seems to have been lost in the darkness that is CommaScript.')
-        value = var.value
+        var_type = type(var)
+        value = var.value if var_type is FunctionData or var_type is MacroData else var
         self.current_python_module = builtins
         self.leave_module_scope()
         if node.ref:
             return value
+        cache = node.cache
+        if cache is not None and var_type is cache[0]:
+            if self.display_debug_messages:
+                self.count_inline_cache("VarGet", True)
+            return cache[1](self, node, value) if cache[1] else value
+        if self.display_debug_messages:
+            self.count_inline_cache("VarGet", False)
+        node.cache = self.specialize_var_get(node, var, value)
         return self.eval_var_value(node, var, value)
 
+    def specialize_var_get(self, node, var, value):
+        """Returns the (value type, index method) a VarGet that read value from var can go straight to next time, if any."""
+        if isinstance(var, (FunctionData, MacroData)) or isfunction(value):
+            return None
+        if not node.indexer:
+            return (type(value), None)
+        if type(value) in (list, tuple, str):
+            return (type(value), Interpreter.index_sequence)
+        if type(value) is dict:
+            return (dict, Interpreter.index_dict)
+
+    def index_sequence(self, node, value):
+        index = self.visit(node.indexer)
+        val_len = len(value)
+        if not isinstance(index, int) or index < -val_len or index >= val_len:
+            self.error(ErrorCode.INDEX_ERROR, token=node.token,
+                       message=f"{index} is out of range of the given {type(value).__name__}")
+        return value[index]
+
+    def index_dict(self, node, value):
+        index = self.visit(node.indexer)
+        if index not in value:
+            self.error(ErrorCode.INDEX_ERROR, token=node.token,
+                       message=f"{index} does not exist in the given dictionary")
+        return value[index]
+
     def eval_referenced_function(self, token, function, *params):
         node = VarGet(token, False, 0, "-ref-func", params[0], None)
         var = FunctionData(len(params), [], function)
@@ -241,23 +471,38 @@ class Interpreter(NodeVisitor):
 
             self.current_scope = scope
 
-            self.function_stack.append(Function())
-            self.enter_scope(f"m{node.mem_loc}",
-                             self.current_scope.get_scope(node.scope_depth))
+            memo = None
+            if self.memo_size is not None:
+                result, memo = self.memoized(node, var, arg_values)
+                if result is not MISSING:
+                    return result
+
+            function = self.push_function(node.token)
+            function.memo = memo
+            if self.display_debug_messages:
+                self.enter_scope(f"m{node.mem_loc}",
+                                 self.current_scope.get_scope(node.scope_depth))
+            else:
+                self.enter_function_scope(f"m{node.mem_loc}",
+                                          self.current_scope.get_scope(node.scope_depth))
 
             for arg_val in arg_values:
                 if isinstance(arg_val, StatementList):
-                    data = FunctionData(0, [], arg_val)
-                else:
-                    data = Data(arg_val)
-                self.current_scope.insert(data)
+                    arg_val = FunctionData(0, [], arg_val)
+                self.current_scope.insert(arg_val)
 
             self.visit(value)
+            while function.tail_call:
+                self.visit(self.enter_tail_call(function))
 
-            self.leave_scope()
-            function = self.function_stack.pop()
-            return_value = function.return_value
-            return return_value
+            if self.display_debug_messages:
+                self.leave_scope()
+            else:
+                self.leave_function_scope()
+            self.function_stack.pop()
+            if memo:
+                memo[0].put(memo[1], function.return_value)
+            return function.return_value
         # Macro
         elif isinstance(var, MacroData):
             arg_values = [self.visit(arg) for arg in node.args] if visit_args else node.args
@@ -271,19 +516,10 @@ class Interpreter(NodeVisitor):
             self.current_macro_variables = None
         # List, Tuple, String - Indexed
         elif isinstance(value, (list, tuple, str)) and node.indexer:
-            index = self.visit(node.indexer)
-            val_len = len(value)
-            if not isinstance(index, int) or index < -val_len or index >= val_len:
-                self.error(ErrorCode.INDEX_ERROR, token=node.token,
-                           message=f"{index} is out of range of the given {type(value).__name__}")
-            return value[index]
+            return self.index_sequence(node, value)
         # Dictionary - Indexed
         elif isinstance(value, dict) and node.indexer:
-            index = self.visit(node.indexer)
-            if index not in value:
-                self.error(ErrorCode.INDEX_ERROR, token=node.token,
-                           message=f"{index} does not exist in the given dictionary")
-            return value[index]
+            return self.index_dict(node, value)
         elif isfunction(value):
             return value(self, node.token, *[self.visit(arg) for arg in node.args] if visit_args else node.args)
         elif node.indexer:
@@ -292,6 +528,81 @@ class Interpreter(NodeVisitor):
         else:
             return value
 
+    def push_function(self, token):
+        if self.max_depth is not None and len(self.function_stack) >= self.max_depth:
+            self.error(ErrorCode.MAX_DEPTH_EXCEEDED, token,
+                       f"Function calls can't be nested more than {self.max_depth} deep")
+        function = Function()
+        self.function_stack.append(function)
+        return function
+
+    # The compiled engines call functions and macros with arguments they have already evaluated,
+    # never with debug messages on, so nothing here is logged
+    def call_function(self, node, var, arg_values):
+        if var.default_param_vals:
+            self.add_default_args(node, var, arg_values)
+        memo = None
+        if self.memo_size is not None:
+            result, memo = self.memoized(node, var, arg_values)
+            if result is not MISSING:
+                return result
+
+        function = self.enter_function(node, var, arg_values, memo)
+        self.visit(var.value)
+        while function.tail_call:
+            self.visit(self.enter_tail_call(function))
+
+        self.leave_function_scope()
+        self.function_stack.pop()
+        if memo:
+            memo[0].put(memo[1], function.return_value)
+        return function.return_value
+
+    def add_default_args(self, node, var, arg_values):
+        scope = self.current_scope
+        self.current_scope = self.current_scope.get_scope(node.scope_depth)
+
+        for default_val in var.default_param_vals[var.params_num - len(arg_values)::]:
+            arg_values.append(self.visit(default_val))
+
+        self.current_scope = scope
+
+    def memoized(self, node, var, arg_values):
+        """The result cached for calling var with arg_values, or MISSING along with the (MemoCache, key)
+        to cache its result under, None when the call can't be memoized."""
+        body = var.value
+        if type(body) is not StatementList or not body.pure:
+            return MISSING, None
+        key = memo_key(arg_values)
+        if key is None:
+            return MISSING, None
+        cache = self.memo_caches.get(body)
+        if cache is None:
+            cache = self.memo_caches[body] = MemoCache(f"m{node.mem_loc} called on line {node.token.line}", self.memo_size)
+        return cache.get(key), (cache, key)
+
+    def enter_function(self, node, var, arg_values, memo=None):
+        """Everything call_function does before running the function's body, once its arguments are complete, returning its Function."""
+        function = self.push_function(node.token)
+        function.memo = memo
+        self.enter_function_scope(f"m{node.mem_loc}", self.current_scope.get_scope(node.scope_depth))
+        memory = self.current_scope._memory
+        for arg_val in arg_values:
+            memory.append(FunctionData(0, [], arg_val) if isinstance(arg_val, StatementList) else arg_val)
+        return function
+
+    def call_macro(self, var, arg_values):
+        self.enter_macro(var, arg_values)
+        self.visit(var.value)
+
+        self.current_macro_variables = None
+
+    def enter_macro(self, var, arg_values):
+        for default_val in var.default_param_vals[var.params_num - len(arg_values)::]:
+            arg_values.append(self.visit(default_val))
+
+        self.current_macro_variables = arg_values
+
     def visit_MacroDecl(self, node):
         data = MacroData(node.params_num, node.default_param_vals, node.value)
         self.current_scope.insert(data)
@@ -318,6 +629,15 @@ class Interpreter(NodeVisitor):
                        f"'{type(value).__name__}' does not support the use of indexers.")
         return value
 
+    def visit_Expansion(self, node):
+        if not node.args:
+            self.visit(node.body)
+            return
+        self.current_macro_variables = [self.visit(arg) for arg in node.args]
+        self.visit(node.body)
+
+        self.current_macro_variables = None
+
     def visit_Import(self, node):
         if node.from_python:
             if node.file_path not in Memory.imported_scopes:
@@ -338,8 +658,10 @@ class Interpreter(NodeVisitor):
         self.current_file_path = current_file_path
 
     def visit_ModuleGet(self, node):
-        module = self.current_scope.get_imported_scope(
-            node.scope_depth, node.mem_loc)
+        if node.access and not self.display_debug_messages:
+            module = self.current_scope.load_imported_scope(node.access.distance, node.access.slot)
+        else:
+            module = self.current_scope.get_imported_scope(node.scope_depth, node.mem_loc)
 
         if type(module) is ModuleType:
             self.current_python_module = module
@@ -359,7 +681,7 @@ class Interpreter(NodeVisitor):
         mode = 'r' if node.file_mode == TokenType.FILE_READ else 'w' if node.file_mode == TokenType.FILE_WRITE else 'a'
         self.enter_scope("openfile-block")
         with open(node.file_path, mode) as file:
-            self.current_scope.insert(Data(file))
+            self.current_scope.insert(file)
             self.visit(node.value)
         self.leave_scope()
 
@@ -368,23 +690,25 @@ class Interpreter(NodeVisitor):
 
     def visit_If(self, node):
         if self.visit(node.conditional):
-            self.enter_scope("if-block")
+            self.enter_block_scope("if-block", node.value)
             self.visit(node.value)
             self.leave_scope()
         elif node.else_value:
             if isinstance(node.else_value, If):
                 self.visit(node.else_value)
             else:
-                self.enter_scope("else-block")
+                self.enter_block_scope("else-block", node.else_value)
                 self.visit(node.else_value)
                 self.leave_scope()
 
     def visit_While(self, node):
+        if node.invariants:
+            forget_invariants(node.invariants)
         loop = Loop()
         self.loop_stack.append(loop)
         while self.visit(node.conditional):
             loop.continuing = False
-            self.enter_scope("while-block")
+            self.enter_block_scope("while-block", node.value)
             self.visit(node.value)
             self.leave_scope()
             if (len(self.function_stack) > 0 and self.function_stack[-1].has_return_value or
@@ -395,14 +719,20 @@ class Interpreter(NodeVisitor):
     def visit_For(self, node):
         iter = self.visit(node.iterable)
         iter = range(iter) if isinstance(iter, int) else iter
+        if node.invariants:
+            forget_invariants(node.invariants)
         loop = Loop()
         self.loop_stack.append(loop)
+        scope = None
         try:
             for i in iter:
                 loop.continuing = False
-                self.enter_scope("for-block")
-                data = Data(i)
-                self.current_scope.insert(data)
+                if scope is None or self.display_debug_messages:
+                    self.enter_scope("for-block")
+                    self.current_scope.insert(i)
+                    scope = self.current_scope
+                else:
+                    self.reenter_loop_scope(scope, i)
                 self.visit(node.value)
                 self.leave_scope()
                 if (len(self.function_stack) > 0 and self.function_stack[-1].has_return_value or
@@ -413,9 +743,74 @@ class Interpreter(NodeVisitor):
                        f"'{type(iter).__name__}' is not iterable")
         self.loop_stack.pop()
 
+    def visit_Invariant(self, node):
+        value = node.values[node.index]
+        if value is MISSING:
+            value = self.visit(node.expr)
+            if type(value) in INVARIANT_VALUE_TYPES:
+                node.values[node.index] = value
+        return value
+
     def visit_Return(self, node):
+        if node.tail_call is not None and not self.display_debug_messages:
+            return self.visit_tail_call(node)
         return self.visit(node.expr)
 
+    def visit_tail_call(self, node):
+        call = node.expr
+        if self.current_python_module != builtins:
+            self.error(ErrorCode.INVALID_VARIABLE, call.token,
+                       f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
+        if call.access:
+            var = self.current_scope.load(call.access.distance, call.access.slot)
+        else:
+            var = self.current_scope.get(call.scope_depth, call.mem_loc)
+        if var is MISSING:
+            self.error(ErrorCode.VARIABLE_MISSING, call.token,
+                       f'm{"."*call.scope_depth}{call.mem_loc} seems to have been lost in the darkness that is CommaScript.')
+        self.current_python_module = builtins
+        self.leave_module_scope()
+        if type(var) is not FunctionData:
+            return self.eval_var_value(call, var, var.value if type(var) is MacroData else var)
+        self.prepare_tail_call(node, var, [self.visit(arg) for arg in call.args])
+
+    # A call in tail position is left for the function returning it to make, once its body has been
+    # left, so a chain of them runs in a loop rather than nesting a python call for each
+
+    def prepare_tail_call(self, node, var, arg_values):
+        call = node.expr
+        scope = self.current_scope
+        self.current_scope = self.current_scope.get_scope(call.scope_depth)
+
+        for default_val in var.default_param_vals[var.params_num - len(arg_values)::]:
+            arg_values.append(self.visit(default_val))
+
+        self.current_scope = scope
+        # The caller's scope is only still needed when the call was found in it or a block inside it
+        self.function_stack[-1].tail_call = (call, var, arg_values, scope.get_scope(call.scope_depth),
+                                             call.scope_depth > node.tail_call)
+
+    def enter_tail_call(self, function):
+        """Leaves function for the call it returned in tail position, returning the body to run next."""
+        call, var, arg_values, enclosing_scope, rebind = function.tail_call
+        function.tail_call = None
+        function.return_value = None
+        function.has_return_value = False
+        scope = self.current_scope
+        if rebind:
+            scope._memory.clear()
+            if scope.imported_file_paths:
+                scope.imported_file_paths.clear()
+            scope.scope_name = f"m{call.mem_loc}"
+            scope.enclosing_scope = enclosing_scope
+        else:
+            self.current_scope = Memory(self.current_file_path, f"m{call.mem_loc}", scope.scope_level,
+                                        enclosing_scope, scope.scope_to_return_to)
+        memory = self.current_scope._memory
+        for arg_val in arg_values:
+            memory.append(FunctionData(0, [], arg_val) if isinstance(arg_val, StatementList) else arg_val)
+        return var.value
+
     def visit_Break(self, node):
         pass
 
@@ -424,7 +819,7 @@ class Interpreter(NodeVisitor):
 
     def visit_BuiltInFunction(self, node):
         function = getattr(self.current_python_module,
-                           node.name) if node.from_python else globals()['cs_' + node.name.lower()]
+                           node.name) if node.from_python else node.built_in.function
         self.current_python_module = builtins
         if node.ref:
             return function
@@ -458,27 +853,66 @@ class Interpreter(NodeVisitor):
         pass
 
 
+def count_option(arg, default=None):
+    """The number given to an option like --jobs=N, or default when there's no =N. Exits when it isn't a number."""
+    name, _, value = arg.partition("=")
+    if not value and default is not None:
+        return default
+    try:
+        count = int(value)
+    except ValueError:
+        count = None
+    if count is None or count < 0:
+        print(f"Invalid {name} value '{value}', expected a whole number, 0 or more")
+        sys.exit(1)
+    return count
+
+
 if __name__ == "__main__":
     if len(sys.argv) <= 1:
         print("Unspecified file")
     else:
         file_path = sys.argv[1]
-        file_contents = ""
-        with open(file_path) as file:
-            file_contents = file.read()
 
-        debug_messages = False
-        if len(sys.argv) > 2 and sys.argv[2] == "--debug":
-            debug_messages = True
+        debug_messages = "--debug" in sys.argv[2:]
+
+        # --jobs parses and analyzes imported modules in parallel, --jobs=N uses N processes
+        jobs = None
+        for arg in sys.argv[2:]:
+            if arg == "--jobs" or arg.startswith("--jobs="):
+                jobs = count_option(arg, 0)
+
+        # --engine=vm runs the program as bytecode, --engine=closures as compiled Python closures and
+        # --engine=python as a generated Python module, debug messages always come from the tree walker
+        engine = "tree"
+        for arg in sys.argv[2:]:
+            if arg.startswith("--engine="):
+                engine = arg.partition("=")[2]
+        if engine not in ("tree", "vm", "closures", "python"):
+            print(f"Unknown engine {engine}, expected tree, vm, closures or python")
+            sys.exit(1)
+
+        # --max-depth=N makes nesting function calls more than N deep an error
+        max_depth = None
+        for arg in sys.argv[2:]:
+            if arg.startswith("--max-depth="):
+                max_depth = count_option(arg)
+
+        # --memoize caches the results of pure functions, --memoize=N keeps N results of each
+        memo_size = None
+        for arg in sys.argv[2:]:
+            if arg == "--memoize" or arg.startswith("--memoize="):
+                memo_size = count_option(arg, DEFAULT_MEMO_SIZE)
 
         if debug_messages:
             h = " Parser "
             print(f"\n{'-'*len(h)}\n{h}\n{'-'*len(h)}\n")
 
         try:
-            lexer = Lexer(file_contents)
-            parser = Parser(lexer, file_path, debug_messages)
-            tree = parser.parse()
+            if jobs is not None and not debug_messages:
+                tree = import_graph.build(file_path, jobs)
+            else:
+                tree = Parser.parse_file(file_path, debug_messages)
         except (ParserError, LexerError) as e:
             print(e.message)
             sys.exit(1)
@@ -494,13 +928,48 @@ if __name__ == "__main__":
             print(e.message)
             sys.exit(1)
 
+        # Debug messages follow the program as it was written, so it's only rewritten without them
+        if not debug_messages:
+            from optimizer import Optimizer
+            Optimizer(semantic_analyzer).optimize(tree)
+
+        # --dump-optimized prints the tree the engines run, rather than running it
+        if "--dump-optimized" in sys.argv[2:]:
+            print(tree)
+            sys.exit(0)
+
         if debug_messages:
             h = " Interpreter "
             print(f"\n{'-'*len(h)}\n{h}\n{'-'*len(h)}\n")
 
-        interpreter = Interpreter(file_path, debug_messages)
+        if engine == "vm" and not debug_messages:
+            from vm import VirtualMachine
+            interpreter = VirtualMachine(file_path, max_depth=max_depth, memo_size=memo_size)
+        elif engine == "closures" and not debug_messages:
+            from closures import ClosureInterpreter
+            interpreter = ClosureInterpreter(file_path, max_depth=max_depth, memo_size=memo_size)
+        elif engine == "python" and not debug_messages:
+            from transpiler import TranspiledInterpreter
+            interpreter = TranspiledInterpreter(file_path, max_depth=max_depth, memo_size=memo_size)
+        else:
+            interpreter = Interpreter(file_path, debug_messages, max_depth, memo_size)
         try:
             interpreter.visit(tree)
         except InterpreterError as e:
             print(e.message)
             sys.exit(1)
+        except RecursionError:
+            # Only the vm keeps function calls off the python stack
+            print(f"\u001b[31mFunction calls nested too deep for the {'tree' if debug_messages else engine} engine" +
+                  ("" if engine == "vm" and not debug_messages else ", try --engine=vm") + "\u001b[0m")
+            sys.exit(1)
+
+        if debug_messages:
+            h = " Inline Caches "
+            print(f"\n{'-'*len(h)}\n{h}\n{'-'*len(h)}\n")
+            interpreter.log_inline_caches()
+
+            if memo_size is not None:
+                h = " Memoization "
+                print(f"\n{'-'*len(h)}\n{h}\n{'-'*len(h)}\n")
+                interpreter.log_memo_caches()
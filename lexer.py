@@ -1,308 +1,232 @@
+import re
 import sys
+import codecs
+from sys import intern
 from error import *
 from cstoken import *
 
 
+def _build_punctuation():
+    punctuation = {
+        token_type.value: token_type
+        for token_type in TokenType
+        if not any(char.isalpha() for char in token_type.value)
+    }
+    return punctuation
+
+
+PUNCTUATION = _build_punctuation()
+
+# One alternative per token kind, tried in the same order get_next_token used to check
+# them. Longer operators come first so '**' wins over '*', '<\' over '<' and so on.
+TOKEN_PATTERN = r'''
+      (?P<number>\d+(?:\.\d+)?)
+    | (?P<string>"(?P<dq>(?:\\.?|[^"\\])*)"?|'(?P<sq>(?:\\.?|[^'\\])*)'?)
+    | (?P<boolean>[tT]|[fF](?![rRwWaAiI]))
+    | (?P<id>[^\W\d_]+)
+    | (?P<punctuation>''' + '|'.join(
+    re.escape(value) for value in sorted(PUNCTUATION, key=len, reverse=True)) + ''')
+'''
+SKIP_PATTERN = r'(?:\s|\#[^#]*(?:\#|\Z))+'
+
+TOKEN_REGEX = re.compile(
+    f'(?P<skip>{SKIP_PATTERN})|{TOKEN_PATTERN}', re.VERBOSE | re.DOTALL)
+# Outside of f-strings whitespace and comments are skipped as part of the token match
+PLAIN_TOKEN_REGEX = re.compile(
+    f'(?:{SKIP_PATTERN})?(?:(?P<backtick>`)|(?P<eof>\Z)|{TOKEN_PATTERN})', re.VERBOSE | re.DOTALL)
+SKIP_REGEX = re.compile(f'(?:{SKIP_PATTERN})?')
+F_STRING_PORTION_REGEX = re.compile(r'(?:\\.?|[^`{\\])+', re.DOTALL)
+
+# Characters a streamed source keeps buffered past the end of a match, enough to
+# tell '1' from '1.5', '*' from '**' and 'f' from 'fr'
+LOOKAHEAD = 2
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
 class Lexer():
-    def __init__(self, text):
-        self.text = text
+    """Tokenizes CommaScript source.
+
+    source is either the whole text as a str, or a file object or mmap that is read
+    chunk_size characters (or bytes, which are decoded as UTF-8) at a time. A
+    streamed source only keeps the text that has not been tokenized yet plus the
+    next chunk in memory.
+    """
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
         self.pos = 0
-        self.line = 1
-        self.column = 1
-        self.current_char = self.text[self.pos] if self.pos < len(
-            self.text) else None
+        # Offset of self.text within the whole source
+        self.offset = 0
         self.in_formatted_string = False
         self.in_f_string_var = False
+        if isinstance(source, str):
+            self.text = source
+            self.source = None
+            self.line_index = LineIndex(source)
+        else:
+            self.text = ''
+            self.source = source
+            self.chunk_size = chunk_size
+            self.decoder = codecs.getincrementaldecoder('utf-8')()
+            self.line_index = LineIndex()
+        self.length = len(self.text)
+
+    @property
+    def current_char(self):
+        return self.text[self.pos] if self.pos < self.length else None
 
     def error(self):
-        s = f"\u001b[31mError on '{self.current_char}' column: {self.pos}\u001b[0m"
+        s = f"\u001b[31mError on '{self.current_char}' column: {self.offset + self.pos}\u001b[0m"
         raise LexerError(message=s)
 
-    def advance(self, amount=1):
-        while amount > 0:
-            self.pos += 1
-            amount -= 1
-            if self.pos > len(self.text) - 1:
-                self.current_char = None
+    def read_chunk(self):
+        data = self.source.read(self.chunk_size)
+        chunk = self.decoder.decode(data, final=not data) if isinstance(data, bytes) else data
+        if not data:
+            self.source = None
+        self.offset += self.pos
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        self.length = len(self.text)
+        self.line_index.extend(chunk)
+
+    def fill(self, amount=LOOKAHEAD):
+        while self.source is not None and self.pos + amount > self.length:
+            self.read_chunk()
+
+    def complete_match(self, regex, match):
+        # A match that runs into the end of what has been read so far could still grow
+        while self.source is not None:
+            end = match.end() if match else SKIP_REGEX.match(self.text, self.pos).end()
+            if end + LOOKAHEAD <= self.length:
                 break
-            else:
-                self.current_char = self.text[self.pos]
-                if self.current_char == '\n':
-                    self.line += 1
-                    self.column = 1
-                else:
-                    self.column += 1
+            self.read_chunk()
+            match = regex.match(self.text, self.pos)
+        return match
+
+    def advance(self, amount=1):
+        self.pos += amount
 
     def peek(self, peek_amount=1):
+        self.fill(peek_amount + 1)
         peek_pos = self.pos + peek_amount
-        if peek_pos > len(self.text) - 1:
+        if peek_pos > self.length - 1:
             return None
         else:
             return self.text[peek_pos]
 
     def check(self, string):
+        self.fill(len(string))
         end_pos = self.pos + len(string)
-        if end_pos > len(self.text):
+        if end_pos > self.length:
             return False
         return self.text[self.pos: end_pos].upper() == string.upper()
 
+    def last_pos(self, pos):
+        # Tokens reported at their end never point past the last character
+        return self.offset + (pos if pos < self.length else self.length - 1)
+
     def get_next_token(self):
+        if self.in_formatted_string:
+            return self.f_string_token()
+
+        match = PLAIN_TOKEN_REGEX.match(self.text, self.pos)
+        if self.source is not None:
+            match = self.complete_match(PLAIN_TOKEN_REGEX, match)
+        if match is None:
+            self.pos = SKIP_REGEX.match(self.text, self.pos).end()
+            self.error()
+        kind = match.lastgroup
+        self.pos = match.end()
+
+        if kind == 'punctuation':
+            token_type = PUNCTUATION[match.group(kind)]
+            # Every punctuation token shares its type's value string rather than a fresh slice of the source.
+            # Multi-character operators report where they end, single ones where they start
+            return Token(
+                token_type,
+                token_type.value,
+                self.last_pos(self.pos) if self.pos - match.start(kind) > 1 else self.offset + match.start(kind),
+                self.line_index
+            )
+
+        if kind == 'backtick':
+            self.in_formatted_string = True
+            return Token(TokenType.BACKTICK, TokenType.BACKTICK.value, self.last_pos(self.pos), self.line_index)
+
+        if kind == 'eof':
+            return Token(TokenType.EOF, None, self.offset + self.pos, self.line_index)
+
+        return self.build_token(kind, match, match.start(kind))
+
+    def f_string_token(self):
         while True:
-            if self.current_char == "`":
-                self.in_formatted_string = not self.in_formatted_string
-                self.advance()
-                return Token(
-                    TokenType.BACKTICK,
-                    TokenType.BACKTICK.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.in_formatted_string:
-                if self.current_char == "{":
-                    self.in_f_string_var = True
-                if not self.in_f_string_var:
-                    return self.f_string_portion()
-                if self.current_char == "}":
-                    self.in_f_string_var = False
-
-            if self.current_char and self.current_char.isspace():
-                self.advance()
-                continue
-
-            if self.current_char == '#':
-                self.advance()
-                while self.current_char and self.current_char != '#':
-                    self.advance()
-                self.advance()
-                continue
-
-            if not self.current_char:
-                return Token(TokenType.EOF, None, self.line, self.column + 1)
-
-            if self.current_char.isdigit():
-                return self.number()
-
-            if self.current_char == "'" or self.current_char == '"':
-                return self.string()
-
-            if self.current_char.upper() == 'T' or self.current_char.upper() == 'F' and self.peek().upper() not in ('R', 'W', 'A', 'I'):
-                return self.boolean()
-
-            if self.current_char.isalpha():
-                return self.id()
-
-            if self.check('**'):
-                self.advance(2)
-                return Token(
-                    TokenType.EXPO,
-                    TokenType.EXPO.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('//'):
-                self.advance(2)
-                return Token(
-                    TokenType.INT_DIV,
-                    TokenType.INT_DIV.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('++'):
-                self.advance(2)
-                return Token(
-                    TokenType.PLUS_PLUS,
-                    TokenType.PLUS_PLUS.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('--'):
-                self.advance(2)
-                return Token(
-                    TokenType.MINUS_MINUS,
-                    TokenType.MINUS_MINUS.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('<='):
-                self.advance(2)
-                return Token(
-                    TokenType.LTHAN_OR_EQUAL,
-                    TokenType.LTHAN_OR_EQUAL.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('>='):
-                self.advance(2)
-                return Token(
-                    TokenType.GTHAN_OR_EQUAL,
-                    TokenType.GTHAN_OR_EQUAL.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('<\\'):
-                self.advance(2)
-                return Token(
-                    TokenType.LTHAN,
-                    TokenType.LTHAN.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('>\\'):
-                self.advance(2)
-                return Token(
-                    TokenType.GTHAN,
-                    TokenType.GTHAN.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('!='):
-                self.advance(2)
-                return Token(
-                    TokenType.NOT_EQUAL,
-                    TokenType.NOT_EQUAL.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('=>'):
-                self.advance(2)
-                return Token(
-                    TokenType.SET_TO,
-                    TokenType.SET_TO.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('??'):
-                self.advance(2)
-                return Token(
-                    TokenType.WHILE,
-                    TokenType.WHILE.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('?/'):
-                self.advance(2)
-                return Token(
-                    TokenType.FOR,
-                    TokenType.FOR.value,
-                    self.line,
-                    self.column
-                )
-
-            if self.check('||'):
-                self.advance(2)
-                return Token(
-                    TokenType.PARAM_SEP,
-                    TokenType.PARAM_SEP.value,
-                    self.line,
-                    self.column
-                )
-
-            try:
-                token_type = TokenType(self.current_char)
-            except:
+            self.fill()
+            pos = self.pos
+            char = self.text[pos] if pos < self.length else None
+
+            if char == "`":
+                self.in_formatted_string = False
+                self.pos = pos + 1
+                return Token(TokenType.BACKTICK, TokenType.BACKTICK.value, self.last_pos(pos + 1), self.line_index)
+
+            if char == "{":
+                self.in_f_string_var = True
+            if not self.in_f_string_var:
+                return self.f_string_portion()
+            if char == "}":
+                self.in_f_string_var = False
+
+            if char is None:
+                return Token(TokenType.EOF, None, self.offset + pos, self.line_index)
+
+            match = TOKEN_REGEX.match(self.text, pos)
+            if self.source is not None:
+                match = self.complete_match(TOKEN_REGEX, match)
+            if match is None:
                 self.error()
-            else:
-                token = Token(
-                    type=token_type,
-                    value=token_type.value,
-                    line=self.line,
-                    column=self.column
-                )
-                self.advance()
-                return token
-
-    def number(self):
-        token = Token(type=None, value=None,
-                      line=self.line, column=self.column)
-
-        result = ''
-        while self.current_char and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-        if self.current_char == '.' and (peeked_char := self.peek()) and peeked_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-            while self.current_char and self.current_char.isdigit():
-                result += self.current_char
-                self.advance()
-
-            token.type = TokenType.FLOAT_CONST
-            token.value = float(result)
-        else:
-            token.type = TokenType.INT_CONST
-            token.value = int(result)
-
-        return token
-
-    def string(self):
-        result = ''
-        col = self.column
-        line = self.line
-        marker = self.current_char
-        self.advance()
-        while self.current_char and self.current_char != marker:
-            if self.current_char == "\\":
-                result += self.current_char
-                self.advance()
-            result += self.current_char
-            self.advance()
-        self.advance()
-
-        return Token(type=TokenType.STR_CONST, value=result, line=line, column=col)
+            kind = match.lastgroup
+            start = match.start()
+            self.pos = match.end()
+
+            if kind != 'skip':
+                return self.build_token(kind, match, start)
+
+    def build_token(self, kind, match, start):
+        if kind == 'punctuation':
+            token_type = PUNCTUATION[match.group(kind)]
+            return Token(
+                token_type,
+                token_type.value,
+                self.last_pos(self.pos) if self.pos - start > 1 else self.offset + start,
+                self.line_index
+            )
+
+        if kind == 'id':
+            result = intern(match.group(kind))
+            token_type = RESERVED_KEYWORDS.get(result.upper(), TokenType.FUNCTION)
+            return Token(token_type, result, self.offset + start, self.line_index)
+
+        if kind == 'number':
+            result = match.group(kind)
+            if '.' in result:
+                return Token(TokenType.FLOAT_CONST, float(result), self.offset + start, self.line_index)
+            return Token(TokenType.INT_CONST, int(result), self.offset + start, self.line_index)
+
+        if kind == 'string':
+            result = intern(match.group('dq') if self.text[start] == '"' else match.group('sq'))
+            return Token(TokenType.STR_CONST, result, self.offset + start, self.line_index)
+
+        return Token(TokenType.BOOL_CONST, self.text[start] in 'tT', self.offset + start, self.line_index)
 
     def f_string_portion(self):
-        if not self.current_char:
-            return Token(TokenType.EOF, None, self.line, self.column)
-        result = ''
-        col = self.column
-        line = self.line
-        while self.current_char and self.current_char not in "`{":
-            if self.current_char == "\\":
-                result += self.current_char
-                self.advance()
-            result += self.current_char
-            self.advance()
-
-        return Token(TokenType.STR_CONST, result, line, col)
-
-    def boolean(self):
-        result = self.current_char.upper() == 'T'
-        col = self.column
-        line = self.line
-        self.advance()
-        return Token(type=TokenType.BOOL_CONST, value=result, line=line, column=col)
-
-    def id(self):
-        token = Token(type=None, value=None,
-                      line=self.line, column=self.column)
-        result = ''
-        while self.current_char and self.current_char.isalpha():
-            result += self.current_char
-            self.advance()
-
-        token_type = RESERVED_KEYWORDS.get(result.upper())
-        if token_type is None:
-            token.type = TokenType.FUNCTION
-            token.value = result
-        else:
-            # reserved keyword
-            token.type = token_type
-            token.value = result
-
+        if self.pos >= self.length:
+            # Unlike the end of the file proper, an unterminated f-string ends on its last character
+            return Token(TokenType.EOF, None, self.offset + self.length - 1, self.line_index)
+        match = F_STRING_PORTION_REGEX.match(self.text, self.pos)
+        if self.source is not None:
+            match = self.complete_match(F_STRING_PORTION_REGEX, match)
+        token = Token(TokenType.STR_CONST, match.group(), self.offset + match.start(), self.line_index)
+        self.pos = match.end()
         return token
 
 
@@ -312,9 +236,9 @@ if __name__ == "__main__":
     else:
         file_path = sys.argv[1]
         with open(file_path) as file:
-            lexer = Lexer(file.read())
-        while True:
-            token = lexer.get_next_token()
-            input(token)
-            if token.type == TokenType.EOF:
-                break
+            lexer = Lexer(file)
+            while True:
+                token = lexer.get_next_token()
+                input(token)
+                if token.type == TokenType.EOF:
+                    break
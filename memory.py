@@ -26,17 +26,21 @@ class MacroData(object):
     __repr__ = __str__
 
 
-class Data(object):
-    def __init__(self, value):
-        self.value = value
+# Returned by get and load for a slot that does not exist, since None is a value a slot can hold
+MISSING = object()
 
-    def __str__(self):
-        return f"<Data(value = {self.value}, type = {type(self.value)})>"
 
-    __repr__ = __str__
+def describe(value):
+    """How a slot's value is shown in debug messages, a FunctionData or MacroData as itself and data as it always was."""
+    if isinstance(value, (FunctionData, MacroData)):
+        return str(value)
+    return f"<Data(value = {value}, type = {type(value)})>"
 
 
 class Memory(object):
+    """A scope's slots, holding data values as they are and functions and macros as their FunctionData or MacroData."""
+    __slots__ = ('_memory', 'file_path', 'scope_name', 'scope_level', 'enclosing_scope',
+                 'scope_to_return_to', 'display_debug_messages', 'imported_file_paths')
     imported_scopes = {}
 
     def __init__(self, file_path, scope_name, scope_level, enclosing_scope=None, scope_to_return_to=None, display_debug_messages=False):
@@ -69,7 +73,7 @@ class Memory(object):
             f"Imported Files : {', '.join([file_name for file_name in self.imported_file_paths])}")
         h2 = 'Memory contents'
         lines.extend([h2, '-' * len(h2)])
-        lines.extend([str(data) for data in self._memory])
+        lines.extend([describe(value) for value in self._memory])
         lines.append('\n')
         s = '\n'.join(lines)
         return s
@@ -87,9 +91,9 @@ class Memory(object):
         if self.display_debug_messages:
             print(msg)
 
-    def insert(self, data):
-        self.log('Define: %s' % data)
-        self._memory.append(data)
+    def insert(self, value):
+        self.log('Define: %s' % describe(value))
+        self._memory.append(value)
 
     def get(self, scope_depth, mem_loc):
         self.log(
@@ -97,16 +101,37 @@ class Memory(object):
         if scope_depth > 0:
             if self.enclosing_scope is not None:
                 return self.enclosing_scope.get(scope_depth - 1, mem_loc)
-            return None
+            return MISSING
         if mem_loc < len(self._memory):
             return self._memory[mem_loc]
+        return MISSING
 
     def get_scope(self, scope_depth):
-        if scope_depth > 0:
-            if self.enclosing_scope is not None:
-                return self.enclosing_scope.get_scope(scope_depth - 1)
-            return None
-        return self
+        scope = self
+        for _ in range(scope_depth):
+            scope = scope.enclosing_scope
+            if scope is None:
+                return None
+        return scope
+
+    # load, store and load_imported_scope do the same as get, set and get_imported_scope for
+    # accesses the semantic analyzer resolved, without the recursive walk or the logging
+
+    def load(self, distance, slot):
+        scope = self.get_scope(distance) if distance else self
+        if scope is not None and slot < len(scope._memory):
+            return scope._memory[slot]
+        return MISSING
+
+    def store(self, distance, slot, value, add_mode):
+        scope = self.get_scope(distance) if distance else self
+        if scope is not None and slot < len(scope._memory):
+            return scope.assign(slot, value, add_mode)
+
+    def load_imported_scope(self, distance, slot):
+        scope = self.get_scope(distance) if distance else self
+        if scope is not None and slot < len(scope.imported_file_paths):
+            return Memory.imported_scopes[scope.imported_file_paths[slot]]
 
     def set(self, scope_depth, mem_loc, value, add_mode):
         self.log(
@@ -115,13 +140,31 @@ class Memory(object):
             if self.enclosing_scope is not None:
                 return self.enclosing_scope.set(scope_depth - 1, mem_loc, value, add_mode)
         elif mem_loc < len(self._memory):
+            return self.assign(mem_loc, value, add_mode)
+
+    def assign(self, slot, value, add_mode):
+        """Sets the value in slot, returning the types involved if adding them failed.
+
+        A function or macro keeps its parameters and has only its value replaced.
+        """
+        memory = self._memory
+        current = memory[slot]
+        if isinstance(current, (FunctionData, MacroData)):
             if add_mode:
                 try:
-                    self._memory[mem_loc].value += value
+                    current.value += value
                 except:
-                    return (type(self._memory[mem_loc].value), type(value))
+                    return (type(current.value), type(value))
             else:
-                self._memory[mem_loc].value = value
+                current.value = value
+        elif add_mode:
+            try:
+                current += value
+            except:
+                return (type(current), type(value))
+            memory[slot] = current
+        else:
+            memory[slot] = value
 
     def import_scope(self, scope):
         try:
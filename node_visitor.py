@@ -1,14 +1,26 @@
 class NodeVisitor(object):
     def __init__(self, display_debug_messages=False):
         self.display_debug_messages = display_debug_messages
+        # Node class -> bound visit_ method, filled in the first time each class is visited
+        self.visitors = {}
+        if display_debug_messages:
+            self.visit = self.traced_visit
 
     def visit(self, node):
-        if self.display_debug_messages:
-            print(f"VISITING {type(node).__name__}")
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
+        visitor = self.visitors.get(type(node))
+        if visitor is None:
+            visitor = self.resolve_visitor(type(node))
         return visitor(node)
 
+    def resolve_visitor(self, node_type):
+        visitor = getattr(self, 'visit_' + node_type.__name__, self.generic_visit)
+        self.visitors[node_type] = visitor
+        return visitor
+
+    def traced_visit(self, node):
+        print(f"VISITING {type(node).__name__}")
+        return type(self).visit(self, node)
+
     def generic_visit(self, node):
         if self.display_debug_messages:
             print(self.current_scope)
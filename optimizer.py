@@ -0,0 +1,618 @@
+import copy
+import hashlib
+
+from interpreter import *
+from vm import BINARY_OPERATORS, child_nodes
+
+# Bump whenever a change to the Optimizer gives trees it rewrites a different shape
+OPTIMIZER_VERSION = 6
+
+# Folded strings and ints bigger than this are left for the interpreter to build, rather than
+# spending the time and memory on them before the program even starts
+MAX_FOLDED_SIZE = 4096
+
+# Operators that give a number or a bool whatever they're given, or raise
+NUMERIC_OPERATORS = {TokenType.MINUS, TokenType.INT_DIV, TokenType.FLOAT_DIV, TokenType.EXPO, TokenType.EQUAL,
+                     TokenType.NOT_EQUAL, TokenType.LTHAN, TokenType.GTHAN, TokenType.LTHAN_OR_EQUAL,
+                     TokenType.GTHAN_OR_EQUAL}
+# and built-ins that do
+NUMERIC_BUILT_INS = {'l', 'ci', 'cf', 'cb', 'ab'}
+
+CONST_TOKEN_TYPES = {bool: TokenType.BOOL_CONST, int: TokenType.INT_CONST,
+                     float: TokenType.FLOAT_CONST, str: TokenType.STR_CONST}
+
+
+def is_constant(node):
+    return type(node) is Const or node is NULL
+
+
+def constant_value(node):
+    return None if node is NULL else node.value
+
+
+def too_big(value):
+    if type(value) is str:
+        return len(value) > MAX_FOLDED_SIZE
+    return type(value) is int and value.bit_length() > MAX_FOLDED_SIZE
+
+
+class Hoister(NodeVisitor):
+    """Wraps the expressions in a loop that give the same value every time round in Invariants.
+
+    Only loops that call nothing but built-ins that leave their arguments alone are hoisted from,
+    as anything else could set any variable or change any collection. It also means nothing else
+    can run while the loop does, so its Invariants' values are kept on the loop rather than in
+    slots of the scope it's in, which would move the slots of everything declared after it.
+    """
+
+    def __init__(self):
+        super(Hoister, self).__init__()
+        # How many scopes the node being visited is nested in, below the one the loop is in
+        self.level = 0
+        # (level, slot) of every variable the loop sets, and the slots of sets the analyzer couldn't resolve
+        self.sets = set()
+        self.unknown_sets = set()
+        # Whether the loop sets a slot counted from the end of its scope, which could be any of them
+        self.sets_anything = False
+        self.values = []
+
+    def hoist_loop(self, loop):
+        """Hoists what it can out of a While or For, which it's run on once the Optimizer has rewritten it."""
+        self.loop = loop
+        if isinstance(loop, While):
+            if not self.scan(loop.conditional) or not self.scan(loop.value):
+                return
+            loop.conditional = self.hoist(loop.conditional)
+        # A for loop's iterable is only ever computed once
+        elif not self.scan(loop.value):
+            return
+        self.visit(loop.value)
+        if self.values:
+            loop.invariants = self.values
+
+    def scan(self, node):
+        """Records the variables node sets, returning False if running it could do anything else."""
+        kind = type(node)
+        if kind is StatementList:
+            self.level += 1
+            safe = all(self.scan(child) for child in node.children)
+            self.level -= 1
+            return safe
+        if kind in (ModuleGet, Import, OpenFile, GetAttr, MacroVarGet, Expansion):
+            return False
+        if kind is VarGet:
+            # Only variables the analyzer knows hold data, which those of a function with defaults never are,
+            # since the slots of everything in it move with how many optional arguments it's passed
+            if node.ref or node.args or node.access is None or node.access.kind not in (AccessKind.DATA, AccessKind.PARAMETER):
+                return False
+        elif kind is BuiltInFunction:
+            if node.from_python or node.name in MUTATING_BUILT_INS:
+                return False
+        elif kind is VarSet:
+            if node.mem_loc < 0:
+                self.sets_anything = True
+            elif node.access is None:
+                self.unknown_sets.add(node.mem_loc)
+            else:
+                self.sets.add((self.level - node.access.distance, node.access.slot))
+            # Adding anything but a number to a list extends it in place, for every variable holding it
+            if node.add_mode and not self.numeric(node.value):
+                return False
+        elif kind is MacroDecl or kind is VarDecl and isinstance(node.value, StatementList):
+            # Declaring a function or macro doesn't run it
+            return True
+        return all(self.scan(child) for child in child_nodes(node))
+
+    def numeric(self, node):
+        """Whether node can only give a number or a bool, if it doesn't raise."""
+        kind = type(node)
+        if kind is Const:
+            return type(node.value) in (int, float, bool)
+        if kind is UnaryOp:
+            return self.numeric(node.expr)
+        if kind is BinOp:
+            if node.op.type in NUMERIC_OPERATORS:
+                return True
+            return not node.short_circuit and self.numeric(node.left) and self.numeric(node.right)
+        if kind is BuiltInFunction:
+            return not node.from_python and not node.ref and node.name in NUMERIC_BUILT_INS
+        # The variable of a for loop over a number of items
+        return (kind is VarGet and type(self.loop) is For and type(self.loop.iterable) is Const and
+                type(self.loop.iterable.value) is int and self.level - node.scope_depth == 1 and node.mem_loc == 0 and
+                not node.indexer)
+
+    def invariant(self, node):
+        kind = type(node)
+        if kind is Const or node is NULL:
+            return True
+        if kind is VarGet:
+            # scan has already turned the loop down if any variable it gets wasn't resolved
+            access = node.access
+            level = self.level - access.distance
+            return (level <= 0 and access.slot >= 0 and not self.sets_anything and (level, access.slot) not in self.sets and
+                    access.slot not in self.unknown_sets and (node.indexer is None or self.invariant(node.indexer)))
+        if kind is BinOp:
+            return self.invariant(node.left) and self.invariant(node.right)
+        if kind is UnaryOp:
+            return self.invariant(node.expr)
+        if kind is Not:
+            return self.invariant(node.value)
+        if kind is FString:
+            return all(self.invariant(portion) for portion in node.portions)
+        if kind is BuiltInFunction:
+            return not node.ref and node.built_in.pure and all(self.invariant(arg) for arg in node.args)
+        return False
+
+    def hoist(self, node):
+        """The node to put in place of node, an Invariant if it's worth keeping the value of."""
+        if not self.invariant(node):
+            self.visit(node)
+            return node
+        if type(node) is Const or node is NULL or type(node) is VarGet and node.indexer is None:
+            return node
+        self.values.append(MISSING)
+        return Invariant(node, self.values, len(self.values) - 1)
+
+    def visit_StatementList(self, node):
+        self.level += 1
+        node.children = [self.hoist(child) for child in node.children]
+        self.level -= 1
+
+    def visit_BinOp(self, node):
+        node.left = self.hoist(node.left)
+        node.right = self.hoist(node.right)
+
+    def visit_UnaryOp(self, node):
+        node.expr = self.hoist(node.expr)
+
+    def visit_Not(self, node):
+        node.value = self.hoist(node.value)
+
+    def visit_FString(self, node):
+        node.portions = [self.hoist(portion) for portion in node.portions]
+
+    def visit_List(self, node):
+        node.value = [self.hoist(element) for element in node.value]
+
+    def visit_Tuple(self, node):
+        node.value = [self.hoist(element) for element in node.value]
+
+    def visit_Dict(self, node):
+        node.value = {self.hoist(key): self.hoist(value) for key, value in node.value.items()}
+
+    def visit_VarGet(self, node):
+        if node.indexer:
+            node.indexer = self.hoist(node.indexer)
+
+    def visit_BuiltInFunction(self, node):
+        node.args = [self.hoist(arg) for arg in node.args]
+
+    def visit_VarDecl(self, node):
+        if not isinstance(node.value, StatementList):
+            node.value = self.hoist(node.value)
+
+    def visit_VarSet(self, node):
+        node.value = self.hoist(node.value)
+
+    def visit_If(self, node):
+        node.conditional = self.hoist(node.conditional)
+        self.visit(node.value)
+        if node.else_value:
+            self.visit(node.else_value)
+
+    def visit_Return(self, node):
+        node.expr = self.hoist(node.expr)
+
+    # Loops inside the loop hoist out of themselves
+
+    def visit_While(self, node):
+        pass
+
+    def visit_For(self, node):
+        pass
+
+    def visit_MacroDecl(self, node):
+        pass
+
+    def visit_Const(self, node):
+        pass
+
+    def visit_Null(self, node):
+        pass
+
+    def visit_Invariant(self, node):
+        pass
+
+    def visit_Break(self, node):
+        pass
+
+    def visit_Continue(self, node):
+        pass
+
+    def visit_NoOp(self, node):
+        pass
+
+
+class Optimizer(NodeVisitor):
+    """Rewrites an analyzed tree so the interpreter does less work running it.
+
+    Every visit_ method returns the node to put in place of the one it was given, or None to
+    drop a statement. BinOps, UnaryOps, Nots and FStrings made only of constants are folded
+    into a single Const, and variables that are declared as a constant and never set are
+    replaced by that constant. Anything that would raise an error is left as it is, so the
+    error is still raised when the program runs, from the same line and column.
+
+    Branches and loops whose conditions fold to constants that never let them run are dropped,
+    as is everything after a return, break or continue, and statement lists nothing run in can
+    end early are marked so the engines run them without checking after every statement.
+    Expressions that give the same value every time round a loop are left to a Hoister.
+
+    A call to a macro that is never set is replaced by an Expansion of a copy of its body, with
+    the arguments that are constants written in, for the rest of the Optimizer to go over as if it
+    had been written there. Which macro a call is to is only certain while nothing is passed by
+    reference, for a call from a function to a macro outside of it, and while no macro declares
+    anything, moving the slots of its caller's scope.
+    """
+
+    def __init__(self, semantic_analyzer):
+        super(Optimizer, self).__init__()
+        self.local_reads = semantic_analyzer.local_reads
+        self.unknown_set_slots = semantic_analyzer.unknown_set_slots
+        self.macro_declares = semantic_analyzer.macro_declares
+        self.macro_refs = semantic_analyzer.macro_refs
+        self.refs = semantic_analyzer.refs
+        self.macro_calls = semantic_analyzer.macro_calls
+        # Value node of each VarDecl -> the constant it folded into
+        self.constants = {}
+        # Body of each MacroDecl -> the MacroDecl
+        self.macros = {}
+        # What each of the arguments of the macro being expanded is read as in its body, the constant
+        # written in place of it or the index of the macro variable it's evaluated into
+        self.arguments = None
+        # Positions of the reads replaced in the program being visited. Which ones can be depends on
+        # the programs that import it as well as its own source, so they're part of what it's cached by
+        self.propagated = []
+        # and of the macro calls expanded
+        self.expanded = []
+        # Returns and calls that could be to a macro visited so far, and breaks and continues visited
+        # in the innermost loop, for a statement list to tell whether anything in it can end it early
+        self.exit_points = 0
+        self.loop_exits = 0
+        # How many macro bodies are being visited, where a variable is whatever the caller has in its slot
+        self.macro_depth = 0
+
+    def optimize(self, program):
+        return self.visit(program)
+
+    def const(self, value, token):
+        """A node for value in place of the node token came from, or None if value isn't a constant."""
+        if value is None:
+            return NULL
+        token_type = CONST_TOKEN_TYPES.get(type(value))
+        if token_type is None or too_big(value):
+            return None
+        return Const(Token(token_type, value, token.pos, token.line_index))
+
+    def visit_Program(self, node):
+        if not node.optimized:
+            propagated, expanded = self.propagated, self.expanded
+            self.propagated, self.expanded = [], []
+            node.statement_list_node = self.visit(node.statement_list_node)
+            digest = hashlib.sha256(repr((self.macro_declares, self.macro_refs, self.refs, self.propagated,
+                                          self.expanded)).encode()).hexdigest()
+            node.optimized = f"{OPTIMIZER_VERSION}:{digest}"
+            self.propagated, self.expanded = propagated, expanded
+        return node
+
+    def visit_StatementList(self, node):
+        exit_points, loop_exits = self.exit_points, self.loop_exits
+        children = []
+        for child in node.children:
+            child = self.visit(child)
+            if child is None:
+                continue
+            children.append(child)
+            # Nothing after these is ever run
+            if isinstance(child, (Return, Break, Continue)):
+                break
+        node.children = children
+        node.exits = self.exit_points != exit_points or self.loop_exits != loop_exits
+        return node
+
+    def may_run_macro(self, node):
+        """Whether getting node could run a macro, which returns, breaks or continues from wherever it's called."""
+        if node.ref:
+            return False
+        # The kinds the analyzer found are only certain while no macro shifts the slots of its caller's scope
+        if self.macro_depth or self.macro_declares or node.access is None:
+            return True
+        kind = node.access.kind
+        return kind in (AccessKind.MACRO, AccessKind.UNKNOWN) or kind != AccessKind.FUNCTION and self.macro_refs
+
+    def visit_BinOp(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        if not is_constant(node.left):
+            return node
+        left = constant_value(node.left)
+        if node.short_circuit:
+            # The left hand side decides whether the right is the result
+            if node.op.type == TokenType.AND:
+                return node.right if left else node.left
+            return node.left if left else node.right
+        if not is_constant(node.right):
+            return node
+        right = constant_value(node.right)
+        op_type = node.op.type
+        # Anything with a size that grows with the right hand side is checked before it's built
+        if op_type == TokenType.MUL and type(right) is int and type(left) is str and len(left) * right > MAX_FOLDED_SIZE:
+            return node
+        if (op_type == TokenType.EXPO and type(left) is int and type(right) is int and right > 0 and
+                left.bit_length() * right > MAX_FOLDED_SIZE):
+            return node
+        try:
+            value = BINARY_OPERATORS[op_type](left, right)
+        except Exception:
+            return node
+        return self.const(value, node.token) or node
+
+    def visit_Const(self, node):
+        return node
+
+    def visit_Null(self, node):
+        return node
+
+    def visit_FString(self, node):
+        portions = []
+        for portion in node.portions:
+            portion = self.visit(portion)
+            # Neighbouring constants are joined into one
+            if is_constant(portion) and portions and is_constant(portions[-1]):
+                joined = self.const(f"{constant_value(portions[-1])}{constant_value(portion)}", portions[-1].token)
+                if joined:
+                    portions[-1] = joined
+                    continue
+            portions.append(portion)
+        node.portions = portions
+        if len(portions) == 1 and is_constant(portions[0]):
+            return self.const(str(constant_value(portions[0])), node.token) or node
+        return node
+
+    def visit_List(self, node):
+        node.value = [self.visit(element) for element in node.value]
+        return node
+
+    def visit_Tuple(self, node):
+        node.value = [self.visit(element) for element in node.value]
+        return node
+
+    def visit_Dict(self, node):
+        node.value = {self.visit(key): self.visit(value) for key, value in node.value.items()}
+        return node
+
+    def visit_UnaryOp(self, node):
+        node.expr = self.visit(node.expr)
+        if not is_constant(node.expr):
+            return node
+        value = constant_value(node.expr)
+        op_type = node.op.type
+        if op_type == TokenType.PLUS:
+            return node.expr
+        if op_type == TokenType.MINUS:
+            try:
+                return self.const(-value, node.token) or node
+            except Exception:
+                return node
+        return NULL
+
+    def visit_Not(self, node):
+        node.value = self.visit(node.value)
+        if is_constant(node.value):
+            return self.const(not constant_value(node.value), node.token)
+        return node
+
+    def visit_VarDecl(self, node):
+        if isinstance(node.value, StatementList):
+            node.default_param_vals = [self.visit(value) for value in node.default_param_vals]
+            # What ends the body early ends the call, not the list the function is declared in
+            exit_points, loop_exits = self.exit_points, self.loop_exits
+            node.value = self.visit(node.value)
+            self.exit_points, self.loop_exits = exit_points, loop_exits
+            return node
+        value = self.visit(node.value)
+        if is_constant(value):
+            self.constants[node.value] = value
+        node.value = value
+        return node
+
+    def visit_VarSet(self, node):
+        node.value = self.visit(node.value)
+        return node
+
+    def visit_VarGet(self, node):
+        symbol = self.local_reads.get(node)
+        # Only a symbol that was never set still holds the value node it was declared with
+        if symbol is not None and not self.macro_declares and node.mem_loc not in self.unknown_set_slots:
+            constant = self.constants.get(symbol.value)
+            if constant is not None:
+                self.propagated.append(node.token.pos)
+                return self.const(constant_value(constant), node.token)
+        node.args = [self.visit(arg) for arg in node.args]
+        if node.indexer:
+            node.indexer = self.visit(node.indexer)
+        expansion = self.expand(node)
+        if expansion is not None:
+            self.expanded.append(node.token.pos)
+            return expansion
+        if self.may_run_macro(node):
+            self.exit_points += 1
+        return node
+
+    def expand(self, node):
+        """An Expansion of the macro node calls, or None if which macro that is isn't certain."""
+        call = self.macro_calls.get(node)
+        if call is None or self.macro_declares or node.mem_loc in self.unknown_set_slots:
+            return None
+        symbol, local = call
+        # Only a macro that was never set still holds the body node it was declared with
+        declaration = self.macros.get(symbol.value)
+        if declaration is None or not local and self.refs:
+            return None
+        # The same defaults the interpreter adds, which it evaluates in the caller's scope
+        defaults = declaration.default_param_vals[declaration.params_num - len(node.args)::]
+        count = len(node.args) + len(defaults)
+        body = copy.deepcopy(declaration.value)
+        indexed = set()
+        stack = [body]
+        while stack:
+            child = stack.pop()
+            if type(child) is MacroVarGet:
+                # Left for the interpreter to raise the IndexError
+                if not -count <= child.mem_loc < count:
+                    return None
+                if child.indexer:
+                    indexed.add(child.mem_loc % count)
+            stack.extend(child_nodes(child))
+
+        # Variables in the defaults and the body are whatever the caller has in their slots
+        self.macro_depth += 1
+        values = node.args + [self.visit(value) for value in copy.deepcopy(defaults)]
+        arguments = []
+        args = []
+        for index, value in enumerate(values):
+            # Indexing a constant is an error the interpreter raises when the body gets to it
+            if is_constant(value) and index not in indexed and not too_big(constant_value(value)):
+                arguments.append(value)
+            else:
+                arguments.append(len(args))
+                args.append(value)
+        outer_arguments = self.arguments
+        self.arguments = arguments
+        body = self.visit(body)
+        self.arguments = outer_arguments
+        self.macro_depth -= 1
+        return Expansion(node.token, args, body)
+
+    def visit_MacroDecl(self, node):
+        node.default_param_vals = [self.visit(value) for value in node.default_param_vals]
+        exit_points, loop_exits = self.exit_points, self.loop_exits
+        self.macro_depth += 1
+        node.value = self.visit(node.value)
+        self.macro_depth -= 1
+        self.exit_points, self.loop_exits = exit_points, loop_exits
+        self.macros[node.value] = node
+        return node
+
+    def visit_MacroVarGet(self, node):
+        if node.indexer:
+            node.indexer = self.visit(node.indexer)
+        if self.arguments is None:
+            return node
+        argument = self.arguments[node.mem_loc]
+        if type(argument) is int:
+            node.mem_loc = argument
+            return node
+        return self.const(constant_value(argument), node.token)
+
+    def visit_Import(self, node):
+        # A module's top level runs inside whichever function imports it
+        self.exit_points += 1
+        if not node.from_python:
+            self.visit(Parser.imported_files[node.file_path])
+        return node
+
+    def visit_ModuleGet(self, node):
+        node.var_node = self.visit(node.var_node)
+        return node
+
+    def visit_OpenFile(self, node):
+        node.value = self.visit(node.value)
+        return node
+
+    def visit_If(self, node):
+        node.conditional = self.visit(node.conditional)
+        if is_constant(node.conditional):
+            if constant_value(node.conditional):
+                node.else_value = None
+            elif node.else_value is None or isinstance(node.else_value, If):
+                return self.visit(node.else_value)
+            else:
+                # The else block is left as the block of a condition that always holds
+                node.conditional = self.const(True, node.token)
+                node.value, node.else_value = node.else_value, None
+        node.value = self.visit(node.value)
+        if node.else_value:
+            node.else_value = self.visit(node.else_value)
+        return node
+
+    def visit_While(self, node):
+        node.conditional = self.visit(node.conditional)
+        if is_constant(node.conditional) and not constant_value(node.conditional):
+            return None
+        self.visit_loop_body(node)
+        return node
+
+    def visit_For(self, node):
+        node.iterable = self.visit(node.iterable)
+        self.visit_loop_body(node)
+        return node
+
+    def visit_loop_body(self, node):
+        # A break or continue only ends the loop it's in
+        loop_exits = self.loop_exits
+        node.value = self.visit(node.value)
+        self.loop_exits = loop_exits
+        # Any variable could hold something that gets called when it's read once anything is passed by
+        # reference, and the analyzer's kinds are only certain while no macro moves the slots of its caller
+        if not self.macro_depth and not self.refs and not self.macro_declares:
+            Hoister().hoist_loop(node)
+
+    def visit_Invariant(self, node):
+        return node
+
+    def visit_Return(self, node):
+        self.exit_points += 1
+        node.expr = self.visit(node.expr)
+        # A variable replaced by its constant is no longer a call
+        if not isinstance(node.expr, VarGet):
+            node.tail_call = None
+        return node
+
+    def visit_Break(self, node):
+        self.loop_exits += 1
+        return node
+
+    def visit_Continue(self, node):
+        self.loop_exits += 1
+        return node
+
+    def visit_BuiltInFunction(self, node):
+        # Built-ins like srt call the references they're passed
+        if self.macro_refs and not node.from_python:
+            self.exit_points += 1
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_GetAttr(self, node):
+        return node
+
+    def visit_NoOp(self, node):
+        return node
+
+    def visit_NoneType(self, node):
+        return node
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print("Unspecified file")
+    else:
+        file_path = sys.argv[1]
+        try:
+            tree = Parser.parse_file(file_path)
+            semantic_analyzer = SemanticAnalyzer(file_path)
+            semantic_analyzer.visit(tree)
+        except (ParserError, LexerError, SemanticError) as e:
+            print(e.message)
+            sys.exit(1)
+        print(Optimizer(semantic_analyzer).optimize(tree))
@@ -1,4 +1,5 @@
 import os.path
+import sys
 
 from error import *
 from cstoken import *
@@ -17,6 +18,34 @@ class SemanticAnalyzer(NodeVisitor):
         self.current_scope = None
         self.current_macro_var_count = 0
         self.block_type_stack = []
+        # Scope level and statement list of each function body being analyzed, innermost last
+        self.function_scope_levels = []
+        self.function_bodies = []
+        # How many calls with side effects have been visited, for & and | to tell whether their right hand side makes any
+        self.side_effects = 0
+        # Scope level of the global scope of each program and of each function body being analyzed, innermost last.
+        # Variables further out are found through whichever scope the program or function was entered from
+        self.frame_scope_levels = []
+        # Scope level of each function body being analyzed that has default parameters. Passing some of its
+        # optional arguments changes how many slots its parameters take, so what's in its slots isn't known
+        self.shifting_scope_levels = []
+        # and of the global scope of the program being analyzed
+        self.program_scope_level = None
+        # What the Optimizer needs to know to replace a variable with the constant it was declared as:
+        # VarGet -> Symbol of the reads that resolve within their own program or function,
+        self.local_reads = {}
+        # the slots of every set the analyzer can't tell the scope of, which could be any scope's,
+        self.unknown_set_slots = set()
+        # and whether a macro declares anything, which shifts the slots of whatever scope calls it
+        self.macro_declares = False
+        # Whether a macro could be passed by reference, so any variable or built-in could end up running one
+        self.macro_refs = False
+        # Whether anything is passed by reference, so reading any variable could end up calling something
+        self.refs = False
+        # What the Optimizer needs to know to expand a macro call in place: VarGet -> (Symbol, whether it's local)
+        # of the calls to a macro in the program they're in. A function of an imported program is entered from the
+        # scope of whatever calls it, so calls from one to a macro outside of it are only kept for the program run
+        self.macro_calls = {}
         self.in_module_temps = None
 
     def enter_scope(self, scope_name):
@@ -35,6 +64,10 @@ class SemanticAnalyzer(NodeVisitor):
         self.log(self.current_scope)
         self.current_scope = self.current_scope.enclosing_scope
 
+    def leave_block_scope(self, block):
+        block.declares = self.current_scope.length() > 0 or len(self.current_scope.imported_file_paths) > 0
+        self.leave_scope()
+
     def enter_module_scope(self, module):
         self.in_module_temps = (self.current_scope, self.current_file_path)
         self.current_scope = module
@@ -50,22 +83,43 @@ class SemanticAnalyzer(NodeVisitor):
                 f'LEAVE module scope: {self.current_scope.file_path} : {self.current_scope.scope_name} -> {self.in_module_temps[0]} : {self.in_module_temps[1]}')
             self.in_module_temps = None
 
+    def mark_impure(self, scope_level=0):
+        """Marks the functions being analyzed impure, only those declared deeper than scope_level when it is given."""
+        for level, body in zip(self.function_scope_levels, self.function_bodies):
+            if level > scope_level:
+                body.pure = False
+
+    def mark_access(self, node):
+        # Reading or setting a variable outside of a function makes its result depend on more than its arguments
+        if self.function_scope_levels:
+            self.mark_impure(self.current_scope.scope_level - node.scope_depth)
+
     def error(self, error_code, token, message=''):
         self.log(
             f"------------- SCOPE WHEN ERROR -------------\n{self.current_scope}\n------------- SCOPE WHEN ERROR -------------")
         raise SemanticError(
             error_code=error_code,
             token=token,
-            message=f'\u001b[31m{error_code.value} -> File: {self.current_file_path}, Line: {token.line}, Column: {token.column}\n{message}\u001b[0m'
+            message=message,
+            file_path=self.current_file_path
         )
 
+    def warn(self, token, message):
+        print(f'\u001b[33mWarning -> File: {self.current_file_path}, Line: {token.line}, Column: {token.column}\n{message}\u001b[0m',
+              file=sys.stderr)
+
     def log(self, msg):
         if self.display_debug_messages:
             print(msg)
 
     def visit_Program(self, node):
         self.enter_scope("global")
+        program_scope_level = self.program_scope_level
+        self.program_scope_level = self.current_scope.scope_level
+        self.frame_scope_levels.append(self.current_scope.scope_level)
         self.visit(node.statement_list_node)
+        self.frame_scope_levels.pop()
+        self.program_scope_level = program_scope_level
         global_scope = self.current_scope
         self.leave_scope()
         return global_scope
@@ -82,7 +136,13 @@ class SemanticAnalyzer(NodeVisitor):
 
     def visit_BinOp(self, node):
         self.visit(node.left)
+        side_effects = self.side_effects
         self.visit(node.right)
+        if node.short_circuit and self.side_effects != side_effects:
+            self.warn(node.token, f"The right hand side of '{node.op.value}' makes calls with side effects, "
+                                  f"which are skipped whenever the left hand side decides the result")
+            # Only warned about by the innermost & or | they're skipped by
+            self.side_effects = side_effects
 
     def visit_Const(self, node):
         pass
@@ -111,47 +171,102 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.expr)
 
     def visit_VarDecl(self, node):
+        if BlockType.MACRO in self.block_type_stack:
+            self.macro_declares = True
         if isinstance(node.value, StatementList):
             default_param_values = [self.visit(
                 val) for val in node.default_param_vals]
             self.enter_scope(f"m{self.current_scope.length() - 1}")
+            self.function_scope_levels.append(self.current_scope.scope_level)
+            self.function_bodies.append(node.value)
+            self.frame_scope_levels.append(self.current_scope.scope_level)
+            if node.default_param_vals:
+                self.shifting_scope_levels.append(self.current_scope.scope_level)
+            node.value.pure = True
             for _ in range(node.params_num):
-                self.current_scope.insert(Symbol(-1, 0, None))
+                self.current_scope.insert(Symbol(-1, 0, None, AccessKind.PARAMETER))
             for val in default_param_values:
-                self.current_scope.insert(Symbol(-1, 0, val))
+                self.current_scope.insert(Symbol(-1, 0, val, AccessKind.PARAMETER))
             self.visit(node.value)
+            self.function_scope_levels.pop()
+            self.function_bodies.pop()
+            self.frame_scope_levels.pop()
+            if node.default_param_vals:
+                self.shifting_scope_levels.pop()
             self.leave_scope()
         else:
             self.visit(node.value)
+        kind = AccessKind.FUNCTION if isinstance(node.value, StatementList) else AccessKind.DATA
         self.current_scope.insert(
-            Symbol(node.params_num, len(node.default_param_vals), node.value))
+            Symbol(node.params_num, len(node.default_param_vals), node.value, kind))
 
     def visit_VarSet(self, node):
         value = self.visit(node.value)
-        self.current_scope.set(node.scope_depth, node.mem_loc, value)
+        symbol = self.current_scope.set(node.scope_depth, node.mem_loc, value)
+        self.mark_access(node)
+        if not symbol or BlockType.MACRO in self.block_type_stack or not self.is_local(node):
+            self.unknown_set_slots.add(node.mem_loc)
+        if symbol:
+            node.access = Access(node.scope_depth, node.mem_loc, self.access_kind(node, symbol))
 
     def visit_VarGet(self, node):
+        if node.ref:
+            self.refs = True
+            if not self.macro_refs:
+                symbol = None if BlockType.MACRO in self.block_type_stack else self.current_scope.resolve(
+                    node.scope_depth, node.mem_loc)
+                self.macro_refs = symbol is None or self.access_kind(node, symbol) in (AccessKind.MACRO,
+                                                                                       AccessKind.UNKNOWN)
         if self.block_type_stack[-1] != BlockType.MACRO and not node.ref:
             symbol = self.current_scope.lookup(node.scope_depth, node.mem_loc)
             if not symbol:
                 self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token,
                            message=f"m{'.'*node.scope_depth}{node.mem_loc} does not exist")
+            kind = self.access_kind(node, symbol)
+            node.access = Access(node.scope_depth, node.mem_loc, kind)
+            # A function set to something else since its declaration is no longer known to be a function
+            if symbol.kind == AccessKind.MACRO or isinstance(symbol.value, StatementList) and not symbol.value.pure:
+                self.side_effects += 1
+            if (kind == AccessKind.DATA and not node.args and not node.indexer and not self.in_module_temps and
+                    BlockType.MACRO not in self.block_type_stack and self.is_local(node)):
+                self.local_reads[node] = symbol
+            if (kind == AccessKind.MACRO and not node.indexer and not self.in_module_temps and
+                    BlockType.MACRO not in self.block_type_stack and
+                    self.current_scope.scope_level - node.scope_depth >= self.program_scope_level and
+                    (self.is_local(node) or self.program_scope_level == self.frame_scope_levels[0])):
+                self.macro_calls[node] = (symbol, self.is_local(node))
             if symbol.params_num != -1:
                 if len(node.args) < symbol.params_num or len(node.args) > symbol.params_num + symbol.default_value_num:
                     self.error(error_code=ErrorCode.WRONG_PARAMS_NUM, token=node.token,
                                message=f"{len(node.args)} {'was' if len(node.args) == 1 else 'were'} passed, but {symbol.params_num} {'was' if symbol.params_num == 1 else 'were'} expected")
+        if self.block_type_stack[-1] != BlockType.MACRO:
+            self.mark_access(node)
         self.leave_module_scope()
         for arg in node.args:
             self.visit(arg)
 
+    def is_local(self, node):
+        """Whether the variable node gets or sets is in the program or function it's in, rather than one it was entered from."""
+        return self.current_scope.scope_level - node.scope_depth >= self.frame_scope_levels[-1]
+
+    def access_kind(self, node, symbol):
+        """The kind of what the variable node gets or sets holds, found from the symbol the analyzer has for its slot."""
+        if self.current_scope.scope_level - node.scope_depth in self.shifting_scope_levels:
+            return AccessKind.UNKNOWN
+        return symbol.kind
+
     def visit_MacroDecl(self, node):
+        # A macro runs in the scope of whatever calls it, which can't be known here
+        self.mark_impure()
+        if BlockType.MACRO in self.block_type_stack:
+            self.macro_declares = True
         self.current_macro_var_count = node.params_num
         for val in node.default_param_vals:
             self.visit(val)
             self.current_macro_var_count += 1
         self.visit(node.value)
         self.current_scope.insert(
-            Symbol(node.params_num, len(node.default_param_vals), node.value))
+            Symbol(node.params_num, len(node.default_param_vals), node.value, AccessKind.MACRO))
         self.current_macro_var_count = 0
 
     def visit_MacroVarGet(self, node):
@@ -165,6 +280,7 @@ class SemanticAnalyzer(NodeVisitor):
                            message=f"k{node.mem_loc} does not exist")
 
     def visit_Import(self, node):
+        self.mark_impure()
         if node.from_python:
             if node.file_path not in ScopedSymbolTable.imported_scopes:
                 self.current_scope.import_scope(node)
@@ -183,6 +299,7 @@ class SemanticAnalyzer(NodeVisitor):
         self.current_file_path = current_file_path
 
     def visit_ModuleGet(self, node):
+        self.mark_impure()
         module = self.current_scope.get_imported_scope(
             node.scope_depth, node.mem_loc)
 
@@ -190,6 +307,9 @@ class SemanticAnalyzer(NodeVisitor):
             self.error(ErrorCode.MODULE_NOT_FOUND, node.token,
                        message=f"${'.'*node.scope_depth}{node.mem_loc} does not exist")
 
+        kind = AccessKind.PYTHON_MODULE if isinstance(module, Import) else AccessKind.MODULE
+        node.access = Access(node.scope_depth, node.mem_loc, kind)
+
         if isinstance(module, Import):
             self.visit(node.var_node)
         else:
@@ -203,6 +323,7 @@ class SemanticAnalyzer(NodeVisitor):
         if node.file_mode != TokenType.FILE_WRITE and not os.path.isfile(node.file_path):
             self.error(error_code=ErrorCode.FILE_NOT_FOUND, token=node.token,
                        message=f"{node.file_path} does not exist.")
+        self.mark_impure()
         self.enter_scope("openfile-block")
         self.current_scope.insert(Symbol(0, 0, node.file_path))
         self.visit(node.value)
@@ -215,20 +336,20 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.conditional)
         self.enter_scope("if-block")
         self.visit(node.value)
-        self.leave_scope()
+        self.leave_block_scope(node.value)
         if node.else_value:
             if isinstance(node.else_value, If):
                 self.visit(node.else_value)
             else:
                 self.enter_scope("else-block")
                 self.visit(node.else_value)
-                self.leave_scope()
+                self.leave_block_scope(node.else_value)
 
     def visit_While(self, node):
         self.visit(node.conditional)
         self.enter_scope("while-block")
         self.visit(node.value)
-        self.leave_scope()
+        self.leave_block_scope(node.value)
 
     def visit_For(self, node):
         self.visit(node.iterable)
@@ -242,6 +363,21 @@ class SemanticAnalyzer(NodeVisitor):
             self.error(ErrorCode.INVALID_RETURN_STATEMENT, node.token,
                        f'Return Statements should not be declared outside of a function')
         self.visit(node.expr)
+        if self.is_tail_call(node):
+            # How many scopes the return is nested in below its function's own
+            node.tail_call = self.current_scope.scope_level - self.function_scope_levels[-1]
+
+    def is_tail_call(self, node):
+        """Whether node returns a call the interpreter can make after leaving the function returning it."""
+        expr = node.expr
+        if not isinstance(expr, VarGet) or expr.ref or expr.indexer or not self.function_scope_levels:
+            return False
+        # A return in a macro body returns from whichever function the macro is called in, and one at
+        # the top of a module imported from a function from the function importing it
+        for block_type in reversed(self.block_type_stack):
+            if block_type in (BlockType.FUNCTION, BlockType.MACRO, BlockType.PROGRAM):
+                return block_type == BlockType.FUNCTION
+        return False
 
     def visit_Break(self, node):
         if BlockType.LOOP not in self.block_type_stack and BlockType.MACRO not in self.block_type_stack:
@@ -254,11 +390,17 @@ class SemanticAnalyzer(NodeVisitor):
                        f'Continue Statements should not be declared outside of a loop')
 
     def visit_BuiltInFunction(self, node):
+        if node.ref:
+            self.refs = True
+        if node.from_python or not node.built_in.pure:
+            self.mark_impure()
+            if not node.ref:
+                self.side_effects += 1
         for arg in node.args:
             self.visit(arg)
 
     def visit_GetAttr(self, node):
-        pass
+        self.mark_impure()
 
     # def visit_PythonModuleFunction(self, node):
     #     for arg in node.args:
@@ -276,10 +418,7 @@ if __name__ == "__main__":
         print("Unspecified file")
     else:
         file_path = sys.argv[1]
-        with open(file_path) as file:
-            lexer = Lexer(file.read())
-        parser = Parser(lexer, file_path)
-        tree = parser.parse()
+        tree = Parser.parse_file(file_path)
         print(tree)
 
         semantic_analyzer = SemanticAnalyzer(
@@ -1,11 +1,44 @@
 from cstoken import *
 
 
+class AccessKind(Enum):
+    DATA = 'DATA'
+    FUNCTION = 'FUNCTION'
+    MACRO = 'MACRO'
+    # Whatever gets passed in, which can be data or a function
+    PARAMETER = 'PARAMETER'
+    # Whatever is in a slot of a function with default parameters, which depends on how it was called
+    UNKNOWN = 'UNKNOWN'
+    MODULE = 'MODULE'
+    PYTHON_MODULE = 'PYTHON_MODULE'
+
+
+class Access():
+    """Where a VarGet, VarSet or ModuleGet resolved to, written onto the node by the semantic analyzer.
+
+    distance is the number of enclosing scopes to go up and slot the index within that scope.
+    kind is what the analyzer saw stored there, which the interpreter can only treat as a hint
+    since macros, references and sets can change it at run time.
+    """
+    __slots__ = ('distance', 'slot', 'kind')
+
+    def __init__(self, distance, slot, kind):
+        self.distance = distance
+        self.slot = slot
+        self.kind = kind
+
+    def __str__(self):
+        return f"<Access(distance = {self.distance}, slot = {self.slot}, kind = {self.kind.value})>"
+
+    __repr__ = __str__
+
+
 class Symbol():
-    def __init__(self, params_num, default_value_num, value):
+    def __init__(self, params_num, default_value_num, value, kind=AccessKind.DATA):
         self.params_num = params_num
         self.default_value_num = default_value_num
         self.value = value
+        self.kind = kind
 
     def __str__(self):
         return f"<Symbol(params_num = {self.params_num}, default_value_num = {self.default_value_num}, value = {self.value})>"
@@ -65,14 +98,25 @@ class ScopedSymbolTable(object):
         if mem_loc < len(self._symbols):
             return self._symbols[mem_loc]
 
+    def resolve(self, scope_depth, mem_loc):
+        """Does the same as lookup without logging, for checks that aren't part of analyzing the program."""
+        scope = self
+        for _ in range(scope_depth):
+            scope = scope.enclosing_scope
+            if scope is None:
+                return None
+        if mem_loc < len(scope._symbols):
+            return scope._symbols[mem_loc]
+
     def set(self, scope_depth, mem_loc, value):
         self.log(f'Set: m{"."*scope_depth}{mem_loc}, (Scope name: {self.scope_name})')
         if scope_depth > 0:
             if self.enclosing_scope is not None:
-                self.enclosing_scope.set(scope_depth - 1, mem_loc, value)
+                return self.enclosing_scope.set(scope_depth - 1, mem_loc, value)
         elif mem_loc < len(self._symbols):
             self._symbols[mem_loc].params_num = 0
             self._symbols[mem_loc].value = value
+            return self._symbols[mem_loc]
 
     def length(self):
         return len(self._symbols)
@@ -0,0 +1,712 @@
+import os
+import sys
+import math
+import pickle
+import marshal
+import importlib.util
+from types import FunctionType, ModuleType
+
+import ast_cache
+from interpreter import *
+from vm import VirtualMachine, child_nodes, can_exit
+
+# Bump whenever the generated code changes
+TRANSPILER_VERSION = 9
+
+PYTHON_OPERATORS = {
+    TokenType.PLUS: '+',
+    TokenType.MINUS: '-',
+    TokenType.MUL: '*',
+    TokenType.EXPO: '**',
+    TokenType.INT_DIV: '//',
+    TokenType.FLOAT_DIV: '/',
+    TokenType.MOD: '%',
+    TokenType.EQUAL: '==',
+    TokenType.NOT_EQUAL: '!=',
+    TokenType.LTHAN: '<',
+    TokenType.GTHAN: '>',
+    TokenType.LTHAN_OR_EQUAL: '<=',
+    TokenType.GTHAN_OR_EQUAL: '>=',
+}
+
+FILE_MODES = {TokenType.FILE_READ: 'r', TokenType.FILE_WRITE: 'w'}
+
+EXIT_CHECK = 'if FS and FS[-1].has_return_value or LS and (LS[-1].breaking or LS[-1].continuing):'
+LOOP_EXIT_CHECK = 'if FS and FS[-1].has_return_value or LS and LS[-1].breaking:'
+
+
+def preorder(program):
+    """Every node of program, in an order that only depends on the source it was parsed from."""
+    nodes = []
+    stack = [program]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(list(child_nodes(node))))
+    return nodes
+
+
+# Helpers the generated code calls, for everything that isn't worth writing out inline
+
+def call_var(rt, node, var, arg_values):
+    if isinstance(var, FunctionData):
+        return rt.call_function(node, var, arg_values)
+    if isinstance(var, MacroData):
+        return rt.call_macro(var, arg_values)
+    return var(rt, node.token, *arg_values)
+
+
+def index_value(rt, node, value, index):
+    if isinstance(value, dict):
+        if index not in value:
+            rt.error(ErrorCode.INDEX_ERROR, token=node.token,
+                     message=f"{index} does not exist in the given dictionary")
+    else:
+        val_len = len(value)
+        if not isinstance(index, int) or index < -val_len or index >= val_len:
+            rt.error(ErrorCode.INDEX_ERROR, token=node.token,
+                     message=f"{index} is out of range of the given {type(value).__name__}")
+    return value[index]
+
+
+def invalid_variable(rt, node):
+    rt.error(ErrorCode.INVALID_VARIABLE, node.token,
+             f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
+
+
+def variable_missing(rt, node):
+    rt.error(ErrorCode.VARIABLE_MISSING, node.token,
+             f'm{"."*node.scope_depth}{node.mem_loc} seems to have been lost in the darkness that is CommaScript.')
+
+
+def invalid_indexer(rt, node, value):
+    rt.error(ErrorCode.INVALID_INDEXER, node.token,
+             f"'{type(value).__name__}' does not support the use of indexers.")
+
+
+def bin_op_error(rt, node, left, right):
+    rt.error(ErrorCode.TYPE_ERROR, node.token,
+             f"'{node.op.value}' not supported between instances of '{type(left).__name__}' and '{type(right).__name__}'")
+
+
+def unary_op_error(rt, node, value):
+    rt.error(ErrorCode.TYPE_ERROR, node.token,
+             f"Unary '{node.op.value}' not supported for instances of type '{type(value).__name__}'")
+
+
+def set_error(rt, node, types):
+    rt.error(ErrorCode.TYPE_ERROR, node.token,
+             f"'+' not supported between instances of '{types[0].__name__}' and '{types[1].__name__}'")
+
+
+def wrong_params(rt, node, function, arg_values, e):
+    rt.log(e)
+    rt.error(ErrorCode.WRONG_PARAMS_NUM, node.token,
+             f"{node.name}<> takes {len(signature(function).parameters) - 2} arguments but {len(arg_values)} were given")
+
+
+def invalid_attribute(rt, node):
+    rt.error(ErrorCode.INVALID_VARIABLE, node.token,
+             f"'{rt.current_python_module}' has no attribute '{node.name}'")
+
+
+def not_iterable(rt, node, iterable):
+    rt.error(ErrorCode.TYPE_ERROR, node.token, f"'{type(iterable).__name__}' is not iterable")
+
+
+# What a variable holds when reading it calls it rather than giving its value
+CALLABLE_TYPES = frozenset((FunctionData, MacroData, FunctionType))
+
+GENERATED_GLOBALS = {
+    'builtins': builtins,
+    'MISSING': MISSING,
+    'INVARIANT_VALUE_TYPES': INVARIANT_VALUE_TYPES,
+    'forget_invariants': forget_invariants,
+    'CALLABLE_TYPES': CALLABLE_TYPES,
+    'FunctionData': FunctionData,
+    'MacroData': MacroData,
+    'Memory': Memory,
+    'Loop': Loop,
+    'StatementList': StatementList,
+    'FunctionType': FunctionType,
+    'ModuleType': ModuleType,
+    'call_var': call_var,
+    'index_value': index_value,
+    'invalid_variable': invalid_variable,
+    'variable_missing': variable_missing,
+    'invalid_indexer': invalid_indexer,
+    'bin_op_error': bin_op_error,
+    'unary_op_error': unary_op_error,
+    'set_error': set_error,
+    'wrong_params': wrong_params,
+    'invalid_attribute': invalid_attribute,
+    'not_iterable': not_iterable,
+    **{built_in.function.__name__: built_in.function for built_in in BUILT_INS.values()},
+}
+
+
+class Transpiler(NodeVisitor):
+    """Writes an analyzed Program out as the source of an equivalent Python module.
+
+    The program, every function and macro body, and every default parameter value become a
+    function u<index>(rt) taking the interpreter, where index is the node's position in
+    preorder(program) and N[index] is the node itself. Expressions are broken down into
+    temporaries so that every operation can fail with the same error as in the Interpreter,
+    blocks become a `while True:` that is broken out of after a return, break or continue,
+    and memory is still the interpreter's Memory, so scoping works exactly as before.
+    """
+
+    def __init__(self, program):
+        super(Transpiler, self).__init__()
+        self.program = program
+        self.indexes = {}
+        for index, node in enumerate(preorder(program)):
+            self.indexes.setdefault(node, index)
+        self.lines = []
+        self.level = 0
+        self.names = 0
+        self.units = []
+        self.unit_indexes = set()
+        self.pending = []
+
+    def generate(self):
+        self.unit(self.program)
+        while self.pending:
+            node = self.pending.pop()
+            if self.indexes[node] not in self.unit_indexes:
+                self.unit(node)
+        self.lines.append(f"UNITS = {tuple(self.units)!r}")
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def name(self, prefix):
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def ref(self, node):
+        return f"N[{self.indexes[node]}]"
+
+    def unit(self, node):
+        index = self.indexes[node]
+        self.units.append(index)
+        self.unit_indexes.add(index)
+        self.emit(f"def u{index}(rt):")
+        self.level += 1
+        self.emit("FS = rt.function_stack")
+        self.emit("LS = rt.loop_stack")
+        if isinstance(node, Program):
+            self.emit("scope = rt.current_scope")
+            self.emit("rt.current_scope = Memory(rt.current_file_path, 'global', "
+                      "scope.scope_level + 1 if scope else 1, scope, scope)")
+            self.block(node.statement_list_node)
+            self.emit("global_scope = rt.current_scope")
+            self.emit("rt.current_scope = global_scope.scope_to_return_to")
+            self.emit("return global_scope")
+        elif isinstance(node, StatementList):
+            self.block(node)
+        else:
+            self.emit(f"return {self.visit(node)}")
+        self.level -= 1
+        self.emit("")
+
+    def declare(self, node):
+        # Bodies and default values get visited on their own when called
+        self.pending.append(node.value)
+        self.pending.extend(node.default_param_vals)
+
+    def block(self, node):
+        children = []
+        for child in node.children:
+            children.append(child)
+            if isinstance(child, (Return, Break, Continue)):
+                break
+        checks = [node.exits and can_exit(child) for child in children[:-1]]
+        wrapped = any(checks)
+        if wrapped:
+            self.emit("while True:")
+            self.level += 1
+        start = len(self.lines)
+        for index, child in enumerate(children):
+            self.visit(child)
+            if index < len(checks) and checks[index]:
+                self.emit(EXIT_CHECK)
+                self.emit("    break")
+        if wrapped:
+            self.emit("break")
+            self.level -= 1
+        elif len(self.lines) == start:
+            self.emit("pass")
+
+    def scoped_block(self, scope_name, node):
+        if isinstance(node, StatementList) and not node.declares:
+            self.emit(f"rt.enter_block_scope({scope_name!r}, {self.ref(node)})")
+            return
+        self.emit("scope = rt.current_scope")
+        self.emit(f"rt.current_scope = Memory(rt.current_file_path, {scope_name!r}, scope.scope_level + 1, scope, scope)")
+
+    def leave_block(self):
+        self.emit("rt.current_scope = rt.current_scope.scope_to_return_to")
+
+    def load(self, node, var):
+        self.emit("if rt.current_python_module is not builtins:")
+        self.emit(f"    invalid_variable(rt, {self.ref(node)})")
+        if node.access:
+            self.emit(f"{var} = rt.current_scope.load({node.access.distance}, {node.access.slot})")
+        else:
+            self.emit(f"{var} = rt.current_scope.get({node.scope_depth}, {node.mem_loc})")
+        self.emit(f"if {var} is MISSING:")
+        self.emit(f"    variable_missing(rt, {self.ref(node)})")
+
+    def visit_Program(self, node):
+        raise Exception('Programs are only transpiled as units')
+
+    def visit_StatementList(self, node):
+        self.block(node)
+
+    def visit_BinOp(self, node):
+        if node.short_circuit:
+            return self.short_circuit(node)
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        result = self.name('t')
+        self.emit("try:")
+        self.emit(f"    {result} = ({left}) {PYTHON_OPERATORS[node.op.type]} ({right})")
+        self.emit("except:")
+        self.emit(f"    bin_op_error(rt, {self.ref(node)}, {left}, {right})")
+        return result
+
+    def short_circuit(self, node):
+        # Anything the right hand side emits has to go inside the check, to only run when it's needed
+        result = self.name('t')
+        self.emit(f"{result} = {self.visit(node.left)}")
+        self.emit(f"if {'' if node.op.type == TokenType.AND else 'not '}{result}:")
+        self.level += 1
+        self.emit(f"{result} = {self.visit(node.right)}")
+        self.level -= 1
+        return result
+
+    def visit_Const(self, node):
+        value = node.value
+        if type(value) in (int, str, bool) or type(value) is float and math.isfinite(value):
+            return repr(value)
+        return f"{self.ref(node)}.value"
+
+    def visit_Null(self, node):
+        return 'None'
+
+    def visit_NoneType(self, node):
+        return 'None'
+
+    def visit_NoOp(self, node):
+        return 'None'
+
+    def visit_FString(self, node):
+        portions = [self.visit(portion) for portion in node.portions]
+        result = self.name('t')
+        self.emit(f"{result} = ''.join([{', '.join(f'str({portion})' for portion in portions)}])")
+        return result
+
+    def visit_List(self, node):
+        elements = [self.visit(element) for element in node.value]
+        result = self.name('t')
+        self.emit(f"{result} = [{', '.join(elements)}]")
+        return result
+
+    def visit_Tuple(self, node):
+        elements = [self.visit(element) for element in node.value]
+        result = self.name('t')
+        self.emit(f"{result} = ({''.join(element + ', ' for element in elements)})")
+        return result
+
+    def visit_Dict(self, node):
+        items = [(self.visit(key), self.visit(value)) for key, value in node.value.items()]
+        result = self.name('t')
+        self.emit(f"{result} = {{{', '.join(f'{key}: {value}' for key, value in items)}}}")
+        return result
+
+    def visit_UnaryOp(self, node):
+        value = self.visit(node.expr)
+        if node.op.type == TokenType.PLUS:
+            return value
+        if node.op.type != TokenType.MINUS:
+            return 'None'
+        result = self.name('t')
+        self.emit("try:")
+        self.emit(f"    {result} = -({value})")
+        self.emit("except:")
+        self.emit(f"    unary_op_error(rt, {self.ref(node)}, {value})")
+        return result
+
+    def visit_Not(self, node):
+        value = self.visit(node.value)
+        result = self.name('t')
+        self.emit(f"{result} = not ({value})")
+        return result
+
+    def visit_VarDecl(self, node):
+        self.declare(node)
+        function = f"FunctionData({node.params_num}, {self.ref(node)}.default_param_vals, {self.ref(node)}.value)"
+        if isinstance(node.value, StatementList):
+            self.emit(f"rt.current_scope._memory.append({function})")
+            return
+        value = self.visit(node.value)
+        self.emit(f"rt.current_scope._memory.append({function} if isinstance({value}, StatementList) else {value})")
+
+    def visit_VarSet(self, node):
+        value = self.visit(node.value)
+        if node.access:
+            store = f"rt.current_scope.store({node.access.distance}, {node.access.slot}, {value}, {node.add_mode!r})"
+            if not node.add_mode:
+                # Only adding can fail
+                self.emit(store)
+                return
+        else:
+            store = f"rt.current_scope.set({node.scope_depth}, {node.mem_loc}, {value}, {node.add_mode!r})"
+        types = self.name('t')
+        self.emit(f"{types} = {store}")
+        self.emit(f"if {types}:")
+        self.emit(f"    set_error(rt, {self.ref(node)}, {types})")
+
+    def visit_VarGet(self, node):
+        var = self.name('v')
+        result = self.name('t')
+        self.load(node, var)
+        if not node.ref and not node.args and not node.indexer:
+            self.emit("if rt.in_module_temps:")
+            self.emit("    rt.leave_module_scope()")
+            self.emit(f"if type({var}) in CALLABLE_TYPES:")
+            self.emit(f"    {result} = call_var(rt, {self.ref(node)}, {var}, [])")
+            self.emit("else:")
+            self.emit(f"    {result} = {var}")
+            return result
+
+        value = self.name('d')
+        self.emit(f"{value} = {var}.value if isinstance({var}, (FunctionData, MacroData)) else {var}")
+        self.emit("rt.current_python_module = builtins")
+        self.emit("rt.leave_module_scope()")
+        if node.ref:
+            return value
+
+        self.emit(f"if isinstance({var}, (FunctionData, MacroData)) or type({value}) is FunctionType:")
+        self.level += 1
+        args = [self.visit(arg) for arg in node.args]
+        self.emit(f"{result} = call_var(rt, {self.ref(node)}, {var}, [{', '.join(args)}])")
+        self.level -= 1
+        if node.indexer:
+            self.emit(f"elif isinstance({value}, (list, tuple, str, dict)):")
+            self.level += 1
+            index = self.visit(node.indexer)
+            self.emit(f"{result} = index_value(rt, {self.ref(node)}, {value}, {index})")
+            self.level -= 1
+            self.emit("else:")
+            self.emit(f"    invalid_indexer(rt, {self.ref(node)}, {value})")
+        else:
+            self.emit("else:")
+            self.emit(f"    {result} = {value}")
+        return result
+
+    def visit_MacroDecl(self, node):
+        self.declare(node)
+        self.emit(f"rt.current_scope._memory.append(MacroData({node.params_num}, "
+                  f"{self.ref(node)}.default_param_vals, {self.ref(node)}.value))")
+
+    def visit_MacroVarGet(self, node):
+        value = self.name('d')
+        self.emit(f"{value} = rt.current_macro_variables[{node.mem_loc}]")
+        if not node.indexer:
+            return value
+        result = self.name('t')
+        self.emit(f"if isinstance({value}, (list, tuple, dict)):")
+        self.level += 1
+        index = self.visit(node.indexer)
+        self.emit(f"{result} = index_value(rt, {self.ref(node)}, {value}, {index})")
+        self.level -= 1
+        self.emit("else:")
+        self.emit(f"    invalid_indexer(rt, {self.ref(node)}, {value})")
+        return result
+
+    def visit_Expansion(self, node):
+        args = [self.visit(arg) for arg in node.args]
+        if args:
+            self.emit(f"rt.current_macro_variables = [{', '.join(args)}]")
+        self.block(node.body)
+        if args:
+            self.emit("rt.current_macro_variables = None")
+        return 'None'
+
+    def visit_Import(self, node):
+        self.emit(f"rt.visit_Import({self.ref(node)})")
+
+    def visit_ModuleGet(self, node):
+        module = self.name('m')
+        python = self.name('p')
+        if node.access:
+            self.emit(f"{module} = rt.current_scope.load_imported_scope({node.access.distance}, {node.access.slot})")
+        else:
+            self.emit(f"{module} = rt.current_scope.get_imported_scope({node.scope_depth}, {node.mem_loc})")
+        self.emit(f"{python} = type({module}) is ModuleType")
+        self.emit(f"if {python}:")
+        self.emit(f"    rt.current_python_module = {module}")
+        self.emit("else:")
+        self.emit(f"    rt.enter_module_scope({module})")
+        value = self.visit(node.var_node)
+        self.emit(f"if {python}:")
+        self.emit("    rt.current_python_module = builtins")
+        self.emit("else:")
+        self.emit("    rt.leave_module_scope()")
+        return value
+
+    def visit_OpenFile(self, node):
+        file = self.name('f')
+        self.scoped_block("openfile-block", node)
+        self.emit(f"with open({self.ref(node)}.file_path, {FILE_MODES.get(node.file_mode, 'a')!r}) as {file}:")
+        self.level += 1
+        self.emit(f"rt.current_scope._memory.append({file})")
+        self.block(node.value)
+        self.level -= 1
+        self.leave_block()
+
+    def visit_If(self, node):
+        conditional = self.visit(node.conditional)
+        self.emit(f"if {conditional}:")
+        self.level += 1
+        self.scoped_block("if-block", node.value)
+        self.block(node.value)
+        self.leave_block()
+        self.level -= 1
+        if node.else_value:
+            self.emit("else:")
+            self.level += 1
+            if isinstance(node.else_value, If):
+                self.visit(node.else_value)
+            else:
+                self.scoped_block("else-block", node.else_value)
+                self.block(node.else_value)
+                self.leave_block()
+            self.level -= 1
+
+    def visit_While(self, node):
+        self.forget_invariants(node)
+        loop = self.name('l')
+        self.emit(f"{loop} = Loop()")
+        self.emit(f"LS.append({loop})")
+        self.emit("while True:")
+        self.level += 1
+        conditional = self.visit(node.conditional)
+        self.emit(f"if not {conditional}:")
+        self.emit("    break")
+        self.emit(f"{loop}.continuing = False")
+        self.scoped_block("while-block", node.value)
+        self.block(node.value)
+        self.leave_block()
+        self.emit(LOOP_EXIT_CHECK)
+        self.emit("    break")
+        self.level -= 1
+        self.emit("LS.pop()")
+
+    def visit_For(self, node):
+        iterable = self.visit(node.iterable)
+        iter = self.name('i')
+        item = self.name('x')
+        loop = self.name('l')
+        scope = self.name('s')
+        self.emit(f"{iter} = range({iterable}) if isinstance({iterable}, int) else {iterable}")
+        self.forget_invariants(node)
+        self.emit(f"{loop} = Loop()")
+        self.emit(f"LS.append({loop})")
+        self.emit(f"{scope} = None")
+        self.emit("try:")
+        self.level += 1
+        self.emit(f"for {item} in {iter}:")
+        self.level += 1
+        self.emit(f"{loop}.continuing = False")
+        self.emit(f"if {scope} is None:")
+        self.level += 1
+        self.scoped_block("for-block", node.value)
+        self.emit(f"{scope} = rt.current_scope")
+        self.emit(f"{scope}._memory.append({item})")
+        self.level -= 1
+        self.emit("else:")
+        self.emit(f"    rt.reenter_loop_scope({scope}, {item})")
+        self.block(node.value)
+        self.leave_block()
+        self.emit(LOOP_EXIT_CHECK)
+        self.emit("    break")
+        self.level -= 2
+        self.emit("except TypeError:")
+        self.emit(f"    not_iterable(rt, {self.ref(node)}, {iter})")
+        self.emit("LS.pop()")
+
+    def forget_invariants(self, node):
+        if node.invariants:
+            self.emit(f"forget_invariants({self.ref(node)}.invariants)")
+
+    def visit_Invariant(self, node):
+        values = f"{self.ref(node)}.values"
+        result = self.name('t')
+        self.emit(f"{result} = {values}[{node.index}]")
+        self.emit(f"if {result} is MISSING:")
+        self.level += 1
+        self.emit(f"{result} = {self.visit(node.expr)}")
+        self.emit(f"if type({result}) in INVARIANT_VALUE_TYPES:")
+        self.emit(f"    {values}[{node.index}] = {result}")
+        self.level -= 1
+        return result
+
+    def visit_Return(self, node):
+        if node.tail_call is not None:
+            value = self.tail_call(node)
+        else:
+            value = self.visit(node.expr)
+        self.emit(f"FS[-1].set_return_value({value})")
+
+    def tail_call(self, node):
+        # As visit_VarGet, except that a function is left for the caller to call
+        call = node.expr
+        var = self.name('v')
+        result = self.name('t')
+        self.load(call, var)
+        self.emit("rt.current_python_module = builtins")
+        self.emit("rt.leave_module_scope()")
+        self.emit(f"if type({var}) in CALLABLE_TYPES:")
+        self.level += 1
+        args = [self.visit(arg) for arg in call.args]
+        self.emit(f"if type({var}) is FunctionData:")
+        self.emit(f"    rt.prepare_tail_call({self.ref(node)}, {var}, [{', '.join(args)}])")
+        self.emit(f"    {result} = None")
+        self.emit("else:")
+        self.emit(f"    {result} = call_var(rt, {self.ref(call)}, {var}, [{', '.join(args)}])")
+        self.level -= 1
+        self.emit("else:")
+        self.emit(f"    {result} = {var}")
+        return result
+
+    def visit_Break(self, node):
+        self.emit("LS[-1].breaking = True")
+
+    def visit_Continue(self, node):
+        self.emit("LS[-1].continuing = True")
+
+    def visit_BuiltInFunction(self, node):
+        result = self.name('t')
+        if node.from_python:
+            function = self.name('f')
+            self.emit(f"{function} = getattr(rt.current_python_module, {node.name!r})")
+        else:
+            function = node.built_in.function.__name__
+        self.emit("rt.current_python_module = builtins")
+        if node.ref:
+            return function
+        args = [self.visit(arg) for arg in node.args]
+        call_args = ', '.join(args) if node.from_python else ', '.join([f"rt, {self.ref(node)}.token"] + args)
+        self.emit("try:")
+        self.emit(f"    {result} = {function}({call_args})")
+        self.emit("except TypeError as e:")
+        self.emit(f"    wrong_params(rt, {self.ref(node)}, {function}, [{', '.join(args)}], e)")
+        return result
+
+    def visit_GetAttr(self, node):
+        result = self.name('t')
+        self.emit("try:")
+        self.emit(f"    {result} = getattr(rt.current_python_module, {node.name!r})")
+        self.emit("except:")
+        self.emit(f"    invalid_attribute(rt, {self.ref(node)})")
+        return result
+
+
+def code_path(file_path):
+    directory, file_name = os.path.split(file_path)
+    return os.path.join(directory, ast_cache.CACHE_DIR, file_name + '.pyc')
+
+
+def code_key(hash, optimized):
+    # Generated code refers to nodes by position, so it only fits a tree rewritten the same way
+    return ast_cache.cache_key(hash) + (TRANSPILER_VERSION, importlib.util.MAGIC_NUMBER, optimized)
+
+
+def load_code(file_path, hash, optimized=None):
+    """Returns the compiled module cached for file_path, or None if there is no valid entry."""
+    try:
+        with open(code_path(file_path), 'rb') as file:
+            if pickle.load(file) != code_key(hash, optimized):
+                return None
+            return marshal.load(file)
+    except Exception:
+        return None
+
+
+def store_code(file_path, hash, code, optimized=None):
+    path = code_path(file_path)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            pickle.dump(code_key(hash, optimized), file, pickle.HIGHEST_PROTOCOL)
+            marshal.dump(code, file)
+        os.replace(temp_path, path)
+    except (OSError, ValueError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+class TranspiledInterpreter(VirtualMachine):
+    """Runs each Program as the Python module the Transpiler writes for it.
+
+    Compiled modules are cached in __cscache__ next to their script, keyed by the script's hash.
+    A program Python can't compile, such as one nesting more blocks than Python allows, is run
+    by the VirtualMachine instead, as is anything visited that isn't one of the generated units.
+    """
+    # The generated functions take the interpreter as an argument, so every instance can share them
+    units = {}
+
+    def visit(self, node):
+        unit = TranspiledInterpreter.units.get(node)
+        if unit is None:
+            if isinstance(node, Program) and node not in TranspiledInterpreter.units:
+                self.load_program(node)
+                unit = TranspiledInterpreter.units.get(node)
+            if unit is None:
+                return super(TranspiledInterpreter, self).visit(node)
+        return unit(self)
+
+    def load_program(self, program):
+        file_path = next((path for path, node in Parser.imported_files.items() if node is program), None)
+        hash = None
+        if file_path:
+            try:
+                hash = ast_cache.source_hash(file_path)
+            except OSError:
+                pass
+        code = load_code(file_path, hash, program.optimized) if hash else None
+        if code is None:
+            try:
+                code = compile(Transpiler(program).generate(), f"<transpiled {file_path or 'program'}>", 'exec')
+            except (SyntaxError, RecursionError, MemoryError, ValueError):
+                TranspiledInterpreter.units[program] = None
+                return
+            if hash:
+                store_code(file_path, hash, code, program.optimized)
+
+        nodes = preorder(program)
+        namespace = dict(GENERATED_GLOBALS, N=nodes)
+        exec(code, namespace)
+        for index in namespace['UNITS']:
+            TranspiledInterpreter.units[nodes[index]] = namespace[f"u{index}"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print("Unspecified file")
+    else:
+        file_path = sys.argv[1]
+        try:
+            tree = Parser.parse_file(file_path)
+            SemanticAnalyzer(file_path).visit(tree)
+        except (ParserError, LexerError, SemanticError) as e:
+            print(e.message)
+            sys.exit(1)
+        print(Transpiler(tree).generate())
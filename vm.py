@@ -0,0 +1,902 @@
+import operator
+from types import FunctionType, ModuleType
+
+from interpreter import *
+
+
+# Opcodes, roughly ordered by how often they run
+LOAD_VAR = 0           # node: VarGet without arguments, indexer or ~
+LOAD_CONST = 1         # value
+BINARY = 2             # (function, node)
+STORE_VAR = 3          # node: VarSet
+CHECK_EXIT = 4         # target: leave the statement list after a return, break or continue
+JUMP_IF_FALSE = 5      # target
+JUMP = 6               # target
+ENTER_SCOPE = 7        # scope name
+LEAVE_SCOPE = 8
+GET_VAR = 9            # [node, index target, end target]: any other VarGet
+CALL_VAR = 10          # (node, argument count)
+INDEX_VAR = 11         # node
+CALL_BUILTIN = 12      # (node, argument count): a CommaScript built-in
+DECLARE = 13           # node: VarDecl of an expression
+DECLARE_FUNCTION = 14  # node: VarDecl of a statement list
+DECLARE_MACRO = 15     # node
+POP = 16
+FOR_SETUP = 17         # node
+FOR_NEXT = 18          # target
+FOR_END = 19
+PUSH_LOOP = 20
+LOOP_START = 21
+LOOP_EXIT_CHECK = 22   # target
+POP_LOOP = 23
+RETURN_VALUE = 24      # target
+BREAK = 25             # target
+CONTINUE = 26          # target
+UNARY = 27             # node
+NOT = 28
+BUILD_LIST = 29        # count
+BUILD_TUPLE = 30       # count
+BUILD_DICT = 31        # count of pairs
+BUILD_STRING = 32      # count
+LOAD_BUILTIN = 33      # node: ~ of a CommaScript built-in
+PREPARE_PYTHON = 34    # (node, end target): look up a python function
+CALL_PYTHON = 35       # (node, argument count)
+GET_ATTR = 36          # node
+MACRO_VAR_GET = 37     # [node, index target, end target]
+MACRO_INDEX = 38       # node
+MODULE_ENTER = 39      # node
+MODULE_LEAVE = 40
+IMPORT = 41            # node
+OPEN_FILE = 42         # node
+PUSH_SCOPE = 43
+REUSE_SCOPE = 44        # (scope name, statement list): a block that declares nothing
+TAIL_CALL = 45          # node: Return of a call in tail position
+JUMP_IF_FALSE_OR_POP = 46  # target: & keeps a false left hand side as its value
+JUMP_IF_TRUE_OR_POP = 47   # target: | keeps a true left hand side as its value
+LOAD_INVARIANT = 48     # [node, end target]: skips computing an Invariant it already has the value of
+STORE_INVARIANT = 49    # node
+FORGET_INVARIANTS = 50  # values: a loop's Invariants, when it starts
+SET_MACRO_VARIABLES = 51    # count: the arguments of an Expansion
+CLEAR_MACRO_VARIABLES = 52
+
+OP_NAMES = {value: name for name, value in list(globals().items())
+            if name.isupper() and isinstance(value, int)}
+
+BINARY_OPERATORS = {
+    TokenType.PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.MUL: operator.mul,
+    TokenType.EXPO: operator.pow,
+    TokenType.INT_DIV: operator.floordiv,
+    TokenType.FLOAT_DIV: operator.truediv,
+    TokenType.MOD: operator.mod,
+    TokenType.EQUAL: operator.eq,
+    TokenType.NOT_EQUAL: operator.ne,
+    TokenType.LTHAN: operator.lt,
+    TokenType.GTHAN: operator.gt,
+    TokenType.LTHAN_OR_EQUAL: operator.le,
+    TokenType.GTHAN_OR_EQUAL: operator.ge,
+}
+
+# Nodes that only run for their effect and leave nothing on the stack
+STATEMENT_NODES = (VarDecl, VarSet, MacroDecl, Import, OpenFile, If, While, For, NoOp)
+
+
+def child_nodes(node):
+    for name in type(node).__slots__:
+        value = getattr(node, name)
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            yield from (child for child in value if isinstance(child, AST))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                yield key
+                yield item
+
+
+def can_exit(node):
+    """Whether running node could return, break or continue out of the statement list holding it."""
+    if isinstance(node, (VarGet, ModuleGet, BuiltInFunction, Import, OpenFile, Return, Break, Continue)):
+        return True
+    # Declaring a function or macro doesn't run its body or its default values
+    if isinstance(node, MacroDecl) or isinstance(node, VarDecl) and isinstance(node.value, StatementList):
+        return False
+    return any(can_exit(child) for child in child_nodes(node))
+
+
+class Code():
+    __slots__ = ('ops', 'args')
+
+    def __init__(self):
+        self.ops = []
+        self.args = []
+
+    def __str__(self):
+        lines = []
+        for index, (op, arg) in enumerate(zip(self.ops, self.args)):
+            if isinstance(arg, (list, tuple)):
+                arg = ', '.join(type(item).__name__ if isinstance(item, AST) else str(item) for item in arg)
+            elif isinstance(arg, AST):
+                arg = type(arg).__name__
+            lines.append(f"{index:>5} {OP_NAMES[op]:<17}{'' if arg is None else arg}")
+        return '\n'.join(lines)
+
+    __repr__ = __str__
+
+
+class Compiler(NodeVisitor):
+    """Compiles an analyzed tree into the flat bytecode the VirtualMachine runs.
+
+    Every expression leaves its value on the stack, statements leave nothing. Statement lists
+    are compiled inline into the code of the function, macro or program they belong to, with
+    the same checks after each statement that Interpreter.visit_StatementList makes.
+    """
+
+    def compile(self, node):
+        self.code = Code()
+        self.visit(node)
+        return self.code
+
+    def emit(self, op, arg=None):
+        self.code.ops.append(op)
+        self.code.args.append(arg)
+        return len(self.code.ops) - 1
+
+    def here(self):
+        return len(self.code.ops)
+
+    def patch(self, indexes, target):
+        for index in indexes:
+            self.code.args[index] = target
+
+    def enter_block(self, scope_name, block):
+        if block.declares:
+            self.emit(ENTER_SCOPE, scope_name)
+        else:
+            self.emit(REUSE_SCOPE, (scope_name, block))
+
+    def visit_Program(self, node):
+        self.emit(ENTER_SCOPE, "global")
+        self.visit(node.statement_list_node)
+        self.emit(PUSH_SCOPE)
+        self.emit(LEAVE_SCOPE)
+
+    def visit_StatementList(self, node):
+        exits = []
+        for index, child in enumerate(node.children):
+            if isinstance(child, Return):
+                if child.tail_call is not None:
+                    self.tail_call(child)
+                else:
+                    self.visit(child.expr)
+                exits.append(self.emit(RETURN_VALUE))
+                break
+            if isinstance(child, Break):
+                exits.append(self.emit(BREAK))
+                break
+            if isinstance(child, Continue):
+                exits.append(self.emit(CONTINUE))
+                break
+            self.visit(child)
+            if not isinstance(child, STATEMENT_NODES):
+                self.emit(POP)
+            if node.exits and index < len(node.children) - 1 and can_exit(child):
+                exits.append(self.emit(CHECK_EXIT))
+        self.patch(exits, self.here())
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        if node.short_circuit:
+            skip = self.emit(JUMP_IF_FALSE_OR_POP if node.op.type == TokenType.AND else JUMP_IF_TRUE_OR_POP)
+            self.visit(node.right)
+            self.patch([skip], self.here())
+            return
+        self.visit(node.right)
+        self.emit(BINARY, (BINARY_OPERATORS[node.op.type], node))
+
+    def visit_Const(self, node):
+        self.emit(LOAD_CONST, node.value)
+
+    def visit_Null(self, node):
+        self.emit(LOAD_CONST, None)
+
+    def visit_NoneType(self, node):
+        self.emit(LOAD_CONST, None)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def visit_FString(self, node):
+        for portion in node.portions:
+            self.visit(portion)
+        self.emit(BUILD_STRING, len(node.portions))
+
+    def visit_List(self, node):
+        for element in node.value:
+            self.visit(element)
+        self.emit(BUILD_LIST, len(node.value))
+
+    def visit_Tuple(self, node):
+        for element in node.value:
+            self.visit(element)
+        self.emit(BUILD_TUPLE, len(node.value))
+
+    def visit_Dict(self, node):
+        for key, value in node.value.items():
+            self.visit(key)
+            self.visit(value)
+        self.emit(BUILD_DICT, len(node.value))
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        self.emit(UNARY, node)
+
+    def visit_Not(self, node):
+        self.visit(node.value)
+        self.emit(NOT)
+
+    def visit_VarDecl(self, node):
+        if isinstance(node.value, StatementList):
+            self.emit(DECLARE_FUNCTION, node)
+        else:
+            self.visit(node.value)
+            self.emit(DECLARE, node)
+
+    def visit_VarSet(self, node):
+        self.visit(node.value)
+        self.emit(STORE_VAR, node)
+
+    def visit_VarGet(self, node):
+        if not node.ref and not node.args and not node.indexer:
+            self.emit(LOAD_VAR, node)
+            return
+        # Arguments are only evaluated for whatever turns out to be callable, and the
+        # indexer only for something that can be indexed, so GET_VAR picks where to go
+        targets = [node, None, None]
+        self.emit(GET_VAR, targets)
+        for arg in node.args:
+            self.visit(arg)
+        self.emit(CALL_VAR, (node, len(node.args)))
+        if node.indexer:
+            end = self.emit(JUMP)
+            targets[1] = self.here()
+            self.visit(node.indexer)
+            self.emit(INDEX_VAR, node)
+            self.patch([end], self.here())
+        targets[2] = self.here()
+
+    def tail_call(self, node):
+        # As visit_VarGet, except that a function is left for the caller to call
+        call = node.expr
+        targets = [call, None, None]
+        self.emit(GET_VAR, targets)
+        for arg in call.args:
+            self.visit(arg)
+        self.emit(TAIL_CALL, node)
+        targets[2] = self.here()
+
+    def visit_MacroDecl(self, node):
+        self.emit(DECLARE_MACRO, node)
+
+    def visit_Expansion(self, node):
+        # The body is compiled inline, so a return, break or continue in it ends its own
+        # statement list and is then checked for by the caller's, as after a macro call
+        for arg in node.args:
+            self.visit(arg)
+        if node.args:
+            self.emit(SET_MACRO_VARIABLES, len(node.args))
+        self.visit(node.body)
+        if node.args:
+            self.emit(CLEAR_MACRO_VARIABLES)
+        self.emit(LOAD_CONST, None)
+
+    def visit_MacroVarGet(self, node):
+        targets = [node, None, None]
+        self.emit(MACRO_VAR_GET, targets)
+        if node.indexer:
+            targets[1] = self.here()
+            self.visit(node.indexer)
+            self.emit(MACRO_INDEX, node)
+        targets[2] = self.here()
+
+    def visit_Import(self, node):
+        self.emit(IMPORT, node)
+
+    def visit_ModuleGet(self, node):
+        self.emit(MODULE_ENTER, node)
+        self.visit(node.var_node)
+        self.emit(MODULE_LEAVE)
+
+    def visit_OpenFile(self, node):
+        self.emit(OPEN_FILE, node)
+
+    def visit_If(self, node):
+        self.visit(node.conditional)
+        otherwise = self.emit(JUMP_IF_FALSE)
+        self.enter_block("if-block", node.value)
+        self.visit(node.value)
+        self.emit(LEAVE_SCOPE)
+        if node.else_value:
+            end = self.emit(JUMP)
+            self.patch([otherwise], self.here())
+            if isinstance(node.else_value, If):
+                self.visit(node.else_value)
+            else:
+                self.enter_block("else-block", node.else_value)
+                self.visit(node.else_value)
+                self.emit(LEAVE_SCOPE)
+            self.patch([end], self.here())
+        else:
+            self.patch([otherwise], self.here())
+
+    def visit_While(self, node):
+        if node.invariants:
+            self.emit(FORGET_INVARIANTS, node.invariants)
+        self.emit(PUSH_LOOP)
+        top = self.here()
+        self.visit(node.conditional)
+        done = self.emit(JUMP_IF_FALSE)
+        self.emit(LOOP_START)
+        self.enter_block("while-block", node.value)
+        self.visit(node.value)
+        self.emit(LEAVE_SCOPE)
+        stop = self.emit(LOOP_EXIT_CHECK)
+        self.emit(JUMP, top)
+        self.patch([done, stop], self.here())
+        self.emit(POP_LOOP)
+
+    def visit_For(self, node):
+        self.visit(node.iterable)
+        if node.invariants:
+            self.emit(FORGET_INVARIANTS, node.invariants)
+        self.emit(FOR_SETUP, node)
+        top = self.here()
+        done = self.emit(FOR_NEXT)
+        self.visit(node.value)
+        self.emit(LEAVE_SCOPE)
+        stop = self.emit(LOOP_EXIT_CHECK)
+        self.emit(JUMP, top)
+        self.patch([done, stop], self.here())
+        self.emit(FOR_END)
+
+    def visit_Invariant(self, node):
+        targets = [node, None]
+        self.emit(LOAD_INVARIANT, targets)
+        self.visit(node.expr)
+        self.emit(STORE_INVARIANT, node)
+        targets[1] = self.here()
+
+    def visit_Return(self, node):
+        # Only reachable outside of a statement list, which the parser never produces
+        self.visit(node.expr)
+
+    def visit_Break(self, node):
+        self.emit(LOAD_CONST, None)
+
+    def visit_Continue(self, node):
+        self.emit(LOAD_CONST, None)
+
+    def visit_BuiltInFunction(self, node):
+        if not node.from_python:
+            if node.ref:
+                self.emit(LOAD_BUILTIN, node)
+                return
+            for arg in node.args:
+                self.visit(arg)
+            self.emit(CALL_BUILTIN, (node, len(node.args)))
+            return
+        targets = [node, None]
+        self.emit(PREPARE_PYTHON, targets)
+        if not node.ref:
+            for arg in node.args:
+                self.visit(arg)
+            self.emit(CALL_PYTHON, (node, len(node.args)))
+        targets[1] = self.here()
+
+    def visit_GetAttr(self, node):
+        self.emit(GET_ATTR, node)
+
+
+class VirtualMachine(Interpreter):
+    """Runs CommaScript by compiling each program, function and macro body into bytecode.
+
+    It keeps all of the Interpreter's state, scopes and quirks, so anything it doesn't compile
+    itself, like imports, opened files and functions passed to built-ins, goes through the
+    Interpreter's own methods, which call back into visit and so into compiled code.
+
+    Functions and macros called from compiled code run in the same run loop, with the code
+    that called them waiting in a list of frames, so how deeply CommaScript calls can nest is
+    only limited by memory, or by max_depth.
+    """
+    # Code only refers to the nodes it was compiled from, so every VirtualMachine can share it
+    codes = {}
+
+    def __init__(self, file_path, display_debug_messages=False, max_depth=None, memo_size=None):
+        super(VirtualMachine, self).__init__(file_path, display_debug_messages, max_depth, memo_size)
+        self.compiler = Compiler()
+
+    def visit(self, node):
+        return self.run(self.compiled(node))
+
+    def compiled(self, node):
+        code = VirtualMachine.codes.get(node)
+        if code is None:
+            code = VirtualMachine.codes[node] = self.compiler.compile(node)
+        return code
+
+    def run(self, code):
+        ops = code.ops
+        args = code.args
+        end = len(ops)
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # (token, iterable) of each for loop running in this code, whose TypeErrors it reports
+        for_stack = []
+        pc = 0
+        # (ops, args, end, pc, stack, for_stack, running) of the code waiting on each call below it
+        frames = []
+        # The Function whose body is running, None for a macro's body or the code run was given
+        running = None
+        try:
+            while True:
+                # Set, along with callee, by an op calling a function or macro
+                body = None
+                while pc < end:
+                    op = ops[pc]
+                    arg = args[pc]
+                    pc += 1
+
+                    if op == LOAD_VAR:
+                        if self.current_python_module != builtins:
+                            self.error(ErrorCode.INVALID_VARIABLE, arg.token,
+                                       f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
+                        access = arg.access
+                        if access:
+                            var = self.current_scope.load(access.distance, access.slot)
+                        else:
+                            var = self.current_scope.get(arg.scope_depth, arg.mem_loc)
+                        if var is MISSING:
+                            self.error(ErrorCode.VARIABLE_MISSING, arg.token,
+                                       f'm{"."*arg.scope_depth}{arg.mem_loc} seems to have been lost in the darkness that is CommaScript.')
+                        self.current_python_module = builtins
+                        if self.in_module_temps:
+                            self.leave_module_scope()
+                        var_type = type(var)
+                        if var_type is FunctionData:
+                            arg_values = []
+                            if var.default_param_vals:
+                                self.add_default_args(arg, var, arg_values)
+                            memo = None
+                            if self.memo_size is not None:
+                                result, memo = self.memoized(arg, var, arg_values)
+                                if result is not MISSING:
+                                    push(result)
+                                    continue
+                            callee = self.enter_function(arg, var, arg_values, memo)
+                            body = var.value
+                            break
+                        elif var_type is MacroData:
+                            callee = None
+                            self.enter_macro(var, [])
+                            body = var.value
+                            break
+                        else:
+                            push(var(self, arg.token) if var_type is FunctionType else var)
+
+                    elif op == LOAD_CONST:
+                        push(arg)
+
+                    elif op == BINARY:
+                        right = pop()
+                        left = pop()
+                        try:
+                            push(arg[0](left, right))
+                        except:
+                            self.error(ErrorCode.TYPE_ERROR, arg[1].token,
+                                       f"'{arg[1].op.value}' not supported between instances of '{type(left).__name__}' and '{type(right).__name__}'")
+
+                    elif op == STORE_VAR:
+                        value = pop()
+                        if arg.access:
+                            types = self.current_scope.store(arg.access.distance, arg.access.slot, value, arg.add_mode)
+                        else:
+                            types = self.current_scope.set(arg.scope_depth, arg.mem_loc, value, arg.add_mode)
+                        if types:
+                            self.error(ErrorCode.TYPE_ERROR, arg.token,
+                                       f"'+' not supported between instances of '{types[0].__name__}' and '{types[1].__name__}'")
+
+                    elif op == CHECK_EXIT:
+                        function_stack = self.function_stack
+                        loop_stack = self.loop_stack
+                        if (function_stack and function_stack[-1].has_return_value or
+                                loop_stack and (loop_stack[-1].breaking or loop_stack[-1].continuing)):
+                            pc = arg
+
+                    elif op == JUMP_IF_FALSE:
+                        if not pop():
+                            pc = arg
+
+                    elif op == JUMP:
+                        pc = arg
+
+                    elif op == JUMP_IF_FALSE_OR_POP:
+                        if stack[-1]:
+                            pop()
+                        else:
+                            pc = arg
+
+                    elif op == JUMP_IF_TRUE_OR_POP:
+                        if stack[-1]:
+                            pc = arg
+                        else:
+                            pop()
+
+                    elif op == LOAD_INVARIANT:
+                        node = arg[0]
+                        value = node.values[node.index]
+                        if value is not MISSING:
+                            push(value)
+                            pc = arg[1]
+
+                    elif op == STORE_INVARIANT:
+                        if type(stack[-1]) in INVARIANT_VALUE_TYPES:
+                            arg.values[arg.index] = stack[-1]
+
+                    elif op == ENTER_SCOPE:
+                        scope = self.current_scope
+                        self.current_scope = Memory(self.current_file_path, arg,
+                                                    scope.scope_level + 1 if scope else 1, scope, scope)
+
+                    elif op == LEAVE_SCOPE:
+                        self.current_scope = self.current_scope.scope_to_return_to
+
+                    elif op == REUSE_SCOPE:
+                        self.enter_block_scope(*arg)
+
+                    elif op == GET_VAR:
+                        node = arg[0]
+                        if self.current_python_module != builtins:
+                            self.error(ErrorCode.INVALID_VARIABLE, node.token,
+                                       f'A CommaScript memory getter cannot be used to get variables/functions from a python module')
+                        if node.access:
+                            var = self.current_scope.load(node.access.distance, node.access.slot)
+                        else:
+                            var = self.current_scope.get(node.scope_depth, node.mem_loc)
+                        if var is MISSING:
+                            self.error(ErrorCode.VARIABLE_MISSING, node.token,
+                                       f'm{"."*node.scope_depth}{node.mem_loc} seems to have been lost in the darkness that is CommaScript.')
+                        value = var.value if isinstance(var, (FunctionData, MacroData)) else var
+                        self.current_python_module = builtins
+                        self.leave_module_scope()
+                        if node.ref:
+                            push(value)
+                            pc = arg[2]
+                        elif isinstance(var, (FunctionData, MacroData)) or isinstance(value, FunctionType):
+                            push(var)
+                        elif node.indexer and isinstance(value, (list, tuple, str, dict)):
+                            push(value)
+                            pc = arg[1]
+                        elif node.indexer:
+                            self.error(ErrorCode.INVALID_INDEXER, node.token,
+                                       f"'{type(value).__name__}' does not support the use of indexers.")
+                        else:
+                            push(value)
+                            pc = arg[2]
+
+                    elif op == CALL_VAR:
+                        node, count = arg
+                        arg_values = stack[len(stack) - count:]
+                        del stack[len(stack) - count:]
+                        var = pop()
+                        if isinstance(var, FunctionData):
+                            if var.default_param_vals:
+                                self.add_default_args(node, var, arg_values)
+                            memo = None
+                            if self.memo_size is not None:
+                                result, memo = self.memoized(node, var, arg_values)
+                                if result is not MISSING:
+                                    push(result)
+                                    continue
+                            callee = self.enter_function(node, var, arg_values, memo)
+                            body = var.value
+                            break
+                        elif isinstance(var, MacroData):
+                            callee = None
+                            self.enter_macro(var, arg_values)
+                            body = var.value
+                            break
+                        else:
+                            push(var(self, node.token, *arg_values))
+
+                    elif op == TAIL_CALL:
+                        call = arg.expr
+                        count = len(call.args)
+                        arg_values = stack[len(stack) - count:]
+                        del stack[len(stack) - count:]
+                        var = pop()
+                        if isinstance(var, FunctionData):
+                            self.prepare_tail_call(arg, var, arg_values)
+                            push(None)
+                        elif isinstance(var, MacroData):
+                            callee = None
+                            self.enter_macro(var, arg_values)
+                            body = var.value
+                            break
+                        else:
+                            push(var(self, call.token, *arg_values))
+
+                    elif op == INDEX_VAR:
+                        index = pop()
+                        value = pop()
+                        if isinstance(value, dict):
+                            if index not in value:
+                                self.error(ErrorCode.INDEX_ERROR, token=arg.token,
+                                           message=f"{index} does not exist in the given dictionary")
+                        else:
+                            val_len = len(value)
+                            if not isinstance(index, int) or index < -val_len or index >= val_len:
+                                self.error(ErrorCode.INDEX_ERROR, token=arg.token,
+                                           message=f"{index} is out of range of the given {type(value).__name__}")
+                        push(value[index])
+
+                    elif op == CALL_BUILTIN:
+                        node, count = arg
+                        arg_values = stack[len(stack) - count:]
+                        del stack[len(stack) - count:]
+                        function = node.built_in.function
+                        self.current_python_module = builtins
+                        try:
+                            push(function(self, node.token, *arg_values))
+                        except TypeError as e:
+                            self.log(e)
+                            self.error(ErrorCode.WRONG_PARAMS_NUM, node.token,
+                                       f"{node.name}<> takes {len(signature(function).parameters) - 2} arguments but {len(arg_values)} were given")
+
+                    elif op == DECLARE:
+                        value = pop()
+                        if isinstance(value, StatementList):
+                            value = FunctionData(arg.params_num, arg.default_param_vals, arg.value)
+                        self.current_scope._memory.append(value)
+
+                    elif op == DECLARE_FUNCTION:
+                        self.current_scope._memory.append(
+                            FunctionData(arg.params_num, arg.default_param_vals, arg.value))
+
+                    elif op == DECLARE_MACRO:
+                        self.current_scope._memory.append(
+                            MacroData(arg.params_num, arg.default_param_vals, arg.value))
+
+                    elif op == POP:
+                        pop()
+
+                    elif op == FOR_SETUP:
+                        iterable = pop()
+                        iterable = range(iterable) if isinstance(iterable, int) else iterable
+                        self.loop_stack.append(Loop())
+                        # token, iterable, then the loop's scope once the first item is in
+                        for_stack.append([arg.token, iterable, None])
+                        push(iter(iterable))
+
+                    elif op == FOR_NEXT:
+                        try:
+                            item = next(stack[-1])
+                        except StopIteration:
+                            pc = arg
+                            continue
+                        self.loop_stack[-1].continuing = False
+                        loop = for_stack[-1]
+                        if loop[2] is None:
+                            scope = self.current_scope
+                            self.current_scope = loop[2] = Memory(self.current_file_path, "for-block",
+                                                                  scope.scope_level + 1 if scope else 1, scope, scope)
+                            self.current_scope._memory.append(item)
+                        else:
+                            self.reenter_loop_scope(loop[2], item)
+
+                    elif op == FOR_END:
+                        pop()
+                        for_stack.pop()
+                        self.loop_stack.pop()
+
+                    elif op == PUSH_LOOP:
+                        self.loop_stack.append(Loop())
+
+                    elif op == LOOP_START:
+                        self.loop_stack[-1].continuing = False
+
+                    elif op == LOOP_EXIT_CHECK:
+                        if (self.function_stack and self.function_stack[-1].has_return_value or
+                                self.loop_stack and self.loop_stack[-1].breaking):
+                            pc = arg
+
+                    elif op == POP_LOOP:
+                        self.loop_stack.pop()
+
+                    elif op == FORGET_INVARIANTS:
+                        forget_invariants(arg)
+
+                    elif op == RETURN_VALUE:
+                        self.function_stack[-1].set_return_value(pop())
+                        pc = arg
+
+                    elif op == BREAK:
+                        self.loop_stack[-1].breaking = True
+                        pc = arg
+
+                    elif op == CONTINUE:
+                        self.loop_stack[-1].continuing = True
+                        pc = arg
+
+                    elif op == UNARY:
+                        expr = pop()
+                        try:
+                            op_type = arg.op.type
+                            if op_type == TokenType.PLUS:
+                                push(expr)
+                            elif op_type == TokenType.MINUS:
+                                push(-expr)
+                            else:
+                                push(None)
+                        except:
+                            self.error(ErrorCode.TYPE_ERROR, arg.token,
+                                       f"Unary '{arg.op.value}' not supported for instances of type '{type(expr).__name__}'")
+
+                    elif op == NOT:
+                        push(not pop())
+
+                    elif op == BUILD_LIST:
+                        value = stack[len(stack) - arg:]
+                        del stack[len(stack) - arg:]
+                        push(value)
+
+                    elif op == BUILD_TUPLE:
+                        value = tuple(stack[len(stack) - arg:])
+                        del stack[len(stack) - arg:]
+                        push(value)
+
+                    elif op == BUILD_DICT:
+                        items = stack[len(stack) - 2 * arg:]
+                        del stack[len(stack) - 2 * arg:]
+                        push({items[index]: items[index + 1] for index in range(0, len(items), 2)})
+
+                    elif op == BUILD_STRING:
+                        portions = stack[len(stack) - arg:]
+                        del stack[len(stack) - arg:]
+                        push("".join([str(portion) for portion in portions]))
+
+                    elif op == LOAD_BUILTIN:
+                        self.current_python_module = builtins
+                        push(arg.built_in.function)
+
+                    elif op == PREPARE_PYTHON:
+                        node = arg[0]
+                        push(getattr(self.current_python_module, node.name))
+                        self.current_python_module = builtins
+                        if node.ref:
+                            pc = arg[1]
+
+                    elif op == CALL_PYTHON:
+                        node, count = arg
+                        arg_values = stack[len(stack) - count:]
+                        del stack[len(stack) - count:]
+                        function = pop()
+                        try:
+                            push(function(*arg_values))
+                        except TypeError as e:
+                            self.log(e)
+                            self.error(ErrorCode.WRONG_PARAMS_NUM, node.token,
+                                       f"{node.name}<> takes {len(signature(function).parameters) - 2} arguments but {len(arg_values)} were given")
+
+                    elif op == GET_ATTR:
+                        try:
+                            push(getattr(self.current_python_module, arg.name))
+                        except:
+                            self.error(ErrorCode.INVALID_VARIABLE, arg.token,
+                                       f"'{self.current_python_module}' has no attribute '{arg.name}'")
+
+                    elif op == MACRO_VAR_GET:
+                        node = arg[0]
+                        value = self.current_macro_variables[node.mem_loc]
+                        push(value)
+                        if node.indexer and isinstance(value, (list, tuple, dict)):
+                            pc = arg[1]
+                        elif node.indexer:
+                            self.error(ErrorCode.INVALID_INDEXER, node.token,
+                                       f"'{type(value).__name__}' does not support the use of indexers.")
+                        else:
+                            pc = arg[2]
+
+                    elif op == SET_MACRO_VARIABLES:
+                        self.current_macro_variables = stack[len(stack) - arg:]
+                        del stack[len(stack) - arg:]
+
+                    elif op == CLEAR_MACRO_VARIABLES:
+                        self.current_macro_variables = None
+
+                    elif op == MACRO_INDEX:
+                        index = pop()
+                        value = pop()
+                        if isinstance(value, dict):
+                            if index not in value:
+                                self.error(ErrorCode.INDEX_ERROR, token=arg.token,
+                                           message=f"{index} does not exist in the given dictionary")
+                        else:
+                            val_len = len(value)
+                            if not isinstance(index, int) or index < -val_len or index >= val_len:
+                                self.error(ErrorCode.INDEX_ERROR, token=arg.token,
+                                           message=f"{index} is out of range of the given {type(value).__name__}")
+                        push(value[index])
+
+                    elif op == MODULE_ENTER:
+                        if arg.access:
+                            module = self.current_scope.load_imported_scope(arg.access.distance, arg.access.slot)
+                        else:
+                            module = self.current_scope.get_imported_scope(arg.scope_depth, arg.mem_loc)
+                        if type(module) is ModuleType:
+                            self.current_python_module = module
+                            push(True)
+                        else:
+                            self.enter_module_scope(module)
+                            push(False)
+
+                    elif op == MODULE_LEAVE:
+                        value = pop()
+                        if pop():
+                            self.current_python_module = builtins
+                        else:
+                            self.leave_module_scope()
+                        push(value)
+
+                    elif op == IMPORT:
+                        self.visit_Import(arg)
+
+                    elif op == OPEN_FILE:
+                        self.visit_OpenFile(arg)
+
+                    elif op == PUSH_SCOPE:
+                        push(self.current_scope)
+
+                    else:
+                        raise Exception(f'Unknown opcode {op}')
+
+                if body is not None:
+                    frames.append((ops, args, end, pc, stack, for_stack, running))
+                    running = callee
+                elif not frames:
+                    break
+                elif running is not None and running.tail_call:
+                    body = self.enter_tail_call(running)
+                else:
+                    # The body of the function or macro called has run to its end
+                    if running is None:
+                        self.current_macro_variables = None
+                        value = None
+                    else:
+                        self.leave_function_scope()
+                        self.function_stack.pop()
+                        value = running.return_value
+                        if running.memo:
+                            running.memo[0].put(running.memo[1], value)
+                    ops, args, end, pc, stack, for_stack, running = frames.pop()
+                    stack.append(value)
+                if body is not None:
+                    code = self.compiled(body)
+                    ops = code.ops
+                    args = code.args
+                    end = len(ops)
+                    pc = 0
+                    stack = []
+                    for_stack = []
+                push = stack.append
+                pop = stack.pop
+        except TypeError:
+            # A for loop reports any TypeError raised while it runs, as Interpreter.visit_For does,
+            # including one raised in a function or macro it called
+            for loops in [for_stack] + [frame[5] for frame in reversed(frames)]:
+                if loops:
+                    token, iterable = loops[-1][:2]
+                    self.error(ErrorCode.TYPE_ERROR, token, f"'{type(iterable).__name__}' is not iterable")
+            raise
+        return stack[-1] if stack else None